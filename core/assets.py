@@ -0,0 +1,179 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: fingerprinted static files built by buildassets, theme css rendered
+    once and MEDIA_ROOT copied to STATIC_ROOT under names with a content
+    hash, so they can be served with far-future cache headers
+"""
+
+import gzip
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.template import Context
+from django.template.loader import get_template
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+
+MANIFEST_NAME = 'manifest.json'
+
+""" text files only, images are compressed already """
+GZIP_EXTENSIONS = ('.css', '.js', '.svg', '.ico', '.txt',)
+
+""" css files of the theme are templates themselves, see urls.py """
+CSS_DIR = 'css'
+
+_css_url_regex = re.compile(r'url\(([\'"]?)%s([^\'")]+)\1\)' %
+    re.escape(settings.MEDIA_URL))
+
+
+def _hashed_name(name, content):
+    root, ext = os.path.splitext(name)
+    return '%s.%s%s' % (root, md5_constructor(content).hexdigest()[:12], ext)
+
+
+class AssetBuilder(object):
+    """
+    Writes fingerprinted copies of media files and rendered theme css to
+    root along with a manifest of logical name to hashed name, and gzip
+    copies of text files next to them (for gzip_static and the like)
+    """
+    
+    def __init__(self, root, url, media_root, media_url):
+        self.root = root
+        self.url = url
+        self.media_root = media_root
+        self.media_url = media_url
+        self.manifest = {}
+    
+    def build(self):
+        for name in self._media_names():
+            content = open(os.path.join(self.media_root, name), 'rb').read()
+            self._write(name, content)
+        """ after media, css urls point to hashed images """
+        for name in self._css_names():
+            self._write(name, self._render_css(name))
+        
+        manifest = open(os.path.join(self.root, MANIFEST_NAME), 'w')
+        try:
+            simplejson.dump(self.manifest, manifest, sort_keys=True, indent=1)
+        finally:
+            manifest.close()
+        return self.manifest
+    
+    def _media_names(self):
+        names = []
+        for path, dirs, files in os.walk(self.media_root):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in files:
+                if not name.startswith('.'):
+                    names.append(os.path.relpath(os.path.join(path, name),
+                        self.media_root).replace(os.sep, '/'))
+        return sorted(names)
+    
+    def _css_names(self):
+        """ theme directories come first and hide the same names below """
+        names = set()
+        for directory in settings.TEMPLATE_DIRS:
+            css_dir = os.path.join(directory, CSS_DIR)
+            if os.path.isdir(css_dir):
+                names.update('%s/%s' % (CSS_DIR, name)
+                    for name in os.listdir(css_dir) if name.endswith('.css'))
+        return sorted(names)
+    
+    def _render_css(self, name):
+        css = get_template(name).render(Context({
+            'MEDIA_URL': self.media_url})).encode('utf-8')
+        def hashed_url(match):
+            hashed = self.manifest.get(match.group(2))
+            if hashed is None:
+                return match.group(0)
+            return 'url(%s%s%s%s)' % (match.group(1), self.url, hashed,
+                match.group(1))
+        return _css_url_regex.sub(hashed_url, css)
+    
+    def _write(self, name, content):
+        hashed = _hashed_name(name, content)
+        path = os.path.join(self.root, *hashed.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if not os.path.exists(path):
+            temp = path + '.tmp'
+            open(temp, 'wb').write(content)
+            os.rename(temp, path)
+            if os.path.splitext(name)[1] in GZIP_EXTENSIONS:
+                self._write_gzip(path, content)
+        self.manifest[name] = hashed
+    
+    def _write_gzip(self, path, content):
+        temp = path + '.gz.tmp'
+        output = gzip.GzipFile(temp, 'wb', 9)
+        try:
+            output.write(content)
+        finally:
+            output.close()
+        if os.path.getsize(temp) < len(content):
+            os.rename(temp, path + '.gz')
+        else:
+            os.remove(temp)
+
+
+class AssetManifest(object):
+    """
+    Hashed names written by buildassets, read once per process. Names that
+    are not built are served the old way: css through urls.py templates,
+    everything else from MEDIA_URL.
+    """
+    
+    def __init__(self, root, url):
+        self.root = root
+        self.url = url
+        self._names = None
+        self._lock = threading.Lock()
+    
+    def load(self):
+        try:
+            manifest = open(os.path.join(self.root, MANIFEST_NAME))
+        except IOError:
+            names = {}
+        else:
+            try:
+                names = simplejson.load(manifest)
+            finally:
+                manifest.close()
+        self._lock.acquire()
+        try:
+            self._names = names
+        finally:
+            self._lock.release()
+    
+    def url_of(self, name):
+        if self._names is None:
+            self.load()
+        hashed = self._names.get(name)
+        if hashed is not None:
+            return self.url + hashed
+        if name.startswith(CSS_DIR + '/'):
+            return '/%s/' % name
+        return settings.MEDIA_URL + name
+
+
+manifest = AssetManifest(settings.STATIC_ROOT, settings.STATIC_URL)
@@ -0,0 +1,245 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: in-memory prefix index of usernames, tags and groups for the
+    mention autocomplete
+"""
+
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+
+""" ranges up to this long are ranked per lookup, longer ones are cached """
+_HEAVY = 1000
+
+""" cache top entries of heavy prefixes up to this long on load """
+_WARM_DEPTH = 2
+
+_SEPARATOR = u'\x00'
+_LAST = u'\uffff'
+
+
+def _key(name):
+    """ case-insensitive sort key that still tells names apart """
+    return u'%s%s%s' % (name.lower(), _SEPARATOR, name)
+
+
+def _stem(key):
+    return key.split(_SEPARATOR, 1)[0]
+
+
+def _name(key):
+    return key.split(_SEPARATOR, 1)[1]
+
+
+class PrefixIndex(object):
+    """
+    Names with weights kept in one case-insensitively sorted list, names
+    with a prefix are a bisect range of it. Best limit entries of ranges
+    longer than _HEAVY are cached and kept current on every change, so a
+    lookup never ranks more than _HEAVY entries.
+    """
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self._keys = []
+        self._weights = {}
+        self._ids = {}
+        self._top = {}
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def load(self, rows):
+        """ replace index with (id, name, weight) rows """
+        keys, weights, ids = [], {}, {}
+        for id, name, weight in rows:
+            key = _key(name)
+            keys.append(key)
+            weights[key] = weight
+            ids[id] = key
+        keys.sort()
+        
+        self._lock.acquire()
+        try:
+            self._keys, self._weights, self._ids = keys, weights, ids
+            self._top = {}
+            self._warm(u'', 0, len(keys))
+        finally:
+            self._lock.release()
+    
+    def _warm(self, prefix, lo, hi):
+        if hi - lo <= _HEAVY:
+            return
+        self._top[prefix] = self._rank(self._keys[lo:hi])
+        if len(prefix) == _WARM_DEPTH:
+            return
+        
+        i = lo
+        while i < hi:
+            stem = _stem(self._keys[i])
+            if len(stem) == len(prefix):
+                i += 1
+                continue
+            child = stem[:len(prefix) + 1]
+            j = bisect_left(self._keys, child + _LAST, i, hi)
+            self._warm(child, i, j)
+            i = j
+    
+    def _order(self, key):
+        return (-self._weights.get(key, 0), key)
+    
+    def _rank(self, keys):
+        return heapq.nsmallest(self.limit, keys, key=self._order)
+    
+    def complete(self, prefix):
+        """ best limit (name, weight) pairs for names starting with prefix """
+        prefix = prefix.lower()
+        top = self._top.get(prefix)
+        if top is None:
+            lo = bisect_left(self._keys, prefix)
+            hi = bisect_left(self._keys, prefix + _LAST, lo)
+            top = self._rank(self._keys[lo:hi])
+            if hi - lo > _HEAVY:
+                self._top[prefix] = top
+        return [(_name(key), self._weights.get(key, 0)) for key in top]
+    
+    def _touch(self, key, is_better):
+        """ update cached tops of every prefix of key """
+        stem = _stem(key)
+        for i in xrange(len(stem) + 1):
+            top = self._top.get(stem[:i])
+            if top is None:
+                continue
+            if not is_better:
+                """ someone outside may be better now, rank it again """
+                if key in top:
+                    del self._top[stem[:i]]
+            elif key in top:
+                top.sort(key=self._order)
+            elif len(top) < self.limit:
+                top.append(key)
+                top.sort(key=self._order)
+            elif self._order(key) < self._order(top[-1]):
+                top[-1] = key
+                top.sort(key=self._order)
+    
+    def set(self, id, name, weight=None):
+        """ add or rename entry, weight None keeps the current one """
+        key = _key(name)
+        self._lock.acquire()
+        try:
+            old = self._ids.get(id)
+            if old is not None:
+                if weight is None:
+                    weight = self._weights[old]
+                if old == key:
+                    is_better = weight >= self._weights[key]
+                    self._weights[key] = weight
+                    self._touch(key, is_better)
+                    return
+                self._remove(id)
+            
+            insort(self._keys, key)
+            self._weights[key] = weight or 0
+            self._ids[id] = key
+            self._touch(key, True)
+        finally:
+            self._lock.release()
+    
+    def _remove(self, id):
+        key = self._ids.pop(id, None)
+        if key is None:
+            return
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            self._keys.pop(i)
+        self._touch(key, False)
+        del self._weights[key]
+    
+    def remove(self, id):
+        self._lock.acquire()
+        try:
+            self._remove(id)
+        finally:
+            self._lock.release()
+    
+    def adjust(self, ids, delta):
+        """ add delta to weights of known ids """
+        self._lock.acquire()
+        try:
+            for id in ids:
+                key = self._ids.get(id)
+                if key is not None:
+                    self._weights[key] = max(self._weights[key] + delta, 0)
+                    self._touch(key, delta > 0)
+        finally:
+            self._lock.release()
+
+
+class Autocomplete(object):
+    """
+    Completes @username, #tag and !group prefixes ranked by followers,
+    tag uses and group users. Loaded from the database on first use, kept
+    current by signals and Notice.save.
+    
+    @note: each process holds its own copy and sees changes made by this
+        process only, reload it (or restart) to pick up the others
+    """
+    
+    def __init__(self, limit):
+        self.users = PrefixIndex(limit)
+        self.tags = PrefixIndex(limit)
+        self.groups = PrefixIndex(limit)
+        self._indexes = {'@': self.users, '#': self.tags, '!': self.groups}
+        self._is_loaded = False
+        self._lock = threading.Lock()
+    
+    def load(self):
+        from models import Tag, Group, UserInfo
+        self._lock.acquire()
+        try:
+            self.users.load(UserInfo.objects.order_by().values_list('user',
+                'user__username', 'followers_count').iterator())
+            self.tags.load(Tag.objects.order_by().values_list('id', 'name',
+                'use_count').iterator())
+            self.groups.load(Group.objects.order_by().values_list('id',
+                'name', 'users_count').iterator())
+            self._is_loaded = True
+        finally:
+            self._lock.release()
+    
+    def complete(self, query):
+        """
+        Returns (sigil and name, weight) pairs, query is a sigil followed
+        by a name prefix
+        """
+        index = self._indexes.get(query[:1])
+        if index is None:
+            raise ValueError(query)
+        if not self._is_loaded:
+            self.load()
+        return [(query[:1] + name, weight)
+            for name, weight in index.complete(query[1:])]
+
+
+autocomplete = Autocomplete(settings.AUTOCOMPLETE_LIMIT)
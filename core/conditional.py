@@ -0,0 +1,60 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: change stamps behind conditional GET of timelines, see
+    decorators.conditional
+"""
+
+import time
+
+from django.core.cache import cache
+
+
+TIMELINES_STAMP_KEY = 'pythonica:timelines_changed'
+USER_STAMP_KEY = 'pythonica:user_changed:%d'
+
+""" 30 days is memcached maximum, lost stamps start over anyway """
+STAMP_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def touch_timelines():
+    """ some notice already shown was changed or deleted """
+    cache.set(TIMELINES_STAMP_KEY, time.time(), STAMP_TIMEOUT)
+
+
+def touch_users(user_ids):
+    """ relationships, mentions or profile of these users changed """
+    now = time.time()
+    for user_id in set(user_ids):
+        cache.set(USER_STAMP_KEY % user_id, now, STAMP_TIMEOUT)
+
+
+def last_changed(user_ids):
+    """
+    Time of the latest timelines or users change, stamps lost by the cache
+    are set to now so nothing cached by clients is taken as current
+    """
+    keys = [TIMELINES_STAMP_KEY] + [USER_STAMP_KEY % user_id
+        for user_id in set(user_ids)]
+    stamps = cache.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in stamps:
+            cache.add(key, now, STAMP_TIMEOUT)
+            stamps[key] = now
+    return max(stamps.values())
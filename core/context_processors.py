@@ -19,18 +19,45 @@ along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.contrib.sites.models import Site
 
+from csrf import LazyToken
 from forms import NoticeForm
 from models import Notice
 
 
+class LazyList(object):
+    """
+    Calls func on first iteration only, so pages that do not show the list
+    do not pay for it
+    """
+    
+    def __init__(self, func):
+        self._func = func
+    
+    def _get_list(self):
+        if not hasattr(self, '_list'):
+            self._list = self._func()
+        return self._list
+    
+    def __iter__(self):
+        return iter(self._get_list())
+    
+    def __len__(self):
+        return len(self._get_list())
+
+
 def pythonica_context(request):
     
     noticeForm = NoticeForm()
     
-    popular_notices = Notice.objects.public().order_by('-favorited_count')
+    popular_notices = LazyList(Notice.objects.popular)
     
     return {
         'site': Site.objects.get_current(),
         'notice_form': noticeForm,
         'popular_notices': popular_notices,
     }
+
+
+def csrf(request):
+    """ for {% csrf_token %} of templatetags/csrf.py """
+    return {'csrf_token': LazyToken(request)}
@@ -0,0 +1,171 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import atexit
+import os
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+
+def update_counter(queryset, field, delta):
+    """
+    Atomically add delta to the counter field of all objects in queryset,
+    counters never go below zero
+    """
+    if delta < 0:
+        queryset = queryset.filter(**{'%s__gte' % field: -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+class WriteBehindBuffer(object):
+    """
+    Base of in-memory write-behind buffers, subclasses keep the pending
+    changes and write them in flush. Pending changes are written when the
+    oldest one is max_age seconds old.
+    
+    @note: a daemon timer thread, started by the first buffered change of
+        a process, flushes changes once they are max_age seconds old with
+        a database connection of its own. Staleness is also checked on
+        every add and at the end of every request (see signals), pending
+        changes are flushed on interpreter shutdown (see close).
+    @note: changes are buffered once the transaction that caused them is
+        committed (see jobs.after_commit), a flush must never apply work
+        that rolls back or miss rows that are not committed yet
+    """
+    
+    def __init__(self, max_age=0, max_size=1000):
+        self.max_age = max_age
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._since = None
+        self._timer = None
+        self._timer_pid = None
+        self._stopped = threading.Event()
+    
+    def _start_timer(self):
+        """ threads are not inherited by forked processes, start one each """
+        if self._timer_pid == os.getpid():
+            return
+        self._timer_pid = os.getpid()
+        self._timer = threading.Thread(target=self._run_timer)
+        self._timer.setDaemon(True)
+        self._timer.start()
+        atexit.register(self._stop_timer)
+    
+    def _run_timer(self):
+        while not self._stopped.isSet():
+            since = self._since
+            if since is None:
+                delay = self.max_age
+            else:
+                delay = since + self.max_age - time.time()
+            self._stopped.wait(max(delay, 0))
+            if self._stopped.isSet():
+                return
+            try:
+                try:
+                    self.flush_stale()
+                except Exception:
+                    """ keep the timer alive, changes of the flush are lost """
+                    traceback.print_exc()
+            finally:
+                connection.close()
+    
+    def flush_stale(self):
+        since = self._since
+        if since is not None and time.time() - since >= self.max_age:
+            self.flush()
+    
+    def _stop_timer(self):
+        """ daemon threads waiting at interpreter shutdown die noisily """
+        self._stopped.set()
+        if self._timer is not None and self._timer_pid == os.getpid():
+            self._timer.join()
+    
+    def close(self):
+        self._stop_timer()
+        self.flush()
+    
+    def flush(self):
+        raise NotImplementedError
+
+
+class CounterBuffer(WriteBehindBuffer):
+    """
+    Write-behind aggregator for hot counters (tag use, device and group
+    notices). Deltas are summed in memory and written with one UPDATE per
+    (model, field, delta) when max_size objects are pending or the oldest
+    delta is max_age seconds old.
+    
+    @note: deltas of a process that dies, or of a flush that fails, are
+        lost, reconcile_counters repairs them
+    """
+    
+    def __init__(self, max_age=0, max_size=1000):
+        super(CounterBuffer, self).__init__(max_age, max_size)
+        self._deltas = {}
+    
+    def add(self, model, field, ids, delta=1):
+        if not ids:
+            return
+        if not self.max_age:
+            update_counter(model.objects.filter(id__in=ids), field, delta)
+            return
+        
+        self._lock.acquire()
+        try:
+            deltas = self._deltas.setdefault((model, field), {})
+            for id in ids:
+                deltas[id] = deltas.get(id, 0) + delta
+            if self._since is None:
+                self._since = time.time()
+            is_full = sum(map(len, self._deltas.values())) >= self.max_size
+            self._start_timer()
+        finally:
+            self._lock.release()
+        
+        if is_full:
+            self.flush()
+        else:
+            self.flush_stale()
+    
+    def flush(self):
+        self._lock.acquire()
+        try:
+            deltas, self._deltas, self._since = self._deltas, {}, None
+        finally:
+            self._lock.release()
+        
+        for (model, field), counts in deltas.items():
+            ids_by_delta = {}
+            for id, delta in counts.items():
+                if delta:
+                    ids_by_delta.setdefault(delta, []).append(id)
+            for delta, ids in ids_by_delta.items():
+                update_counter(model.objects.filter(id__in=ids), field, delta)
+
+
+counters = CounterBuffer(settings.COUNTER_BUFFER_MAX_AGE,
+    settings.COUNTER_BUFFER_SIZE)
+atexit.register(counters.close)
@@ -0,0 +1,82 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: csrf tokens rendered by templates ({% load csrf %}{% csrf_token %}),
+    checked by django.contrib.csrf CsrfViewMiddleware
+"""
+
+from django.conf import settings
+from django.contrib.csrf.middleware import _make_token, \
+    CsrfResponseMiddleware
+
+
+def get_token(request):
+    """
+    Token of the request session, None while there is no session to check.
+    Marks request with csrf_token_used so the page is not shared.
+    """
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES and \
+        not request.session.modified:
+        return None
+    request.csrf_token_used = True
+    return _make_token(request.session.session_key)
+
+
+def csrf_field(token):
+    """ hidden form field of {% csrf_token %}, nothing without a token """
+    if not token:
+        return u''
+    return u'<div style="display:none"><input type="hidden" ' \
+        u'name="csrfmiddlewaretoken" value="%s" /></div>' % token
+
+
+class LazyToken(object):
+    """
+    Calls get_token on first use only, so pages without forms do not pay
+    for it
+    """
+    
+    def __init__(self, request):
+        self._request = request
+    
+    def _get_token(self):
+        if not hasattr(self, '_token'):
+            self._token = get_token(self._request)
+        return self._token
+    
+    def __nonzero__(self):
+        return bool(self._get_token())
+    
+    def __unicode__(self):
+        return self._get_token() or u''
+    
+    def __str__(self):
+        return str(self._get_token() or '')
+
+
+class CsrfRewriteMiddleware(CsrfResponseMiddleware):
+    """
+    Response rewriting for third party templates that have no tokens (admin,
+    auth password pages), only under CSRF_REWRITE_PATHS
+    """
+    
+    def process_response(self, request, response):
+        if not request.path.startswith(settings.CSRF_REWRITE_PATHS):
+            return response
+        return super(CsrfRewriteMiddleware, self).process_response(request,
+            response)
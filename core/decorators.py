@@ -17,11 +17,22 @@ You should have received a copy of the GNU Affero General Public License
 along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import time
 
+from django.conf import settings
 from django.contrib.auth.decorators import user_passes_test
+from django.http import Http404, HttpResponseNotModified
 from django.shortcuts import redirect
+from django.utils import translation
+from django.utils.hashcompat import md5_constructor
+from django.utils.http import http_date, parse_etags, quote_etag
 from django.views.generic.simple import direct_to_template
 
+from conditional import last_changed
+from models import Follow, Block
+from pagecache import pages
+from paginator import KeysetPaginator, InvalidCursor
+
 
 def render_to(template):
     """
@@ -61,3 +72,138 @@ def post_required(function):
         else:
             return redirect('pythonica-index')
     return decorator
+
+
+def paginate(name, per_page=10, posted_field='posted', id_field='id'):
+    """
+    Decorator for views returning a context for render_to. Replaces queryset
+    found under name with a KeysetPaginator page chosen by "before" and
+    "after" cursors of the url.
+    """
+    def paginator(func):
+        def wrapper(request, *args, **kw):
+            before = kw.pop('before', None)
+            after = kw.pop('after', None)
+            output = func(request, *args, **kw)
+            if isinstance(output, (list, tuple)):
+                context = output[0]
+            elif isinstance(output, dict):
+                context = output
+            else:
+                return output
+            try:
+                context[name] = KeysetPaginator(context[name], per_page,
+                    posted_field, id_field).page(before, after)
+            except InvalidCursor:
+                raise Http404
+            return output
+        return wrapper
+    return paginator
+
+
+def annotate_authors(name, get_notice=lambda obj: obj):
+    """
+    Decorator for views returning a context for render_to, put it above
+    paginate. Marks authors of notices under name with viewer_follows and
+    viewer_blocks for the current user using one query per relationship
+    instead of one per author.
+    """
+    def annotator(func):
+        def wrapper(request, *args, **kw):
+            output = func(request, *args, **kw)
+            if isinstance(output, (list, tuple)):
+                context = output[0]
+            elif isinstance(output, dict):
+                context = output
+            else:
+                return output
+            if request.user.is_authenticated():
+                objects = getattr(context[name], 'object_list', context[name])
+                authors = [get_notice(obj).author for obj in objects]
+                author_ids = [author.id for author in authors]
+                subscribed = Follow.followed_ids(request.user, author_ids)
+                blocked = Block.blocked_ids(request.user, author_ids)
+                for author in authors:
+                    author.viewer_follows = author.id in subscribed
+                    author.viewer_blocks = author.id in blocked
+            return output
+        return wrapper
+    return annotator
+
+
+def conditional(get_state):
+    """
+    Decorator for views, put it above everything else. get_state(request,
+    *args, **kw) returns (id, posted) of the newest timeline notice (or
+    None) and ids of users whose changes show on the page. ETag and
+    Last-Modified are made of those, the viewer and change stamps (see
+    conditional.py), and GET requests that match them get 304 Not Modified
+    without running the view.
+    
+    @note: ETag also changes every CONDITIONAL_GET_MAX_AGE seconds and
+        Last-Modified older than that is not trusted, so relative posting
+        times get refreshed
+    """
+    def conditioner(func):
+        def wrapper(request, *args, **kw):
+            if request.method not in ('GET', 'HEAD'):
+                return func(request, *args, **kw)
+            
+            newest, user_ids = get_state(request, *args, **kw)
+            viewer_id = request.user.is_authenticated() and request.user.id
+            changed = last_changed(list(user_ids) + (viewer_id and
+                [viewer_id] or []))
+            
+            modified = changed
+            if newest is not None:
+                modified = max(modified, time.mktime(newest[1].timetuple()))
+            period = int(time.time() // settings.CONDITIONAL_GET_MAX_AGE)
+            etag = md5_constructor(repr((request.path, viewer_id, newest,
+                changed, period, translation.get_language()))).hexdigest()
+            last_modified = http_date(modified)
+            
+            if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+            if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+            if if_none_match:
+                try:
+                    is_fresh = etag in parse_etags(if_none_match)
+                except ValueError:
+                    is_fresh = False
+            else:
+                is_fresh = (if_modified_since == last_modified and
+                    time.time() - modified < settings.CONDITIONAL_GET_MAX_AGE)
+            
+            if is_fresh:
+                response = HttpResponseNotModified()
+            else:
+                response = func(request, *args, **kw)
+            response['ETag'] = quote_etag(etag)
+            """
+            dates are in whole seconds, one more change may come within the
+            second of the last one
+            """
+            if int(modified) < int(time.time()):
+                response['Last-Modified'] = last_modified
+            return response
+        return wrapper
+    return conditioner
+
+
+def cache_anonymous(get_user_ids=lambda request, *args, **kw: ()):
+    """
+    Decorator for views that look the same to every anonymous visitor, put
+    it under conditional. GET requests without query string of anonymous
+    visitors are answered from pagecache.pages, get_user_ids(request,
+    *args, **kw) returns ids of users whose notices show on the page, new
+    public notices show on every page.
+    """
+    def cacher(func):
+        def wrapper(request, *args, **kw):
+            if not pages.timeout or request.method not in ('GET', 'HEAD') \
+                or request.GET or request.user.is_authenticated():
+                return func(request, *args, **kw)
+            return pages.get_or_render(request,
+                get_user_ids(request, *args, **kw),
+                lambda: func(request, *args, **kw))
+        return wrapper
+    return cacher
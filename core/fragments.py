@@ -0,0 +1,160 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: rendered notice list items cache, see templatetags/fragments.py
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.template import Context
+from django.utils import translation
+from django.utils.safestring import mark_safe
+from django.utils.timesince import timesince
+
+from csrf import csrf_field
+from notices import NOTICE_HTML_VERSION
+
+
+NOTICE_VERSION_KEY = 'pythonica:notice_version:%d'
+USER_VERSION_KEY = 'pythonica:user_version:%d'
+FRAGMENT_KEY = 'pythonica:notice_html:%d:%d:%s:%d%d'
+HITS_KEY = 'pythonica:notice_html_hits'
+MISSES_KEY = 'pythonica:notice_html_misses'
+
+""" hit and miss totals outlive fragments, 30 days is memcached maximum """
+STATS_TIMEOUT = 60 * 60 * 24 * 30
+
+""" stands for the only part that changes by itself, time since posted """
+_POSTED_AGO = u'\x00posted_ago\x00'
+
+""" stands for the csrf token of the viewer session """
+_CSRF_TOKEN = u'\x00csrf_token\x00'
+
+
+def _new_version():
+    return '%.6f' % time.time()
+
+
+class FragmentCache(object):
+    """
+    Rendered inc/notice.html per notice, viewer relation to the author and
+    language, stored along with the notice and author versions it was
+    rendered with. Versions live in the cache too and are bumped by
+    signals, so a changed notice or author misses once and is rendered
+    again. One get_many per notice.
+    
+    @note: hits and misses are counted in process and added to the cache
+        totals at the end of every request (see signals), fragmentstats
+        shows them
+    @note: device renames do not bump anything, fragments of their notices
+        expire with NOTICE_FRAGMENT_TIMEOUT
+    """
+    
+    template_name = 'inc/notice.html'
+    
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    def bump_notice(self, notice_id):
+        cache.set(NOTICE_VERSION_KEY % notice_id, _new_version(),
+            self.timeout)
+    
+    def bump_user(self, user_id):
+        cache.set(USER_VERSION_KEY % user_id, _new_version(), self.timeout)
+    
+    def render(self, notice, csrf_token=None):
+        if not self.timeout:
+            return self._render(notice, csrf_token=csrf_token)
+        
+        author = notice.author
+        key = FRAGMENT_KEY % (notice.id, NOTICE_HTML_VERSION,
+            translation.get_language(), getattr(author, 'viewer_follows',
+                False), getattr(author, 'viewer_blocks', False))
+        notice_key = NOTICE_VERSION_KEY % notice.id
+        user_key = USER_VERSION_KEY % notice.author_id
+        cached = cache.get_many([key, notice_key, user_key])
+        
+        versions = (cached.get(notice_key), cached.get(user_key))
+        fragment = cached.get(key)
+        if fragment is not None and None not in versions and \
+            fragment[:2] == versions:
+            self._count(hits=1)
+            html = fragment[2]
+        else:
+            self._count(misses=1)
+            """ versions lost by the cache start over, old fragments miss """
+            if versions[0] is None:
+                versions = (_new_version(), versions[1])
+                cache.set(notice_key, versions[0], self.timeout)
+            if versions[1] is None:
+                versions = (versions[0], _new_version())
+                cache.set(user_key, versions[1], self.timeout)
+            html = self._render(notice, _POSTED_AGO, _CSRF_TOKEN)
+            cache.set(key, versions + (html,), self.timeout)
+        
+        return mark_safe(html.replace(_POSTED_AGO, timesince(notice.posted)
+            ).replace(csrf_field(_CSRF_TOKEN), csrf_field(csrf_token)))
+    
+    def _render(self, notice, posted_ago=None, csrf_token=None):
+        if posted_ago is None:
+            posted_ago = timesince(notice.posted)
+        return get_template(self.template_name).render(Context({
+            'notice': notice, 'posted_ago': posted_ago,
+            'csrf_token': csrf_token}))
+    
+    def _count(self, hits=0, misses=0):
+        self._lock.acquire()
+        try:
+            self.hits += hits
+            self.misses += misses
+        finally:
+            self._lock.release()
+    
+    def flush_stats(self):
+        """ add process counts to the cache totals """
+        self._lock.acquire()
+        try:
+            hits, misses, self.hits, self.misses = self.hits, self.misses, 0, 0
+        finally:
+            self._lock.release()
+        
+        for key, count in ((HITS_KEY, hits), (MISSES_KEY, misses)):
+            if count:
+                cache.add(key, 0, STATS_TIMEOUT)
+                try:
+                    cache.incr(key, count)
+                except ValueError:
+                    cache.set(key, count, STATS_TIMEOUT)
+    
+    def stats(self):
+        totals = cache.get_many([HITS_KEY, MISSES_KEY])
+        return totals.get(HITS_KEY, 0), totals.get(MISSES_KEY, 0)
+    
+    def reset_stats(self):
+        cache.delete(HITS_KEY)
+        cache.delete(MISSES_KEY)
+
+
+fragments = FragmentCache(settings.NOTICE_FRAGMENT_TIMEOUT)
@@ -0,0 +1,162 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+
+def _contains(ids, id):
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+
+
+def _intersection(a, b):
+    """ merge two sorted arrays """
+    result = array('l')
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            i += 1
+        elif a[i] > b[j]:
+            j += 1
+        else:
+            result.append(a[i])
+            i += 1
+            j += 1
+    return result
+
+
+class EdgeIndex(object):
+    """
+    Directed user to user edges kept as sorted integer arrays in both
+    directions, membership is a binary search
+    """
+    
+    def __init__(self):
+        self._out = {}
+        self._in = {}
+    
+    def load(self, edges):
+        out, in_ = {}, {}
+        for source, target in edges:
+            out.setdefault(source, []).append(target)
+            in_.setdefault(target, []).append(source)
+        self._out = dict((id, array('l', sorted(ids)))
+            for id, ids in out.iteritems())
+        self._in = dict((id, array('l', sorted(ids)))
+            for id, ids in in_.iteritems())
+    
+    def add(self, source, target):
+        for edges, key, id in ((self._out, source, target),
+            (self._in, target, source)):
+            ids = edges.setdefault(key, array('l'))
+            if not _contains(ids, id):
+                insort(ids, id)
+    
+    def remove(self, source, target):
+        for edges, key, id in ((self._out, source, target),
+            (self._in, target, source)):
+            ids = edges.get(key)
+            if ids is not None and _contains(ids, id):
+                ids.pop(bisect_left(ids, id))
+    
+    def has(self, source, target):
+        return _contains(self._out.get(source, ()), target)
+    
+    def targets(self, source):
+        return self._out.get(source, array('l'))
+    
+    def sources(self, target):
+        return self._in.get(target, array('l'))
+    
+    def count_targets(self, source):
+        return len(self._out.get(source, ()))
+    
+    def count_sources(self, target):
+        return len(self._in.get(target, ()))
+    
+    def common_targets(self, source, other):
+        return _intersection(self.targets(source), self.targets(other))
+    
+    def common_sources(self, target, other):
+        return _intersection(self.sources(target), self.sources(other))
+
+
+class GraphIndex(object):
+    """
+    In-memory follow and block graph used by Follow and Block classmethods
+    when GRAPH_INDEX setting is on. Loaded from the database on first use,
+    kept current by signals.
+    
+    @warning: each process holds its own copy and sees changes made by this
+        process only, use with a single server process
+    """
+    
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.follows = EdgeIndex()
+        self.blocks = EdgeIndex()
+        self._is_loaded = False
+        self._lock = threading.Lock()
+    
+    def load(self):
+        from models import Follow, Block
+        self._lock.acquire()
+        try:
+            self.follows.load(Follow.objects.order_by().values_list(
+                'follower', 'followed').iterator())
+            self.blocks.load(Block.objects.order_by().values_list(
+                'blocker', 'blocked').iterator())
+            self._is_loaded = True
+        finally:
+            self._lock.release()
+    
+    def _ensure_loaded(self):
+        if not self._is_loaded:
+            self.load()
+    
+    def is_following(self, follower_id, followed_id):
+        self._ensure_loaded()
+        return self.follows.has(follower_id, followed_id)
+    
+    def is_blocking(self, blocker_id, blocked_id):
+        self._ensure_loaded()
+        return self.blocks.has(blocker_id, blocked_id)
+    
+    def followers_count(self, user_id):
+        self._ensure_loaded()
+        return self.follows.count_sources(user_id)
+    
+    def following_count(self, user_id):
+        self._ensure_loaded()
+        return self.follows.count_targets(user_id)
+    
+    def common_following(self, user_id, other_id):
+        self._ensure_loaded()
+        return self.follows.common_targets(user_id, other_id)
+    
+    def common_followers(self, user_id, other_id):
+        self._ensure_loaded()
+        return self.follows.common_sources(user_id, other_id)
+
+
+graph = GraphIndex(settings.GRAPH_INDEX)
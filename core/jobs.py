@@ -0,0 +1,223 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: database backed job queue, see models.Job and the runjobs command
+"""
+
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import simplejson
+from django.utils.importlib import import_module
+
+
+_local = threading.local()
+
+
+def run_task(name, args):
+    """ call the function of dotted path name with args """
+    module, function = name.rsplit('.', 1)
+    return getattr(import_module(module), function)(*args)
+
+
+def enqueue(name, args=(), key=None):
+    """
+    Queue a call of the function of dotted path name, args must be JSON
+    serializable. A job of the same key is queued once only. Runs the call
+    at once when JOB_QUEUE_ASYNC is off.
+    
+    @note: the job row is part of the current transaction, it is never run
+        for work that was rolled back
+    """
+    if not settings.JOB_QUEUE_ASYNC:
+        run_task(name, args)
+        return
+    
+    from models import Job
+    job = Job(name=name, args=simplejson.dumps(list(args)), key=key,
+        run_at=datetime.now())
+    if key is None:
+        job.save()
+        return
+    
+    """ a failed insert must not break the transaction of the caller """
+    sid = transaction.savepoint()
+    try:
+        job.save()
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+    else:
+        transaction.savepoint_commit(sid)
+
+
+def after_commit(function, *args):
+    """
+    Call function when the transaction of the enclosing
+    commit_on_success_after (a job, Notice.save) is committed, never for
+    one that rolls back. Outside them it is called at once. For changes
+    a rollback does not undo, like in-memory indexes and buffers.
+    """
+    calls = getattr(_local, 'after_commit', None)
+    if calls is None:
+        function(*args)
+    else:
+        calls.append((function, args))
+
+
+def commit_on_success_after(function):
+    """
+    transaction.commit_on_success that runs the after_commit calls made
+    inside function once it commits, nested uses leave them to the
+    outermost one
+    """
+    in_transaction = transaction.commit_on_success(function)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, 'after_commit', None) is not None:
+            return in_transaction(*args, **kwargs)
+        _local.after_commit = []
+        try:
+            result = in_transaction(*args, **kwargs)
+            calls = _local.after_commit
+        finally:
+            _local.after_commit = None
+        
+        """ the work is committed already, a failing call must not undo it """
+        for call, call_args in calls:
+            try:
+                call(*call_args)
+            except Exception:
+                traceback.print_exc()
+        return result
+    return wrapper
+
+
+def claim(limit=10):
+    """
+    Jobs that are due, or whose worker died, taken by this process. A job
+    is taken by a conditional UPDATE so concurrent workers never share one.
+    """
+    from models import Job
+    now = datetime.now()
+    q_due = Q(status=Job.STATUS_PENDING, run_at__lte=now)
+    q_stale = Q(status=Job.STATUS_RUNNING, locked_until__lt=now)
+    
+    claimed = []
+    for job in Job.objects.filter(q_due | q_stale).order_by('run_at',
+        'id')[:limit]:
+        locked_until = now + timedelta(seconds=settings.JOB_TIMEOUT)
+        if Job.objects.filter(id=job.id, status=job.status,
+            attempts=job.attempts).update(status=Job.STATUS_RUNNING,
+                locked_until=locked_until, attempts=F('attempts') + 1):
+            job.status, job.attempts = Job.STATUS_RUNNING, job.attempts + 1
+            job.locked_until = locked_until
+            claimed.append(job)
+    return claimed
+
+
+@commit_on_success_after
+def _run(job):
+    """
+    The work and the job being done are committed together. Counters and
+    trends are updated by after_commit calls, so a failed attempt leaves
+    nothing behind for the retry to count again.
+    """
+    from models import Job
+    run_task(job.name, simplejson.loads(job.args))
+    Job.objects.filter(id=job.id).update(status=Job.STATUS_DONE,
+        locked_until=None, error='')
+
+
+def run(job):
+    """
+    Run a claimed job, failed jobs are retried JOB_MAX_ATTEMPTS times with
+    exponential backoff from JOB_RETRY_DELAY seconds. Returns True on
+    success.
+    """
+    from models import Job
+    try:
+        _run(job)
+        return True
+    except Exception:
+        error = traceback.format_exc()
+    
+    if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+        Job.objects.filter(id=job.id).update(status=Job.STATUS_FAILED,
+            locked_until=None, error=error)
+    else:
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        Job.objects.filter(id=job.id).update(status=Job.STATUS_PENDING,
+            locked_until=None, error=error,
+            run_at=datetime.now() + timedelta(seconds=delay))
+    return False
+
+
+def work(once=False, sleep=1.0, batch=10):
+    """
+    Worker loop of one process, returns (done, failed) counts when the
+    queue is empty and once is set
+    """
+    done = failed = 0
+    while True:
+        jobs = claim(batch)
+        for job in jobs:
+            if run(job):
+                done += 1
+            else:
+                failed += 1
+        if not jobs:
+            if once:
+                return done, failed
+            time.sleep(sleep)
+
+
+def work_in_pool(processes, once=False, sleep=1.0, batch=10):
+    """
+    Fork processes workers, each with its own database connection, and
+    wait for them. Returns (done, failed) totals.
+    """
+    connection.close()
+    children = {}
+    for i in range(processes):
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            status = 1
+            try:
+                os.write(write_end, '%d %d' % work(once, sleep, batch))
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(write_end)
+        children[pid] = read_end
+    
+    done = failed = 0
+    for pid, read_end in children.items():
+        result = os.read(read_end, 64)
+        os.close(read_end)
+        os.waitpid(pid, 0)
+        if result:
+            counts = map(int, result.split())
+            done, failed = done + counts[0], failed + counts[1]
+    return done, failed
@@ -0,0 +1,72 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+import string
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.utils import simplejson
+
+from core.autocomplete import PrefixIndex
+
+
+class Command(NoArgsCommand):
+    """
+    Loads a prefix index with random names and skewed weights, then times
+    prefix lookups (with their JSON encoding) among weight updates. Nothing
+    touches the database.
+    """
+    option_list = NoArgsCommand.option_list + (
+        make_option('--entries', dest='entries', type='int', default=1000000,
+            help='Number of names in the index'),
+        make_option('--queries', dest='queries', type='int', default=10000,
+            help='Number of prefix lookups to time'),
+    )
+    help = "Benchmark autocomplete prefix index latency"
+    
+    def handle_noargs(self, **options):
+        entries, queries = options['entries'], options['queries']
+        letters = string.ascii_lowercase + string.digits + '_'
+        names = [''.join(random.choice(letters)
+            for j in xrange(random.randint(3, 12))) for i in xrange(entries)]
+        
+        index = PrefixIndex(settings.AUTOCOMPLETE_LIMIT)
+        started = time.time()
+        index.load((id, name, int(1000 * random.random() ** 8))
+            for id, name in enumerate(names))
+        print 'load: %d names in %.2fs' % (len(index), time.time() - started)
+        
+        timings = []
+        for i in xrange(queries):
+            if i % 10 == 0:
+                index.adjust([random.randrange(entries)], random.choice((1,
+                    1, 1, -1)))
+            name = random.choice(names)
+            prefix = name[:random.randint(1, min(len(name), 4))]
+            started = time.time()
+            simplejson.dumps(index.complete(prefix))
+            timings.append(time.time() - started)
+        
+        timings.sort()
+        print 'complete: %d lookups, p50 %.3fms, p99 %.3fms, max %.3fms' % (
+            queries, timings[queries / 2] * 1000,
+            timings[int(queries * 0.99)] * 1000, timings[-1] * 1000)
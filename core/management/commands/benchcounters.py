@@ -0,0 +1,66 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand
+
+from core.counters import counters
+from core.models import Notice, Tag
+
+
+class Command(NoArgsCommand):
+    """
+    Posts tag-heavy notices with counters written through and with the
+    write-behind buffer. Notice.save commits, so the benchmark user, its
+    notices and tags are deleted at the end instead of rolled back.
+    """
+    option_list = NoArgsCommand.option_list + (
+        make_option('--notices', dest='notices', type='int', default=500,
+            help='Number of notices to post in each run'),
+        make_option('--tags', dest='tags', type='int', default=10,
+            help='Number of hashtags in each notice'),
+    )
+    help = "Benchmark posting throughput with and without counter buffer"
+    
+    def handle_noargs(self, **options):
+        tags = ['benchcounters%d' % i for i in range(options['tags'])]
+        text = ' '.join(['#%s' % tag for tag in tags])
+        max_age = counters.max_age
+        
+        author = User.objects.create_user('benchcounters',
+            'benchcounters@example.com')
+        try:
+            for label, buffer_max_age in (('write-through', 0),
+                ('write-behind', 3600)):
+                counters.max_age = buffer_max_age
+                started = time.time()
+                for i in xrange(options['notices']):
+                    Notice(author=author, text=text, via_id=1).save()
+                counters.flush()
+                elapsed = time.time() - started
+                print '%s: %d notices in %.2fs, %.1f notices/s' % (label,
+                    options['notices'], elapsed, options['notices'] / elapsed)
+        finally:
+            counters.max_age = max_age
+            author.delete()
+            Tag.objects.filter(name__in=tags).delete()
+            counters.flush()
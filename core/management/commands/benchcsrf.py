@@ -0,0 +1,114 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.csrf.middleware import CsrfResponseMiddleware
+from django.core.management.base import NoArgsCommand, CommandError
+from django.http import HttpRequest, HttpResponse
+from django.template import Template, Context
+from django.utils.importlib import import_module
+
+from core.context_processors import csrf
+
+
+""" one home timeline entry, forms and markup as inc/notice.html has """
+_ENTRY = '''
+<li class="hentry notice" id="notice-{{ i }}">
+ <div class="entry-title"><span class="vcard author"><a href="/alice/"
+  class="url" title="Alice (alice)"><img src="/media/avatar.png"
+  class="avatar photo" width="48" height="48" alt="alice"/><span
+  class="nickname fn">alice</span></a></span>
+  <p class="entry-content">Some notice text with a <a href="/tag/python/"
+   rel="tag">python</a> tag and a <a href="http://example.com/"
+   rel="nofollow external">link</a> {{ i }}</p></div>
+ <div class="entry-content"><dl class="timestamp"><dt>Published</dt><dd><a
+  rel="bookmark" href="/notice/{{ i }}/"><abbr class="published">5 minutes
+  </abbr></a></dd></dl></div>
+ <div class="notice-options">
+  <form id="favor-{{ i }}" class="form_favor" method="post" action="/favor/">
+   %s<fieldset><legend>Favor this notice</legend><input type="submit"
+   class="submit" value="Favor"/></fieldset></form>
+  <dl class="notice_reply"><dt>Reply to this notice</dt><dd><a
+   href="#notice_form">Reply</a></dd></dl></div>
+</li>'''
+
+_PAGE = '''{%% load csrf %%}<html><body>
+<form id="form_notice" class="form" method="post" action="/post/">%s
+<textarea name="text"></textarea></form><ul class="notices">
+{%% for i in entries %%}%s{%% endfor %%}</ul></body></html>'''
+
+
+class Command(NoArgsCommand):
+    """
+    Renders a home timeline like page with a favor form per entry for a
+    session, once with template tokens and once without them passed
+    through the response rewriting CsrfResponseMiddleware, and times both.
+    Nothing touches the database.
+    """
+    option_list = NoArgsCommand.option_list + (
+        make_option('--entries', dest='entries', type='int', default=200,
+            help='Number of timeline entries on the page'),
+        make_option('--pages', dest='pages', type='int', default=200,
+            help='Number of pages to render'),
+    )
+    help = "Benchmark template csrf tokens against response rewriting"
+    
+    def handle_noargs(self, **options):
+        entries, pages = options['entries'], options['pages']
+        tag = '{% csrf_token %}'
+        with_tokens = Template(_PAGE % (tag, _ENTRY % tag))
+        without_tokens = Template(_PAGE % ('', _ENTRY % ''))
+        
+        request = HttpRequest()
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'x' * 32
+        engine = import_module(settings.SESSION_ENGINE)
+        request.session = engine.SessionStore('x' * 32)
+        middleware = CsrfResponseMiddleware()
+        
+        def tokens():
+            context = Context({'entries': range(entries)})
+            context.update(csrf(request))
+            return HttpResponse(with_tokens.render(context))
+        
+        def rewrite():
+            response = HttpResponse(without_tokens.render(Context({
+                'entries': range(entries)})))
+            return middleware.process_response(request, response)
+        
+        size = len(rewrite().content)
+        if tokens().content.count('csrfmiddlewaretoken') != entries + 1:
+            raise CommandError('template tokens are missing')
+        
+        results = []
+        for name, render in (('rewrite', rewrite), ('tokens', tokens)):
+            timings = []
+            for i in xrange(pages):
+                started = time.time()
+                render()
+                timings.append(time.time() - started)
+            timings.sort()
+            results.append(timings[pages / 2])
+            print '%s: %d pages of %d bytes, p50 %.3fms, max %.3fms' % (
+                name, pages, size, timings[pages / 2] * 1000,
+                timings[-1] * 1000)
+        print 'saving: %.3fms per response' % ((results[0] - results[1])
+            * 1000)
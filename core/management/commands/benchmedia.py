@@ -0,0 +1,92 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import resource
+import shutil
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.http import HttpRequest
+from django.views import static
+
+from core import media
+
+
+class Command(NoArgsCommand):
+    """
+    Writes a large file to a temporary directory and serves it through
+    django.views.static.serve and core.media.serve, each in a forked
+    process, consuming the response body like a WSGI server would. Prints
+    throughput and peak RSS growth of each.
+    """
+    option_list = NoArgsCommand.option_list + (
+        make_option('--size', dest='size', type='int', default=200,
+            help='File size in megabytes'),
+        make_option('--requests', dest='requests', type='int', default=5,
+            help='Number of times the file is served'),
+    )
+    help = "Benchmark media file serving throughput and memory"
+    
+    def handle_noargs(self, **options):
+        size, requests = options['size'], options['requests']
+        root = tempfile.mkdtemp()
+        try:
+            block = os.urandom(1024 * 1024)
+            output = open(os.path.join(root, 'large.bin'), 'wb')
+            for i in xrange(size):
+                output.write(block)
+            output.close()
+            
+            for name, serve in (('static.serve', static.serve),
+                ('media.serve', media.serve)):
+                seconds, rss = self._measure(serve, root, requests)
+                print '%s: %d x %dMB, %.1f MB/s, peak RSS +%.1f MB' % (
+                    name, requests, size, size * requests / seconds,
+                    rss / 1024.0)
+        finally:
+            shutil.rmtree(root)
+    
+    def _measure(self, serve, root, requests):
+        """ (seconds, peak RSS growth in KB) measured by a child process """
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = time.time()
+            for i in xrange(requests):
+                request = HttpRequest()
+                request.method = 'GET'
+                request.path = '/media/large.bin'
+                for chunk in serve(request, 'large.bin', root):
+                    pass
+            result = '%r %r' % (time.time() - started, resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss - rss)
+            os.write(write_end, result)
+            os._exit(0)
+        
+        os.close(write_end)
+        result = os.read(read_end, 1024)
+        os.close(read_end)
+        os.waitpid(pid, 0)
+        seconds, rss = result.split()
+        return float(seconds), float(rss)
@@ -0,0 +1,87 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+
+from core.models import Tag, TagTrend, _insert_many
+from core.trending import TrendBuffer
+
+
+class Command(NoArgsCommand):
+    """
+    Feeds skewed tag use events spread over the trending window into a
+    trend buffer, writes the buckets and ranks trending tags. Benchmark
+    tags and their buckets are deleted at the end.
+    """
+    option_list = NoArgsCommand.option_list + (
+        make_option('--events', dest='events', type='int', default=1000000,
+            help='Number of tag use events'),
+        make_option('--tags', dest='tags', type='int', default=1000,
+            help='Number of distinct tags'),
+        make_option('--rankings', dest='rankings', type='int', default=10,
+            help='Number of trending rankings to time'),
+    )
+    help = "Benchmark trending tags buckets and ranking"
+    
+    def handle_noargs(self, **options):
+        events = options['events']
+        names = ['benchtrending%d' % i for i in range(options['tags'])]
+        tags = Tag.objects.filter(name__startswith='benchtrending')
+        window = settings.TRENDING_TAGS_WINDOW * 3600
+        now = datetime.now()
+        
+        _insert_many(Tag, ('name', 'use_count'), ((name, 0) for name in names))
+        tag_ids = list(tags.values_list('id', flat=True))
+        try:
+            """ few tags get most uses, recent uses are more frequent """
+            uses = [(tag_ids[int(len(tag_ids) * random.random() ** 3)],
+                now - timedelta(seconds=int(window * random.random() ** 2)))
+                for i in xrange(events)]
+            
+            buffer = TrendBuffer(settings.TRENDING_TAGS_BUCKET, max_age=3600,
+                max_size=events)
+            started = time.time()
+            for tag_id, when in uses:
+                buffer.add([tag_id], when)
+            elapsed = time.time() - started
+            print 'add: %d events in %.2fs, %.0f events/s' % (events,
+                elapsed, events / elapsed)
+            
+            started = time.time()
+            buffer.flush()
+            elapsed = time.time() - started
+            print 'flush: %d bucket rows in %.2fs' % (
+                TagTrend.objects.filter(tag__in=tags).count(), elapsed)
+            
+            started = time.time()
+            for i in xrange(options['rankings']):
+                top = Tag.objects._rank_trending(now)
+            elapsed = (time.time() - started) / options['rankings']
+            print 'rank: top %d in %.1fms' % (len(top), elapsed * 1000)
+            print ', '.join(['#%s %.1f' % (tag.name, tag.trend)
+                for tag in top])
+        finally:
+            TagTrend.objects.filter(tag__in=tags).delete()
+            tags.delete()
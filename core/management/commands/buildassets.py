@@ -0,0 +1,57 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+
+from core.assets import AssetBuilder
+
+
+class Command(NoArgsCommand):
+    """
+    Render theme css and copy media to STATIC_ROOT under fingerprinted
+    names, with gzip copies of text files. Files of unchanged content keep
+    their names, so run it on every deploy.
+    """
+    help = "Build fingerprinted static assets"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--clear', action='store_true', dest='clear',
+            default=False, help='Remove STATIC_ROOT first'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        
+        if options['clear'] and os.path.isdir(settings.STATIC_ROOT):
+            shutil.rmtree(settings.STATIC_ROOT)
+        if not os.path.isdir(settings.STATIC_ROOT):
+            os.makedirs(settings.STATIC_ROOT)
+        
+        names = AssetBuilder(settings.STATIC_ROOT, settings.STATIC_URL,
+            settings.MEDIA_ROOT, settings.MEDIA_URL).build()
+        
+        if verbosity > 1:
+            for name in sorted(names):
+                print '%s -> %s' % (name, names[name])
+        if verbosity > 0:
+            print 'Built %d assets in %s' % (len(names), settings.STATIC_ROOT)
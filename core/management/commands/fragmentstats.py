@@ -0,0 +1,48 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from core.fragments import fragments
+
+
+class Command(NoArgsCommand):
+    """
+    Hits and misses of the notice fragment cache summed over all server
+    processes since the last reset
+    """
+    help = "Show notice fragment cache hit and miss counts"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--reset', action='store_true', dest='reset',
+            default=False, help='Start counting from zero'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        
+        fragments.flush_stats()
+        hits, misses = fragments.stats()
+        total = hits + misses
+        if verbosity > 0:
+            print 'hits: %d, misses: %d, hit ratio: %.1f%%' % (hits, misses,
+                total and 100.0 * hits / total)
+        if options['reset']:
+            fragments.reset_stats()
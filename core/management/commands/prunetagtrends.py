@@ -0,0 +1,43 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+
+from core.models import TagTrend
+
+
+class Command(NoArgsCommand):
+    """
+    Drop trending buckets nobody ranks anymore. Run it from cron, the
+    summary table then stays window / bucket size rows per active tag.
+    """
+    help = "Delete tag trend buckets older than the trending window"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--keep', dest='keep', type='int',
+            default=settings.TRENDING_TAGS_WINDOW,
+            help='Hours of buckets to keep'),
+    )
+    
+    def handle_noargs(self, **options):
+        TagTrend.prune(datetime.now() - timedelta(hours=options['keep']))
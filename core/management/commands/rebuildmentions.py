@@ -0,0 +1,47 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Mention
+
+
+class Command(BaseCommand):
+    """
+    Fill (or refill) user mentions from replies to their notices, honouring
+    blocks. Run it once to enable the replies page on an existing database,
+    before rebuildinbox as inbox replies come from mentions.
+    """
+    args = '[username ...]'
+    help = "Rebuild users mentions (all users if none given)"
+    
+    def handle(self, *usernames, **options):
+        verbosity = int(options.get('verbosity', 1))
+        
+        users = User.objects.order_by('id')
+        if usernames:
+            users = users.filter(username__in=usernames)
+            if users.count() != len(set(usernames)):
+                raise CommandError('Unknown user in %s' % ', '.join(usernames))
+        
+        for user in users.iterator():
+            Mention.rebuild(user)
+            if verbosity > 1:
+                print 'Rebuilt mentions for %s' % user.username
@@ -0,0 +1,45 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Tag, TagTimeline
+
+
+class Command(BaseCommand):
+    """
+    Fill (or refill) tag timelines from notice tags. Run it once to enable
+    tag pages on an existing database.
+    """
+    args = '[tag ...]'
+    help = "Rebuild tag timelines (all tags if none given)"
+    
+    def handle(self, *names, **options):
+        verbosity = int(options.get('verbosity', 1))
+        
+        tags = Tag.objects.order_by('id')
+        if names:
+            tags = tags.filter(name__in=names)
+            if tags.count() != len(set(names)):
+                raise CommandError('Unknown tag in %s' % ', '.join(names))
+        
+        for tag in tags.iterator():
+            TagTimeline.rebuild(tag)
+            if verbosity > 1:
+                print 'Rebuilt timeline for #%s' % tag.name
@@ -0,0 +1,89 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from core.models import Notice
+
+
+class Command(NoArgsCommand):
+    """
+    Fill (or refill) notice thread, parent and depth from existing replies.
+    Parent is the latest notice replied to, same as in Notice.save.
+    Notices go in id order chunks, so parents are always placed before
+    their replies.
+    """
+    help = "Rebuild notice threads from in_reply_to"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+            default=500, help='Notices updated per batch'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options['chunk_size']
+        
+        qn = connection.ops.quote_name
+        field = Notice._meta.get_field('in_reply_to')
+        replies_sql = 'SELECT %s, MAX(%s) FROM %s WHERE %s BETWEEN %%s ' \
+            'AND %%s GROUP BY %s' % (qn(field.m2m_column_name()),
+                qn(field.m2m_reverse_name()), qn(field.m2m_db_table()),
+                qn(field.m2m_column_name()), qn(field.m2m_column_name()))
+        update_sql = 'UPDATE %s SET %s = %%s, %s = %%s, %s = %%s ' \
+            'WHERE %s = %%s' % (qn(Notice._meta.db_table),
+                qn('thread_id'), qn('parent_id'), qn('depth'), qn('id'))
+        
+        last_id, total = 0, 0
+        while True:
+            ids = list(Notice.objects.filter(id__gt=last_id).order_by('id'
+                ).values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            
+            cursor = connection.cursor()
+            cursor.execute(replies_sql, [ids[0], ids[-1]])
+            parents = dict(cursor.fetchall())
+            
+            """ parents before this chunk are placed already """
+            placed = dict((id, (thread_id, depth)) for id, thread_id, depth
+                in Notice.objects.filter(id__in=set(parents.values()),
+                    id__lt=ids[0]).values_list('id', 'thread_id', 'depth'))
+            rows = []
+            for id in ids:
+                parent_id = parents.get(id)
+                if parent_id is None or parent_id not in placed:
+                    thread_id, depth, parent_id = None, 0, None
+                else:
+                    thread_id, depth = placed[parent_id]
+                    thread_id, depth = thread_id or parent_id, depth + 1
+                placed[id] = (thread_id, depth)
+                rows.append((thread_id, parent_id, depth, id))
+            cursor.executemany(update_sql, rows)
+            transaction.commit_unless_managed()
+            
+            last_id = ids[-1]
+            total += len(ids)
+            if verbosity > 1:
+                print 'Threaded %d notices' % total
+        
+        if verbosity > 0:
+            print 'Threaded %d notices' % total
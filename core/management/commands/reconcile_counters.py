@@ -0,0 +1,110 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from core.models import Device, Follow, Group, GroupUser, Mention, \
+    Notice, Tag, UserInfo
+
+
+def _counters():
+    """
+    (model, counter field, model key field, table to count rows in, column
+    pointing to model key, boolean column that must be false in counted
+    rows or None)
+    """
+    notice_groups = Notice._meta.get_field('groups')
+    notice_tags = Notice._meta.get_field('tags')
+    return (
+        (Device, 'notices_count', 'id', Notice._meta.db_table,
+            Notice._meta.get_field('via').column, None),
+        (Group, 'notices_count', 'id', notice_groups.m2m_db_table(),
+            notice_groups.m2m_reverse_name(), None),
+        (Group, 'users_count', 'id', GroupUser._meta.db_table,
+            GroupUser._meta.get_field('group').column, None),
+        (Tag, 'use_count', 'id', notice_tags.m2m_db_table(),
+            notice_tags.m2m_reverse_name(), None),
+        (UserInfo, 'followers_count', 'user', Follow._meta.db_table,
+            Follow._meta.get_field('followed').column, None),
+        (UserInfo, 'following_count', 'user', Follow._meta.db_table,
+            Follow._meta.get_field('follower').column, None),
+        (UserInfo, 'notices_count', 'user', Notice._meta.db_table,
+            Notice._meta.get_field('author').column, None),
+        (UserInfo, 'unread_mentions_count', 'user', Mention._meta.db_table,
+            Mention._meta.get_field('user').column,
+            Mention._meta.get_field('is_read').column),
+    )
+
+
+class Command(NoArgsCommand):
+    """
+    Counters are maintained incrementally by signals, this repairs any drift
+    (raw SQL, admin edits of many-to-many fields, crashes) with one UPDATE per
+    batch of ids, so locks are held for a batch only.
+    """
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=1000, help='Number of rows to check in one transaction'),
+        make_option('--verify', action='store_true', dest='verify',
+            default=False, help='Only count drifted rows, do not repair'),
+    )
+    help = "Recount denormalized counters of devices, groups, tags and users"
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        batch_size = options['batch_size']
+        verify = options['verify']
+        qn = connection.ops.quote_name
+        
+        for model, field, key, table, column, unless in _counters():
+            opts = model._meta
+            counter = 'SELECT COUNT(*) FROM %s WHERE %s.%s = %s.%s' % (
+                qn(table), qn(table), qn(column), qn(opts.db_table),
+                qn(opts.get_field(key).column))
+            if unless is not None:
+                counter += ' AND NOT %s.%s' % (qn(table), qn(unless))
+            counter = '(%s)' % counter
+            where = '%s >= %%s AND %s < %%s AND %s <> %s' % (
+                qn(opts.pk.column), qn(opts.pk.column),
+                qn(opts.get_field(field).column), counter)
+            if verify:
+                sql = 'SELECT COUNT(*) FROM %s WHERE %s' % (
+                    qn(opts.db_table), where)
+            else:
+                sql = 'UPDATE %s SET %s = %s WHERE %s' % (qn(opts.db_table),
+                    qn(opts.get_field(field).column), counter, where)
+            
+            max_id = model.objects.aggregate(max_id=Max('pk'))['max_id'] or 0
+            drifted = 0
+            for start in xrange(0, max_id + 1, batch_size):
+                cursor = connection.cursor()
+                cursor.execute(sql, (start, start + batch_size))
+                if verify:
+                    drifted += cursor.fetchone()[0]
+                else:
+                    drifted += cursor.rowcount
+                    transaction.commit_unless_managed()
+            
+            if verbosity > 0:
+                print '%s.%s: %d %s' % (opts.object_name, field, drifted,
+                    verify and 'drifted' or 'repaired')
@@ -0,0 +1,64 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from core.models import Notice
+from core.search import get_backend
+
+
+class Command(NoArgsCommand):
+    """
+    Fill (or refill) the search index from public notices. Notices are read
+    in id order chunks so memory use does not grow with the table.
+    """
+    help = "Rebuild the notice full-text search index"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+            default=1000, help='Notices indexed per batch'),
+        make_option('--clear', action='store_true', dest='clear',
+            default=False, help='Drop the whole index first'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options['chunk_size']
+        
+        backend = get_backend()
+        if options['clear']:
+            backend.clear()
+        
+        last_id, total = 0, 0
+        while True:
+            notices = list(Notice.objects.filter(is_restricted=False,
+                id__gt=last_id).order_by('id').values_list('id', 'text'
+                )[:chunk_size])
+            if not notices:
+                break
+            backend.index(notices)
+            last_id = notices[-1][0]
+            total += len(notices)
+            if verbosity > 1:
+                print 'Indexed %d notices' % total
+        
+        if verbosity > 0:
+            print 'Indexed %d notices' % total
@@ -0,0 +1,73 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from core.models import Notice
+from core.notices import render_notice, NOTICE_HTML_VERSION
+
+
+class Command(NoArgsCommand):
+    """
+    Render stored notice html of older format versions in id order chunks.
+    Stale rows are also rendered one by one when shown (Notice.get_html),
+    run this after bumping NOTICE_HTML_VERSION to do it all at once.
+    """
+    help = "Render notice html stored by older format versions"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+            default=500, help='Notices rendered per batch'),
+        make_option('--all', action='store_true', dest='all',
+            default=False, help='Render current version rows too'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options['chunk_size']
+        
+        qn = connection.ops.quote_name
+        update_sql = 'UPDATE %s SET %s = %%s, %s = %%s WHERE %s = %%s' % (
+            qn(Notice._meta.db_table), qn('html'), qn('html_version'),
+            qn('id'))
+        
+        notices = Notice.objects.all()
+        if not options['all']:
+            notices = notices.exclude(html_version=NOTICE_HTML_VERSION)
+        
+        last_id, total = 0, 0
+        while True:
+            rows = list(notices.filter(id__gt=last_id).order_by('id'
+                ).values_list('id', 'text')[:chunk_size])
+            if not rows:
+                break
+            connection.cursor().executemany(update_sql,
+                [(render_notice(text), NOTICE_HTML_VERSION, id)
+                    for id, text in rows])
+            transaction.commit_unless_managed()
+            
+            last_id = rows[-1][0]
+            total += len(rows)
+            if verbosity > 1:
+                print 'Rendered %d notices' % total
+        
+        if verbosity > 0:
+            print 'Rendered %d notices' % total
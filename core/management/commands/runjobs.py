@@ -0,0 +1,61 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from core.jobs import work, work_in_pool
+from core.models import Job
+
+
+class Command(NoArgsCommand):
+    """
+    Job queue worker. Forks a pool of worker processes that poll the Job
+    table, or works in this process with --processes=0.
+    """
+    help = "Run queued jobs"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', dest='processes', type='int', default=2,
+            help='Worker processes, 0 works in this process'),
+        make_option('--once', action='store_true', dest='once',
+            default=False, help='Exit when the queue is empty'),
+        make_option('--sleep', dest='sleep', type='float', default=1.0,
+            help='Seconds to wait when the queue is empty'),
+        make_option('--batch', dest='batch', type='int', default=10,
+            help='Jobs taken at once by a worker'),
+        make_option('--prune-days', dest='prune_days', type='int',
+            default=None, help='Remove jobs done this many days ago first'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        
+        if options['prune_days'] is not None:
+            Job.prune(datetime.now() - timedelta(days=options['prune_days']))
+        
+        args = (options['once'], options['sleep'], options['batch'])
+        if options['processes'] > 0:
+            done, failed = work_in_pool(options['processes'], *args)
+        else:
+            done, failed = work(*args)
+        
+        if verbosity > 0:
+            print 'Jobs done: %d, failed: %d' % (done, failed)
@@ -17,10 +17,148 @@ You should have received a copy of the GNU Affero General Public License
 along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Q, Sum
+
+
+POPULAR_NOTICES_CACHE_KEY = 'pythonica:popular_notices'
+TRENDING_TAGS_CACHE_KEY = 'pythonica:trending_tags'
+
 
 class NoticeManager(models.Manager):
     
     def public(self):
         return self.get_query_set().select_related().filter(
             is_restricted=False)
+    
+    def thread(self, notice):
+        """
+        Public notices of the conversation notice belongs to in one query
+        by thread, ordered depth first with thread_level set for each
+        """
+        root_id = notice.thread_id or notice.id
+        notices = list(self.public().filter(Q(id=root_id) |
+            Q(thread_id=root_id)).order_by('posted', 'id'))
+        
+        """ replies to hidden notices are shown at the top level """
+        shown = set([reply.id for reply in notices])
+        children = {}
+        for reply in notices:
+            parent_id = reply.parent_id in shown and reply.parent_id or None
+            children.setdefault(parent_id, []).append(reply)
+        
+        ordered, stack = [], [(root, 0) for root in
+            reversed(children.get(None, []))]
+        while stack:
+            reply, level = stack.pop()
+            reply.thread_level = level
+            ordered.append(reply)
+            stack.extend([(child, level + 1) for child in
+                reversed(children.get(reply.id, []))])
+        return ordered
+    
+    def popular(self):
+        """
+        Top POPULAR_NOTICES_COUNT public notices by favorites, precomputed
+        and cached for POPULAR_NOTICES_TIMEOUT seconds or until some notice
+        changes (see signals)
+        """
+        notices = cache.get(POPULAR_NOTICES_CACHE_KEY)
+        if notices is None:
+            notices = self._rank_popular()
+            cache.set(POPULAR_NOTICES_CACHE_KEY, notices,
+                settings.POPULAR_NOTICES_TIMEOUT)
+        return notices
+    
+    def _rank_popular(self):
+        count = settings.POPULAR_NOTICES_COUNT
+        half_life = settings.POPULAR_NOTICES_HALF_LIFE
+        notices = self.public().order_by('-favorited_count', '-posted')
+        
+        if not half_life:
+            return list(notices[:count])
+        
+        """ favorites halve every half_life hours, rank recent candidates """
+        now = datetime.now()
+        candidates = notices.filter(favorited_count__gt=0,
+            posted__gte=now - timedelta(hours=half_life * 8))[:count * 10]
+        
+        def score(notice):
+            age = now - notice.posted
+            hours = age.days * 24 + age.seconds / 3600.0
+            return notice.favorited_count * 0.5 ** (hours / half_life)
+        
+        return sorted(candidates, key=score, reverse=True)[:count]
+
+
+class TagManager(models.Manager):
+    
+    def trending(self):
+        """
+        Top TRENDING_TAGS_COUNT tags by uses in the last TRENDING_TAGS_WINDOW
+        hours, each bucket of uses halves every TRENDING_TAGS_HALF_LIFE
+        hours. Cached for TRENDING_TAGS_TIMEOUT seconds, scores are in the
+        trend attribute.
+        """
+        tags = cache.get(TRENDING_TAGS_CACHE_KEY)
+        if tags is None:
+            tags = self._rank_trending()
+            cache.set(TRENDING_TAGS_CACHE_KEY, tags,
+                settings.TRENDING_TAGS_TIMEOUT)
+        return tags
+    
+    def _rank_trending(self, now=None):
+        from models import TagTrend
+        count = settings.TRENDING_TAGS_COUNT
+        half_life = settings.TRENDING_TAGS_HALF_LIFE
+        now = now or datetime.now()
+        trends = TagTrend.objects.filter(bucket__gte=now - timedelta(
+            hours=settings.TRENDING_TAGS_WINDOW), bucket__lte=now)
+        
+        """ plain window sums pick candidates, decay ranks them """
+        candidates = half_life and count * 10 or count
+        totals = dict((row['tag'], row['total']) for row in
+            trends.values('tag').annotate(total=Sum('count')).order_by(
+                '-total')[:candidates])
+        
+        if half_life:
+            scores = dict.fromkeys(totals, 0.0)
+            half_size = timedelta(seconds=settings.TRENDING_TAGS_BUCKET / 2)
+            for tag_id, bucket, uses in trends.filter(
+                tag__in=totals.keys()).values_list('tag', 'bucket', 'count'):
+                age = now - bucket - half_size
+                hours = max(age.days * 24 + age.seconds / 3600.0, 0)
+                scores[tag_id] += uses * 0.5 ** (hours / half_life)
+        else:
+            scores = totals
+        
+        tags = self.in_bulk(scores.keys())
+        for tag_id, tag in tags.items():
+            tag.trend = scores[tag_id]
+        return sorted(tags.values(), key=lambda tag: (-tag.trend, tag.name)
+            )[:count]
+
+
+class InboxManager(models.Manager):
+    
+    def timeline(self, user):
+        return self.get_query_set().select_related('notice__author',
+            'notice__via').filter(user=user)
+
+
+class MentionManager(models.Manager):
+    
+    def timeline(self, user):
+        return self.get_query_set().select_related('notice__author',
+            'notice__via').filter(user=user)
+
+
+class TagTimelineManager(models.Manager):
+    
+    def timeline(self, tag):
+        return self.get_query_set().select_related('notice__author',
+            'notice__via').filter(tag=tag)
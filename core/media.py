@@ -0,0 +1,176 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: streaming file view for MEDIA_ROOT and STATIC_ROOT, a drop-in for
+    django.views.static.serve that never reads a whole file into memory
+"""
+
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+import time
+import urllib
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+
+CHUNK_SIZE = 64 * 1024
+
+""" a year, fingerprinted names never change content """
+FAR_FUTURE = 60 * 60 * 24 * 365
+
+_range_regex = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _safe_path(document_root, path):
+    """ path below document_root, dot parts and drives stripped """
+    parts = []
+    for part in posixpath.normpath(urllib.unquote(path)).split('/'):
+        drive, part = os.path.splitdrive(part)
+        part = os.path.split(part)[1]
+        if part and part not in (os.curdir, os.pardir):
+            parts.append(part)
+    return os.path.join(document_root, *parts)
+
+
+def _parse_range(header, size):
+    """
+    (start, end) of the byte range asked for, end inclusive. None for a
+    full response (no header, several ranges, syntax errors), ValueError
+    when the range is out of the file.
+    """
+    match = header and _range_regex.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        """ suffix range, last bytes of the file """
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end or size - 1), size - 1)
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+class FileChunks(object):
+    """
+    Iterates length bytes of a file from start in CHUNK_SIZE chunks, closes
+    the file when done
+    """
+    
+    def __init__(self, path, start, length):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = length
+    
+    def __iter__(self):
+        try:
+            while self.remaining > 0:
+                chunk = self.file.read(min(CHUNK_SIZE, self.remaining))
+                if not chunk:
+                    break
+                self.remaining -= len(chunk)
+                yield chunk
+        finally:
+            self.close()
+    
+    def close(self):
+        self.file.close()
+
+
+def serve(request, path, document_root=None, expires=None):
+    """
+    Serve the file at path below document_root in chunks, with Range (one
+    range) and If-Modified-Since support. MEDIA_SENDFILE_HEADER hands the
+    body over to the front-end server: X-Sendfile gets the file path,
+    X-Accel-Redirect gets MEDIA_ACCEL_REDIRECT_PREFIX joined with the
+    request path (an nginx internal location).
+    
+    expires is max-age in seconds for Cache-Control and Expires headers.
+    """
+    full_path = _safe_path(document_root, path)
+    try:
+        stat_result = os.stat(full_path)
+    except OSError:
+        raise Http404('"%s" does not exist' % path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404('"%s" is not a file' % path)
+    mtime, size = stat_result[stat.ST_MTIME], stat_result.st_size
+    
+    mimetype, encoding = mimetypes.guess_type(full_path)
+    mimetype = mimetype or 'application/octet-stream'
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+        mtime, size):
+        response = HttpResponseNotModified(mimetype=mimetype)
+    elif settings.MEDIA_SENDFILE_HEADER:
+        response = _sendfile(request, full_path, mimetype)
+    else:
+        response = _stream(request, full_path, mimetype, size, mtime)
+    
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Last-Modified'] = http_date(mtime)
+    if expires is not None:
+        response['Cache-Control'] = 'public, max-age=%d' % expires
+        response['Expires'] = http_date(time.time() + expires)
+    return response
+
+
+def _sendfile(request, full_path, mimetype):
+    response = HttpResponse(mimetype=mimetype)
+    header = settings.MEDIA_SENDFILE_HEADER
+    if header.lower() == 'x-accel-redirect':
+        response[header] = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') \
+            + request.path
+    else:
+        response[header] = full_path
+    return response
+
+
+def _stream(request, full_path, mimetype, size, mtime):
+    """ If-Range may only name the current Last-Modified date """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    try:
+        if if_range and if_range != http_date(mtime):
+            byte_range = None
+        else:
+            byte_range = _parse_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416, mimetype=mimetype)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1
+    if request.method == 'HEAD':
+        response = HttpResponse(mimetype=mimetype)
+    else:
+        response = HttpResponse(FileChunks(full_path, start, length),
+            mimetype=mimetype)
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -17,18 +17,66 @@ You should have received a copy of the GNU Affero General Public License
 along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Q
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
-from managers import NoticeManager
-from notices import get_tags_groups_users
+from autocomplete import autocomplete
+from conditional import touch_users
+from counters import counters, update_counter
+from graph import graph
+from jobs import after_commit, commit_on_success_after, enqueue
+from managers import NoticeManager, TagManager, InboxManager, \
+    MentionManager, TagTimelineManager
+from notices import get_tags_groups_users, render_notice, \
+    NOTICE_HTML_VERSION
+from search import index_notices
+from trending import trends
+
+
+def _insert_many(model, fields, rows):
+    """
+    Insert rows with a single executemany, the ORM inserts one by one
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    opts = model._meta
+    columns = [qn(opts.get_field(field).column) for field in fields]
+    cursor = connection.cursor()
+    cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(opts.db_table), ', '.join(columns), ', '.join(['%s'] * len(columns))
+    ), rows)
+    transaction.commit_unless_managed()
+
+
+def _insert_many_to_many(instance, name, ids):
+    """
+    Add related objects by id to the empty many-to-many field of instance
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    qn = connection.ops.quote_name
+    field = instance._meta.get_field(name)
+    cursor = connection.cursor()
+    cursor.executemany('INSERT INTO %s (%s, %s) VALUES (%%s, %%s)' % (
+        qn(field.m2m_db_table()), qn(field.m2m_column_name()),
+        qn(field.m2m_reverse_name())), [(instance.id, id) for id in ids])
+    transaction.commit_unless_managed()
 
 
 class Tag(models.Model):
     """
     @note: tags for notices, groups, users  
+    @note: no default ordering, use_count is a lifetime total, see
+        Tag.objects.trending for what is popular now
     """
+    objects = TagManager()
     
     name = models.CharField(_('tag name'), max_length=140, unique=True)
     use_count = models.PositiveIntegerField(_('tag use count'), default=0)
@@ -38,12 +86,37 @@ class Tag(models.Model):
     
     @models.permalink
     def get_absolute_url(self):
-        return ('tag', [self.name,])
+        return ('pythonica-tag', [self.name,])
     
     class Meta():
         verbose_name = _('tag')
         verbose_name_plural = _('tags')
-        ordering = ['-use_count',]
+
+
+def _insert_tags(names):
+    """
+    Insert tags of names, a tag inserted meanwhile by a concurrent notice
+    is left as it is
+    """
+    sid = transaction.savepoint()
+    try:
+        _insert_many(Tag, ('name', 'use_count'), ((name, 0) for name in names))
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+    else:
+        transaction.savepoint_commit(sid)
+        return
+    
+    """ some name is taken, insert the others one by one """
+    for name in set(names).difference(Tag.objects.filter(
+        name__in=names).values_list('name', flat=True)):
+        sid = transaction.savepoint()
+        try:
+            _insert_many(Tag, ('name', 'use_count'), [(name, 0)])
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+        else:
+            transaction.savepoint_commit(sid)
 
 
 class Group(models.Model):
@@ -118,7 +191,11 @@ class Device(models.Model):
 class Notice(models.Model):
     """
     @note: Notice itself
-    @todo: Make templatetag for notice text formating
+    @note: text is rendered to html once by save, see get_html
+    @note: thread and parent are plain ids, not foreign keys: Django
+        cascades deletes through nullable foreign keys too, that would
+        delete replies with the notice they reply to. Replies are detached
+        by signals before a notice is deleted, see detach.
     @todo: Automate notice favorites count
     """
     objects = NoticeManager()
@@ -138,45 +215,207 @@ class Notice(models.Model):
         default=False)
     favorited_count = models.PositiveIntegerField(_('notice favorites count'),
         default=0)
+    thread_id = models.PositiveIntegerField(_('notice thread root'),
+        null=True, blank=True, db_index=True)
+    parent_id = models.PositiveIntegerField(_('notice thread parent'),
+        null=True, blank=True, db_index=True)
+    depth = models.PositiveIntegerField(_('notice depth in thread'),
+        default=0)
+    html = models.TextField(_('notice rendered text'), blank=True)
+    html_version = models.PositiveIntegerField(
+        _('notice rendered text format version'), default=0)
     
+    @commit_on_success_after
     def save(self, *args, **kwargs):
+        """
+        @note: number of queries does not depend on number of tags, groups
+            and users in the notice text
+        @note: notice goes to the thread of parent_id if it is set, or of
+            the latest notice it replies to, roots have no thread
+        """
+        
+        self.html = render_notice(self.text)
+        self.html_version = NOTICE_HTML_VERSION
+        
+        if self.id is not None:
+            super(Notice, self).save(*args, **kwargs)
+            """ text may have changed, restricted notices leave the index """
+            after_commit(index_notices, [self], True)
+            return
+        
+        """ unpack tags, groups and users from notice text """
+        tags, groups, users = map(set, get_tags_groups_users(self.text))
+        
+        """ groups must be known before insert to restrict notice """
+        groups = groups and list(Group.objects.filter(name__in=groups))
+        if filter(lambda group: group.is_closed, groups):
+            self.is_restricted = True
+        
+        """ users are mentioned, replies go to their last notices """
+        mentions = users and list(UserInfo.objects.filter(
+            user__username__in=users).values_list('user', 'last_id')) or []
+        mentioned = set([row[0] for row in mentions])
+        last_ids = [row[1] for row in mentions if row[1] is not None]
+        replied = last_ids and list(Notice.objects.filter(
+            id__in=last_ids).values_list('id', 'thread_id', 'depth')) or []
+        
+        """
+        explicit parent is replied to, its author is mentioned, a parent
+        the author can not see is ignored
+        """
+        parent = []
+        if self.parent_id is not None:
+            q_visible = Q(is_restricted=False) | Q(author=self.author_id) | \
+                Q(id__in=Notice.objects.filter(
+                    groups__users=self.author_id).values('id'))
+            parent = list(Notice.objects.filter(q_visible, id=self.parent_id
+                ).values_list('id', 'thread_id', 'depth', 'author'))
+            mentioned.update([row[3] for row in parent])
+            parent = [row[:3] for row in parent]
+            replied.extend(parent)
+        if not parent:
+            parent = replied and [max(replied)]
+        if parent:
+            self.parent_id, thread_id, depth = parent[0]
+            self.thread_id, self.depth = thread_id or self.parent_id, depth + 1
+        else:
+            self.parent_id = None
         
         """ save self to take id """
         super(Notice, self).save(*args, **kwargs)
         
-        """ unpack tags, groups and users from notice text """
-        tags, groups, users = get_tags_groups_users(self.text)
+        """ the rest may wait, see process """
+        enqueue('core.models.process_notice', (self.id,
+            sorted(set([row[0] for row in replied])),
+            sorted(mentioned)), key='notice:%d' % self.id)
+    
+    def process(self, replied_ids, mentioned_ids):
+        """
+        Post-save work of a new notice: tags, groups, replies, mentions,
+        author counters, home timelines and search index. Queued by save,
+        replies and mentions are resolved by save already.
+        """
+        tags, groups, users = map(set, get_tags_groups_users(self.text))
+        groups = groups and list(Group.objects.filter(name__in=groups))
         
         """ process tags """
-        self.tags = Tag.objects.filter(name__in=tags)
-        for tag in tags:
-            if tag not in map(lambda t: t.name, self.tags.all()):
-                self.tags.create(name=tag)
-        self.tags.update(use_count=models.F('use_count')+1)
+        if tags:
+            tag_ids = dict(Tag.objects.filter(
+                name__in=tags).values_list('name', 'id'))
+            new_tags = tags.difference(tag_ids)
+            if new_tags:
+                _insert_tags(new_tags)
+                tag_ids.update(Tag.objects.filter(
+                    name__in=new_tags).values_list('name', 'id'))
+                for name in new_tags:
+                    after_commit(autocomplete.tags.set, tag_ids[name], name)
+            _insert_many_to_many(self, 'tags', tag_ids.values())
+            after_commit(counters.add, Tag, 'use_count', tag_ids.values())
+            after_commit(autocomplete.tags.adjust, tag_ids.values(), 1)
+            if not self.is_restricted:
+                _insert_many(TagTimeline, ('tag', 'notice', 'posted'),
+                    ((tag_id, self.id, self.posted)
+                        for tag_id in tag_ids.values()))
+                after_commit(trends.add, tag_ids.values(), self.posted)
         
         """ process groups """
-        self.groups = Group.objects.filter(name__in=groups)
-        if self.groups.filter(is_closed=True).count() > 0:
-            self.is_restricted = True
+        if groups:
+            group_ids = [group.id for group in groups]
+            _insert_many_to_many(self, 'groups', group_ids)
+            after_commit(counters.add, Group, 'notices_count', group_ids)
+        
+        after_commit(counters.add, Device, 'notices_count', [self.via_id])
         
         """ process users """
-        user_info_list = UserInfo.objects.filter(user__username__in=users)
-        self.in_reply_to = (user_info.last for user_info in user_info_list)
+        _insert_many_to_many(self, 'in_reply_to', replied_ids)
+        
+        """ record mentions, users that block author never get them """
+        mentioned = set(mentioned_ids)
+        mentioned.discard(self.author_id)
+        mentioned.difference_update(Block.blocker_ids(self.author, mentioned))
+        if mentioned and self.is_restricted:
+            mentioned.intersection_update(GroupUser.objects.filter(
+                group__in=groups, user__in=mentioned).values_list('user',
+                    flat=True))
+        Mention.record(self, mentioned)
+        
+        """
+        count this notice for author and mark it last, unless a newer
+        notice got processed first
+        """
+        UserInfo.objects.filter(user=self.author_id).update(
+            notices_count=models.F('notices_count')+1)
+        UserInfo.objects.filter(Q(last_id__isnull=True) |
+            Q(last_id__lt=self.id), user=self.author_id).update(
+                last_id=self.id)
+        
+        """ push self to the readers home timelines """
+        Inbox.deliver(self)
+        
+        if not self.is_restricted:
+            after_commit(index_notices, [self], True)
+    
+    def get_html(self):
+        """
+        Rendered text, rows rendered by older NOTICE_HTML_VERSION are
+        rendered again and stored on the way
+        """
+        if self.html_version != NOTICE_HTML_VERSION:
+            self.html = render_notice(self.text)
+            self.html_version = NOTICE_HTML_VERSION
+            Notice.objects.filter(id=self.id).update(html=self.html,
+                html_version=self.html_version)
+        return mark_safe(self.html)
+    
+    def detach(self):
+        """
+        Called by signals for every notice about to be deleted, however it
+        is deleted: author loses it as last notice, replies move one level
+        up, replies to a root become roots of their own threads.
         
-        """ mark this notice last for author """
-        self.author.info.last = self
-        self.author.info.save()
+        @note: notices deleted together may have been loaded before the
+            others got detached, thread and parent are read again
+        """
+        UserInfo.objects.filter(last_id=self.id).update(last_id=None)
         
-        """ save self again and """
-        super(Notice, self).save()
+        rows = Notice.objects.filter(id=self.id).values_list('thread_id',
+            'parent_id')
+        if not rows:
+            return
+        self.thread_id, self.parent_id = rows[0]
         
+        root_id = self.thread_id or self.id
+        children = {}
+        for id, parent_id in Notice.objects.filter(Q(id=root_id) |
+            Q(thread_id=root_id)).values_list('id', 'parent_id'):
+            children.setdefault(parent_id, []).append(id)
+        
+        def descendants(id):
+            ids, stack = [], list(children.get(id, ()))
+            while stack:
+                ids.append(stack.pop())
+                stack.extend(children.get(ids[-1], ()))
+            return ids
+        
+        notices = Notice.objects.all()
+        if self.thread_id:
+            notices.filter(id__in=descendants(self.id)).update(
+                depth=models.F('depth') - 1)
+            notices.filter(parent_id=self.id).update(
+                parent_id=self.parent_id)
+        else:
+            for child_id in children.get(self.id, ()):
+                notices.filter(id__in=descendants(child_id)).update(
+                    thread_id=child_id, depth=models.F('depth') - 1)
+                notices.filter(id=child_id).update(thread_id=None,
+                    parent_id=None, depth=0)
     
     def __unicode__(self):
         return u'(%s) %s: %s' % (self.id, self.posted, self.text)
     
     @models.permalink
     def get_absolute_url(self):
-        return ('notice', [self.id,])
+        return ('pythonica-notice', [self.id,])
     
     class Meta():
         verbose_name = _('notice')
@@ -196,9 +435,25 @@ class Follow(models.Model):
     
     @classmethod
     def is_subscribed(cls, follower, followed):
+        if graph.enabled:
+            return graph.is_following(follower.id, followed.id)
         return bool(
             cls.objects.filter(follower=follower, followed=followed).count())
     
+    @classmethod
+    def followed_ids(cls, follower, followed_ids):
+        """
+        Ids from followed_ids that follower is subscribed to, in one query
+        """
+        followed_ids = set(followed_ids)
+        if not followed_ids:
+            return set()
+        if graph.enabled:
+            return set(id for id in followed_ids
+                if graph.is_following(follower.id, id))
+        return set(cls.objects.filter(follower=follower,
+            followed__in=followed_ids).values_list('followed', flat=True))
+    
     @classmethod
     def subscribe(cls, follower, followed):
         if Block.is_blocked(followed, follower):
@@ -207,6 +462,9 @@ class Follow(models.Model):
             follow, created = cls.objects.get_or_create(
                 follower=follower, followed=followed)
             del follow
+            if created:
+                Inbox.backfill(follower, followed,
+                    settings.INBOX_FOLLOW_BACKFILL)
             return created
     
     @classmethod
@@ -216,6 +474,7 @@ class Follow(models.Model):
         except cls.DoesNotExist:
             return False
         finally:
+            Inbox.rebuild(follower, author=followed)
             return True
     
     def __unicode__(self):
@@ -243,15 +502,48 @@ class Block(models.Model):
     
     @classmethod
     def is_blocked(cls, blocker, blocked):
+        if graph.enabled:
+            return graph.is_blocking(blocker.id, blocked.id)
         return bool(
             cls.objects.filter(blocker=blocker, blocked=blocked).count())
     
+    @classmethod
+    def blocked_ids(cls, blocker, blocked_ids):
+        """
+        Ids from blocked_ids that blocker blocks, in one query
+        """
+        blocked_ids = set(blocked_ids)
+        if not blocked_ids:
+            return set()
+        if graph.enabled:
+            return set(id for id in blocked_ids
+                if graph.is_blocking(blocker.id, id))
+        return set(cls.objects.filter(blocker=blocker,
+            blocked__in=blocked_ids).values_list('blocked', flat=True))
+    
+    @classmethod
+    def blocker_ids(cls, blocked, blocker_ids):
+        """
+        Ids from blocker_ids that block blocked, in one query
+        """
+        blocker_ids = set(blocker_ids)
+        if not blocker_ids:
+            return set()
+        if graph.enabled:
+            return set(id for id in blocker_ids
+                if graph.is_blocking(id, blocked.id))
+        return set(cls.objects.filter(blocked=blocked,
+            blocker__in=blocker_ids).values_list('blocker', flat=True))
+    
     @classmethod
     def block(cls, blocker, blocked):
-        Follow.unsubscribe(blocker, blocked)
+        """ unsubscribe as Follow.unsubscribe, inbox is rebuilt once below """
+        Follow.objects.filter(follower=blocker, followed=blocked).delete()
         block, created = cls.objects.get_or_create(
             blocker=blocker, blocked=blocked)
         del block
+        Mention.objects.filter(user=blocker, notice__author=blocked).delete()
+        Inbox.rebuild(blocker, author=blocked)
         return created
     
     @classmethod
@@ -261,6 +553,7 @@ class Block(models.Model):
         except cls.DoesNotExist:
             return False
         finally:
+            Inbox.rebuild(blocker, author=blocked)
             return True
     
     def __unicode__(self):
@@ -276,16 +569,25 @@ class Block(models.Model):
 class UserInfo(models.Model):
     """
     @note: pythonica specific user info
+    @note: last notice is a plain id for the reason thread of Notice is
     @todo: add avatars
     """
     
     user = models.OneToOneField(User, related_name='info',
         verbose_name=_('user'))
-    last = models.ForeignKey(Notice, null=True, blank=True,
-        verbose_name=_('user last notice'))
+    last_id = models.PositiveIntegerField(_('user last notice'), null=True,
+        blank=True)
     is_featured = models.BooleanField(_('is user featured'), default=False)
     favorites = models.ManyToManyField(Notice, related_name='favorited',
         verbose_name=_('user favorite notices'), blank=True)
+    followers_count = models.PositiveIntegerField(_('user followers count'),
+        default=0)
+    following_count = models.PositiveIntegerField(_('user following count'),
+        default=0)
+    notices_count = models.PositiveIntegerField(_('user notices count'),
+        default=0)
+    unread_mentions_count = models.PositiveIntegerField(
+        _('user unread mentions count'), default=0)
     
     def __unicode__(self):
         return u'%s' % self.user
@@ -298,3 +600,296 @@ class UserInfo(models.Model):
         verbose_name = _('user info')
         verbose_name_plural = _('user info')
         ordering = ['user',]
+
+
+class Inbox(models.Model):
+    """
+    @note: materialized home timeline, one row per notice user should see.
+        Rows are pushed by Notice.save (fan-out on write) so the timeline is a
+        plain (user, posted) index range scan instead of a join over follows,
+        replies, groups and blocks.
+    @note: following a user adds INBOX_FOLLOW_BACKFILL newest notices of
+        that user only, rebuild brings older ones too
+    @note: (user, posted, notice) index is created by sql/inbox.sql
+    """
+    objects = InboxManager()
+    
+    user = models.ForeignKey(User, related_name='inbox',
+        verbose_name=_('inbox owner'))
+    notice = models.ForeignKey(Notice, related_name='inbox',
+        verbose_name=_('inbox notice'))
+    posted = models.DateTimeField(_('notice posted at'))
+    
+    @classmethod
+    def timeline_query(cls, user):
+        """
+        Notices that belong to user home timeline, computed from scratch.
+        
+        ((own or followed or replies) and public) or from_groups
+        exclude blocked do not repeat one twice
+        
+        @note: multi-valued branches are subqueries, or-ing joins over them
+            drops rows that have no match in some branch
+        """
+        q_public = Q(is_restricted=False)
+        q_own = Q(author=user)
+        q_followed = Q(author__in=Follow.objects.filter(
+            follower=user).values('followed'))
+        q_replies = Q(id__in=Mention.objects.filter(
+            user=user).values('notice'))
+        q_from_groups = Q(id__in=Notice.objects.filter(
+            groups__users=user).values('id'))
+        q_blocked = Q(author__in=Block.objects.filter(
+            blocker=user).values('blocked'))
+        
+        return Notice.objects.filter(Q((q_own | q_followed | q_replies),
+            q_public) | q_from_groups).exclude(q_blocked)
+    
+    @classmethod
+    def deliver(cls, notice):
+        """
+        Push notice to the inboxes of all its readers: author, author
+        followers and mentioned users (public notices only) and members of
+        notice groups, except users that block the author.
+        """
+        readers = set(GroupUser.objects.filter(
+            group__notice=notice).values_list('user', flat=True))
+        
+        if not notice.is_restricted:
+            readers.add(notice.author_id)
+            readers.update(Follow.objects.filter(
+                followed=notice.author_id).values_list('follower', flat=True))
+            readers.update(Mention.objects.filter(
+                notice=notice).values_list('user', flat=True))
+        
+        readers.difference_update(Block.objects.filter(
+            blocked=notice.author_id).values_list('blocker', flat=True))
+        readers.difference_update(cls.objects.filter(
+            notice=notice).values_list('user', flat=True))
+        
+        _insert_many(cls, ('user', 'notice', 'posted'),
+            ((user_id, notice.id, notice.posted) for user_id in readers))
+    
+    @classmethod
+    def rebuild(cls, user, author=None):
+        """
+        Recompute user inbox from scratch, only for notices of author if given
+        """
+        entries = cls.objects.filter(user=user)
+        notices = cls.timeline_query(user)
+        if author is not None:
+            entries = entries.filter(notice__author=author)
+            notices = notices.filter(author=author)
+        
+        entries.delete()
+        _insert_many(cls, ('user', 'notice', 'posted'),
+            ((user.id, notice_id, posted)
+                for notice_id, posted in notices.values_list('id', 'posted')))
+        touch_users([user.id])
+    
+    @classmethod
+    def backfill(cls, user, author, limit):
+        """
+        Add the newest limit notices of author to user inbox, so following
+        a prolific user costs a bounded insert
+        """
+        notices = cls.timeline_query(user).filter(author=author).exclude(
+            id__in=cls.objects.filter(user=user).values('notice')
+            ).order_by('-posted', '-id')[:limit]
+        _insert_many(cls, ('user', 'notice', 'posted'),
+            ((user.id, notice_id, posted)
+                for notice_id, posted in notices.values_list('id', 'posted')))
+        touch_users([user.id])
+    
+    def __unicode__(self):
+        return u'%s for %s' % (self.notice_id, self.user)
+    
+    class Meta():
+        unique_together = ('user', 'notice',)
+        verbose_name = _('inbox entry')
+        verbose_name_plural = _('inbox entries')
+        ordering = ['-posted', '-notice',]
+
+
+class Mention(models.Model):
+    """
+    @note: materialized mentions and replies, one row per notice that
+        mentions user or replies to user notice. Written by Notice.save
+        except for users that block the author, so the replies page is a
+        plain (user, posted) index range scan.
+    @note: (user, posted, notice) index is created by sql/mention.sql
+    """
+    objects = MentionManager()
+    
+    user = models.ForeignKey(User, related_name='mentions',
+        verbose_name=_('mentioned user'))
+    notice = models.ForeignKey(Notice, related_name='mentions',
+        verbose_name=_('mentioning notice'))
+    posted = models.DateTimeField(_('notice posted at'))
+    is_read = models.BooleanField(_('is mention read'), default=False)
+    
+    @classmethod
+    def record(cls, notice, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        _insert_many(cls, ('user', 'notice', 'posted', 'is_read'),
+            ((user_id, notice.id, notice.posted, False)
+                for user_id in user_ids))
+        UserInfo.objects.filter(user__in=user_ids).update(
+            unread_mentions_count=models.F('unread_mentions_count') + 1)
+        touch_users(user_ids)
+    
+    @classmethod
+    def mark_read(cls, user, mentions):
+        """ mark shown mentions read, objects keep their is_read as shown """
+        ids = [mention.id for mention in mentions if not mention.is_read]
+        if ids:
+            cls.objects.filter(id__in=ids).update(is_read=True)
+            update_counter(UserInfo.objects.filter(user=user),
+                'unread_mentions_count', -len(ids))
+            touch_users([user.id])
+    
+    @classmethod
+    def rebuild(cls, user):
+        """
+        Recompute user mentions from replies to user notices, all read
+        """
+        q_visible = Q(is_restricted=False) | Q(id__in=Notice.objects.filter(
+            groups__users=user).values('id'))
+        q_replies = Q(id__in=Notice.objects.filter(
+            in_reply_to__author=user).values('id'))
+        q_blocked = Q(author__in=Block.objects.filter(
+            blocker=user).values('blocked'))
+        
+        notices = Notice.objects.filter(q_visible, q_replies).exclude(
+            author=user).exclude(q_blocked)
+        
+        cls.objects.filter(user=user).delete()
+        _insert_many(cls, ('user', 'notice', 'posted', 'is_read'),
+            ((user.id, notice_id, posted, True)
+                for notice_id, posted in notices.values_list('id', 'posted')))
+        UserInfo.objects.filter(user=user).update(unread_mentions_count=0)
+        touch_users([user.id])
+    
+    def __unicode__(self):
+        return u'%s mentions %s' % (self.notice_id, self.user)
+    
+    class Meta():
+        unique_together = ('user', 'notice',)
+        verbose_name = _('mention')
+        verbose_name_plural = _('mentions')
+        ordering = ['-posted', '-notice',]
+
+
+class TagTimeline(models.Model):
+    """
+    @note: inverted index of public notices by tag, filled by Notice.save so
+        tag page is a (tag, posted, notice) index range scan instead of
+        a join through notice tags sorted by posted
+    @note: (tag, posted, notice) index is created by sql/tagtimeline.sql
+    """
+    objects = TagTimelineManager()
+    
+    tag = models.ForeignKey(Tag, related_name='timeline',
+        verbose_name=_('tag'))
+    notice = models.ForeignKey(Notice, related_name='tag_timeline',
+        verbose_name=_('tagged notice'))
+    posted = models.DateTimeField(_('notice posted at'))
+    
+    @classmethod
+    def rebuild(cls, tag):
+        cls.objects.filter(tag=tag).delete()
+        _insert_many(cls, ('tag', 'notice', 'posted'),
+            ((tag.id, notice_id, posted) for notice_id, posted in
+                tag.notice_set.filter(is_restricted=False).values_list(
+                    'id', 'posted')))
+    
+    def __unicode__(self):
+        return u'%s tagged %s' % (self.notice_id, self.tag)
+    
+    class Meta():
+        unique_together = ('tag', 'notice',)
+        verbose_name = _('tag timeline entry')
+        verbose_name_plural = _('tag timeline entries')
+        ordering = ['-posted', '-notice',]
+
+
+class TagTrend(models.Model):
+    """
+    @note: public uses of a tag in one TRENDING_TAGS_BUCKET seconds long time
+        bucket, written by trending.TrendBuffer from Notice.save. Buckets
+        older than the trending window are removed by prunetagtrends.
+    """
+    
+    tag = models.ForeignKey(Tag, related_name='trends',
+        verbose_name=_('tag'))
+    bucket = models.DateTimeField(_('bucket start'), db_index=True)
+    count = models.PositiveIntegerField(_('tag uses'), default=0)
+    
+    @classmethod
+    def prune(cls, before):
+        cls.objects.filter(bucket__lt=before).delete()
+    
+    def __unicode__(self):
+        return u'%s at %s: %s' % (self.tag, self.bucket, self.count)
+    
+    class Meta():
+        unique_together = ('tag', 'bucket',)
+        verbose_name = _('tag trend')
+        verbose_name_plural = _('tag trends')
+
+
+def process_notice(notice_id, replied_ids, mentioned_ids):
+    """ job of Notice.save, deleted notices need nothing """
+    try:
+        notice = Notice.objects.select_related('author').get(id=notice_id)
+    except Notice.DoesNotExist:
+        return
+    notice.process(replied_ids, mentioned_ids)
+
+
+class Job(models.Model):
+    """
+    @note: queued call of a function by dotted path with JSON arguments,
+        run by the runjobs command (see jobs.py). Jobs of the same key are
+        queued once only.
+    @note: (status, run_at) index is created by sql/job.sql
+    """
+    
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_FAILED = 3
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('pending')),
+        (STATUS_RUNNING, _('running')),
+        (STATUS_DONE, _('done')),
+        (STATUS_FAILED, _('failed')),
+    )
+    
+    key = models.CharField(_('job idempotency key'), max_length=255,
+        unique=True, null=True, blank=True)
+    name = models.CharField(_('job function'), max_length=255)
+    args = models.TextField(_('job arguments'))
+    status = models.PositiveSmallIntegerField(_('job status'),
+        choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(_('job attempts'), default=0)
+    run_at = models.DateTimeField(_('job runs not before'))
+    locked_until = models.DateTimeField(_('job is taken until'), null=True,
+        blank=True)
+    error = models.TextField(_('job last error'), blank=True)
+    created = models.DateTimeField(_('job created at'), auto_now_add=True)
+    
+    @classmethod
+    def prune(cls, before):
+        """ done jobs are kept for their keys, remove old ones """
+        cls.objects.filter(status=cls.STATUS_DONE, created__lt=before
+            ).delete()
+    
+    def __unicode__(self):
+        return u'%s%s' % (self.name, self.args)
+    
+    class Meta():
+        verbose_name = _('job')
+        verbose_name_plural = _('jobs')
@@ -20,12 +20,21 @@ along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
 import re
 
 from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
 
 _notice_regex_str = r'(#(?P<tag>%s))|(!(?P<group>%s))|(@(?P<username>%s))' % \
     (settings.HASHTAG_REGEX, settings.HASHTAG_REGEX, settings.USERNAME_REGEX)
 notice_regex = re.compile(_notice_regex_str)
 
+""" bump when render_notice output changes, stored HTML is then stale """
+NOTICE_HTML_VERSION = 1
+
+_url_regex_str = r'(?P<url>https?://[^\s<>"]*[^\s<>"\.,;:!?\)\]\'])'
+_html_regex = re.compile('%s|%s' % (_url_regex_str, _notice_regex_str))
+
 
 def get_tags_groups_users(notice_text):
     """
@@ -36,3 +45,34 @@ def get_tags_groups_users(notice_text):
         return map(lambda group: filter(bool, group), zip(*match)[1::2])
     else:
         return (tuple(), tuple(), tuple(),)
+
+
+def render_notice(notice_text):
+    """
+    Escaped notice text with links to urls, #tags and @users profiles
+    
+    @todo: link !groups when they have pages
+    """
+    def link(match):
+        url, tag, group, username = match.group('url', 'tag', 'group',
+            'username')
+        if url:
+            return u'<a href="%s" rel="nofollow external">%s</a>' % (
+                escape(url), escape(url))
+        elif tag:
+            return u'#<a href="%s" rel="tag">%s</a>' % (
+                reverse('pythonica-tag', args=[tag]), escape(tag))
+        elif group:
+            return u'!<span class="group">%s</span>' % escape(group)
+        else:
+            return u'@<a href="%s" class="url">%s</a>' % (
+                reverse('pythonica-profile', args=[username]),
+                escape(username))
+    
+    html, end = [], 0
+    for match in _html_regex.finditer(notice_text):
+        html.append(escape(notice_text[end:match.start()]))
+        html.append(link(match))
+        end = match.end()
+    html.append(escape(notice_text[end:]))
+    return mark_safe(u''.join(html))
@@ -0,0 +1,133 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: whole page cache for anonymous visitors, see decorators.cache_anonymous
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import translation
+from django.utils.hashcompat import md5_constructor
+
+
+PUBLIC_VERSION_KEY = 'pythonica:pages_version'
+USER_VERSION_KEY = 'pythonica:pages_version:%d'
+PAGE_KEY = 'pythonica:page:%s'
+LOCK_KEY = 'pythonica:page_lock:%s'
+
+""" 30 days is memcached maximum, lost versions start over anyway """
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+""" how often waiting requests look for the page being rendered """
+_POLL_INTERVAL = 0.05
+
+
+def _new_version():
+    return '%.6f' % time.time()
+
+
+class PageCache(object):
+    """
+    Rendered pages by path and language along with versions of the public
+    timeline and of the users shown, versions are bumped by signals.
+    
+    A page that is missing, expired or of old versions is rendered by one
+    request only, the one that gets the lock. Others are given the page
+    they would have got a moment ago if there is one, or wait up to
+    lock_timeout seconds for the new one and render it themselves after
+    that.
+    
+    @note: pages are kept for timeout seconds more after they expire, to
+        be given out while the lock holder renders
+    """
+    
+    def __init__(self, timeout, lock_timeout):
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+    
+    def bump(self, user_ids=(), public=False):
+        version = _new_version()
+        keys = [USER_VERSION_KEY % user_id for user_id in set(user_ids)]
+        if public:
+            keys.append(PUBLIC_VERSION_KEY)
+        for key in keys:
+            cache.set(key, version, VERSION_TIMEOUT)
+    
+    def _versions(self, cached, version_keys):
+        """ versions lost by the cache start over, old pages miss """
+        versions = []
+        for key in version_keys:
+            version = cached.get(key)
+            if version is None:
+                version = _new_version()
+                if not cache.add(key, version, VERSION_TIMEOUT):
+                    version = cache.get(key, version)
+            versions.append(version)
+        return tuple(versions)
+    
+    def get_or_render(self, request, user_ids, render):
+        """
+        Cached page for request, render() gives the response otherwise
+        """
+        name = md5_constructor('%s:%s' % (request.path,
+            translation.get_language())).hexdigest()
+        key, lock_key = PAGE_KEY % name, LOCK_KEY % name
+        version_keys = [PUBLIC_VERSION_KEY] + [USER_VERSION_KEY % user_id
+            for user_id in user_ids]
+        
+        cached = cache.get_many([key] + version_keys)
+        versions = self._versions(cached, version_keys)
+        page = cached.get(key)
+        if page is not None and page[0] == versions and page[1] > time.time():
+            return self._response(page)
+        
+        if cache.add(lock_key, 1, self.lock_timeout):
+            try:
+                response = render()
+                """ pages with csrf tokens belong to one session """
+                if response.status_code == 200 and \
+                    not getattr(request, 'csrf_token_used', False):
+                    cache.set(key, (versions, time.time() + self.timeout,
+                        response.content, response['Content-Type']),
+                        self.timeout * 2)
+            finally:
+                cache.delete(lock_key)
+            return response
+        
+        if page is not None:
+            return self._response(page)
+        
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(_POLL_INTERVAL)
+            page = cache.get(key)
+            if page is not None and page[0] == versions:
+                return self._response(page)
+            if cache.get(lock_key) is None:
+                break
+        return render()
+    
+    def _response(self, page):
+        return HttpResponse(page[2], content_type=page[3])
+
+
+pages = PageCache(settings.ANONYMOUS_PAGE_CACHE_TIMEOUT,
+    settings.ANONYMOUS_PAGE_CACHE_LOCK_TIMEOUT)
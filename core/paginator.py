@@ -0,0 +1,129 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from datetime import datetime
+
+from django.db.models import Q
+
+
+CURSOR_REGEX = r'\d{20}-\d+'
+_CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def make_cursor(posted, id):
+    return '%s-%d' % (posted.strftime(_CURSOR_DATE_FORMAT), id)
+
+
+def parse_cursor(cursor):
+    try:
+        posted, id = cursor.split('-')
+        return datetime.strptime(posted, _CURSOR_DATE_FORMAT), int(id)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+class KeysetPaginator(object):
+    """
+    Paginates newest first by (posted, id) without COUNT(*) and OFFSET, so
+    every page costs the same index range scan as the first one.
+    
+    @note: pages are addressed by cursors of the first/last object shown,
+        "before" goes to older objects, "after" goes to newer ones
+    """
+    
+    def __init__(self, object_list, per_page, posted_field='posted',
+        id_field='id'):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.posted_field = posted_field
+        self.id_field = id_field
+    
+    def page(self, before=None, after=None):
+        if before and after:
+            raise InvalidCursor('%s, %s' % (before, after))
+        
+        posted_field, id_field = self.posted_field, self.id_field
+        object_list = self.object_list
+        
+        if after:
+            posted, id = parse_cursor(after)
+            object_list = object_list.filter(
+                Q(**{'%s__gt' % posted_field: posted}) |
+                Q(**{posted_field: posted, '%s__gt' % id_field: id})
+            ).order_by(posted_field, id_field)
+        else:
+            if before:
+                posted, id = parse_cursor(before)
+                object_list = object_list.filter(
+                    Q(**{'%s__lt' % posted_field: posted}) |
+                    Q(**{posted_field: posted, '%s__lt' % id_field: id}))
+            object_list = object_list.order_by('-%s' % posted_field,
+                '-%s' % id_field)
+        
+        """ one extra object tells if there is one more page """
+        objects = list(object_list[:self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        
+        if after:
+            objects.reverse()
+            return KeysetPage(objects, self, has_next=True,
+                has_previous=has_more)
+        else:
+            return KeysetPage(objects, self, has_next=has_more,
+                has_previous=bool(before))
+
+
+class KeysetPage(object):
+    
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+    
+    def __repr__(self):
+        return '<Page of %s objects>' % len(self.object_list)
+    
+    def has_next(self):
+        return self._has_next
+    
+    def has_previous(self):
+        return self._has_previous
+    
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+    
+    def _cursor(self, obj):
+        return make_cursor(obj.serializable_value(self.paginator.posted_field),
+            obj.serializable_value(self.paginator.id_field))
+    
+    def next_cursor(self):
+        """ pass as "before" to get older objects """
+        if self.has_next():
+            return self._cursor(self.object_list[-1])
+    
+    def previous_cursor(self):
+        """ pass as "after" to get newer objects """
+        if self.has_previous():
+            return self._cursor(self.object_list[0])
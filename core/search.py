@@ -0,0 +1,211 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: notice text search, SEARCH_BACKEND setting is a dotted path to a
+    BaseSearchBackend subclass. Only public notices are indexed.
+@note: saving and deleting notices never fails on index errors, those are
+    logged to the core.search logger
+"""
+
+import logging
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+from paginator import InvalidCursor
+
+
+ORDER_RANK = 'rank'
+ORDER_RECENT = 'recent'
+
+_word_regex = re.compile(r'\w+', re.UNICODE)
+
+logger = logging.getLogger('core.search')
+
+
+class BaseSearchBackend(object):
+    """
+    Backends index (notice id, text) pairs and answer with notice ids
+    """
+    
+    def index(self, notices):
+        """ add or replace (id, text) pairs """
+        raise NotImplementedError
+    
+    def remove(self, ids):
+        raise NotImplementedError
+    
+    def clear(self):
+        raise NotImplementedError
+    
+    def search(self, query, order=ORDER_RANK, limit=10, cursor=None):
+        """
+        Returns notice ids of a page and cursor of the next page (or None)
+        """
+        raise NotImplementedError
+
+
+class SqliteFTSBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 index in a local file (SEARCH_DATABASE), rowid is notice id.
+    Works whatever DATABASE_ENGINE is.
+    
+    @note: sqlite connections are per thread, ':memory:' database is per
+        thread too
+    """
+    
+    table = 'notice_fts'
+    
+    def __init__(self, database=None):
+        self.database = database or settings.SEARCH_DATABASE
+        self._local = threading.local()
+    
+    def _cursor(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            try:
+                from sqlite3 import dbapi2 as sqlite
+            except ImportError:
+                raise ImproperlyConfigured('sqlite3 is required by %s' %
+                    self.__class__.__name__)
+            connection = sqlite.connect(self.database)
+            try:
+                connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS %s '
+                    'USING fts5(text, tokenize=unicode61)' % self.table)
+            except sqlite.OperationalError, e:
+                raise ImproperlyConfigured('SQLite FTS5 is not available: %s'
+                    % e)
+            self._local.connection = connection
+        return connection.cursor()
+    
+    def _commit(self):
+        self._local.connection.commit()
+    
+    def index(self, notices):
+        cursor = self._cursor()
+        notices = list(notices)
+        cursor.executemany('DELETE FROM %s WHERE rowid = ?' % self.table,
+            [(id,) for id, text in notices])
+        cursor.executemany('INSERT INTO %s (rowid, text) VALUES (?, ?)' %
+            self.table, notices)
+        self._commit()
+    
+    def remove(self, ids):
+        self._cursor().executemany('DELETE FROM %s WHERE rowid = ?' %
+            self.table, [(id,) for id in ids])
+        self._commit()
+    
+    def clear(self):
+        self._cursor().execute('DELETE FROM %s' % self.table)
+        self._commit()
+    
+    def _match(self, query):
+        """ quote every word so user input is never FTS query syntax """
+        words = _word_regex.findall(query)
+        return ' '.join(['"%s"' % word for word in words])
+    
+    def search(self, query, order=ORDER_RANK, limit=10, cursor=None):
+        match = self._match(query)
+        if not match:
+            return [], None
+        
+        if order == ORDER_RECENT:
+            sql = 'SELECT rowid, 0 FROM %s WHERE %s MATCH ?' % (self.table,
+                self.table)
+            params = [match]
+            if cursor:
+                sql += ' AND rowid < ?'
+                params.append(self._parse_cursor(cursor)[1])
+            sql += ' ORDER BY rowid DESC LIMIT ?'
+        elif order == ORDER_RANK:
+            """ bm25 is lower for better matches, ties go newest first """
+            sql = 'SELECT rowid, score FROM (SELECT rowid, ' \
+                'bm25(%s) AS score FROM %s WHERE %s MATCH ?)' % (self.table,
+                    self.table, self.table)
+            params = [match]
+            if cursor:
+                score, id = self._parse_cursor(cursor)
+                sql += ' WHERE score > ? OR (score = ? AND rowid < ?)'
+                params.extend([score, score, id])
+            sql += ' ORDER BY score, rowid DESC LIMIT ?'
+        else:
+            raise ValueError(order)
+        params.append(limit + 1)
+        
+        rows = self._cursor().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = '%r_%d' % (rows[-1][1], rows[-1][0])
+        return [row[0] for row in rows], next_cursor
+    
+    def _parse_cursor(self, cursor):
+        try:
+            score, id = cursor.split('_')
+            return float(score), int(id)
+        except ValueError:
+            raise InvalidCursor(cursor)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        module, name = settings.SEARCH_BACKEND.rsplit('.', 1)
+        try:
+            _backend = getattr(import_module(module), name)()
+        except (ImportError, AttributeError), e:
+            raise ImproperlyConfigured('Error loading search backend %s: %s'
+                % (settings.SEARCH_BACKEND, e))
+    return _backend
+
+
+def index_notices(notices, fail_silently=False):
+    """
+    Index public notices, drop the restricted ones from index. Index errors
+    are only logged with fail_silently, reindexsearch fills the gaps.
+    """
+    notices = list(notices)
+    public = [(notice.id, notice.text) for notice in notices
+        if not notice.is_restricted]
+    restricted = [notice.id for notice in notices if notice.is_restricted]
+    try:
+        if public:
+            get_backend().index(public)
+        if restricted:
+            get_backend().remove(restricted)
+    except Exception:
+        if not fail_silently:
+            raise
+        logger.exception('Indexing notices %s failed',
+            [notice.id for notice in notices])
+
+
+def unindex_notices(ids, fail_silently=False):
+    """ drop notices from index, see index_notices """
+    try:
+        get_backend().remove(ids)
+    except Exception:
+        if not fail_silently:
+            raise
+        logger.exception('Removing notices %s from index failed', ids)
@@ -17,30 +17,221 @@ You should have received a copy of the GNU Affero General Public License
 along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.auth.models import User, Message
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db.models.signals import post_save, pre_delete, post_delete
 
-from models import Notice, GroupUser, UserInfo
+from autocomplete import autocomplete
+from conditional import touch_timelines, touch_users
+from counters import counters, update_counter
+from fragments import fragments
+from graph import graph
+from jobs import after_commit
+from managers import POPULAR_NOTICES_CACHE_KEY
+from pagecache import pages
+from search import unindex_notices
+from trending import trends
+from models import Notice, GroupUser, UserInfo, Group, Device, Tag, Follow, \
+    Block, Mention
 
 
-def count_notices(*args, **kwargs):
+def count_group_users(*args, **kwargs):
+    
+    group_user = kwargs['instance']
+    if kwargs['created']:
+        update_counter(Group.objects.filter(id=group_user.group_id),
+            'users_count', 1)
+        autocomplete.groups.adjust([group_user.group_id], 1)
+
+
+def uncount_group_users(*args, **kwargs):
+    
+    group_user = kwargs['instance']
+    update_counter(Group.objects.filter(id=group_user.group_id),
+        'users_count', -1)
+    autocomplete.groups.adjust([group_user.group_id], -1)
+
+
+def detach_notice(*args, **kwargs):
+    
+    kwargs['instance'].detach()
+
+
+def collect_notice_relations(*args, **kwargs):
     
+    """ many-to-many rows are gone by post_delete, remember them now """
     notice = kwargs['instance']
+    notice._group_ids = list(notice.groups.values_list('id', flat=True))
+    notice._tag_ids = list(notice.tags.values_list('id', flat=True))
+
+
+def uncount_notices(*args, **kwargs):
+    
+    notice = kwargs['instance']
+    update_counter(UserInfo.objects.filter(user=notice.author_id),
+        'notices_count', -1)
+    after_commit(counters.add, Device, 'notices_count', [notice.via_id], -1)
+    after_commit(counters.add, Group, 'notices_count', notice._group_ids, -1)
+    after_commit(counters.add, Tag, 'use_count', notice._tag_ids, -1)
+    autocomplete.tags.adjust(notice._tag_ids, -1)
+
+
+def unindex_notice(*args, **kwargs):
     
-    device = notice.via
-    device.notices_count = device.notice_set.count()
-    device.save()
+    unindex_notices([kwargs['instance'].id], fail_silently=True)
+
+
+def uncount_unread_mentions(*args, **kwargs):
     
-    for group in notice.groups.all():
-        group.notices_count = group.notice_set.count()
-        group.save()
+    """ block and notice deletes remove mentions, the read ones are free """
+    mention = kwargs['instance']
+    if not mention.is_read:
+        update_counter(UserInfo.objects.filter(user=mention.user_id),
+            'unread_mentions_count', -1)
+        touch_users([mention.user_id])
 
 
-def count_group_users(*args, **kwargs):
+def count_follows(*args, **kwargs):
+    
+    follow = kwargs['instance']
+    if kwargs['created']:
+        update_counter(UserInfo.objects.filter(user=follow.follower_id),
+            'following_count', 1)
+        update_counter(UserInfo.objects.filter(user=follow.followed_id),
+            'followers_count', 1)
+        autocomplete.users.adjust([follow.followed_id], 1)
+
+
+def uncount_follows(*args, **kwargs):
+    
+    follow = kwargs['instance']
+    update_counter(UserInfo.objects.filter(user=follow.follower_id),
+        'following_count', -1)
+    update_counter(UserInfo.objects.filter(user=follow.followed_id),
+        'followers_count', -1)
+    autocomplete.users.adjust([follow.followed_id], -1)
+
+
+def index_follow(*args, **kwargs):
+    
+    follow = kwargs['instance']
+    if graph.enabled and kwargs['created']:
+        graph.follows.add(follow.follower_id, follow.followed_id)
+
+
+def unindex_follow(*args, **kwargs):
+    
+    follow = kwargs['instance']
+    if graph.enabled:
+        graph.follows.remove(follow.follower_id, follow.followed_id)
+
+
+def index_block(*args, **kwargs):
+    
+    block = kwargs['instance']
+    if graph.enabled and kwargs['created']:
+        graph.blocks.add(block.blocker_id, block.blocked_id)
+
+
+def unindex_block(*args, **kwargs):
+    
+    block = kwargs['instance']
+    if graph.enabled:
+        graph.blocks.remove(block.blocker_id, block.blocked_id)
+
+
+def index_username(*args, **kwargs):
+    
+    """ new and renamed users, followers count is kept """
+    user = kwargs['instance']
+    autocomplete.users.set(user.id, user.username)
+
+
+def unindex_username(*args, **kwargs):
+    
+    autocomplete.users.remove(kwargs['instance'].id)
+
+
+def index_group_name(*args, **kwargs):
     
-    group = kwargs['instance'].group
-    group.users_count = group.users.count()
-    group.save()
+    group = kwargs['instance']
+    autocomplete.groups.set(group.id, group.name)
+
+
+def unindex_group_name(*args, **kwargs):
+    
+    autocomplete.groups.remove(kwargs['instance'].id)
+
+
+def unindex_tag_name(*args, **kwargs):
+    
+    autocomplete.tags.remove(kwargs['instance'].id)
+
+
+def flush_stale_counters(*args, **kwargs):
+    
+    counters.flush_stale()
+    trends.flush_stale()
+    fragments.flush_stats()
+
+
+def bump_notice_fragments(*args, **kwargs):
+    
+    """ covers favorites too, favorited_count is saved with the notice """
+    fragments.bump_notice(kwargs['instance'].id)
+
+
+def bump_user_fragments(*args, **kwargs):
+    
+    instance = kwargs['instance']
+    fragments.bump_user(getattr(instance, 'user_id', instance.id))
+
+
+def touch_changed_timelines(*args, **kwargs):
+    
+    """ new notices move the newest timeline row, validators see that """
+    if not kwargs.get('created'):
+        touch_timelines()
+
+
+def touch_relationship_users(*args, **kwargs):
+    
+    instance = kwargs['instance']
+    if isinstance(instance, Follow):
+        touch_users([instance.follower_id, instance.followed_id])
+    else:
+        touch_users([instance.blocker_id, instance.blocked_id])
+
+
+def touch_user(*args, **kwargs):
+    
+    """ user changes and messages to user show on pages seen by user """
+    touch_users([getattr(kwargs['instance'], 'user_id',
+        kwargs['instance'].id)])
+
+
+def bump_notice_pages(*args, **kwargs):
+    
+    notice = kwargs['instance']
+    pages.bump([notice.author_id], public=not notice.is_restricted)
+
+
+def bump_follow_pages(*args, **kwargs):
+    
+    follow = kwargs['instance']
+    pages.bump([follow.follower_id, follow.followed_id])
+
+
+def bump_user_pages(*args, **kwargs):
+    
+    """
+    User is saved on every login, user renames reach the public pages with
+    ANONYMOUS_PAGE_CACHE_TIMEOUT
+    """
+    instance = kwargs['instance']
+    pages.bump([getattr(instance, 'user_id', instance.id)],
+        public=isinstance(instance, UserInfo))
 
 
 def create_user_info(*args, **kwargs):
@@ -51,6 +242,51 @@ def create_user_info(*args, **kwargs):
         user_info.save()
 
 
-post_save.connect(count_notices, Notice)
+def invalidate_popular_notices(*args, **kwargs):
+    
+    """ new notices have no favorites yet, cache timeout will catch them """
+    if not kwargs.get('created'):
+        cache.delete(POPULAR_NOTICES_CACHE_KEY)
+
+
+post_save.connect(invalidate_popular_notices, Notice)
+post_delete.connect(invalidate_popular_notices, Notice)
+pre_delete.connect(detach_notice, Notice)
+pre_delete.connect(collect_notice_relations, Notice)
+post_delete.connect(uncount_notices, Notice)
+post_delete.connect(unindex_notice, Notice)
+post_delete.connect(uncount_unread_mentions, Mention)
 post_save.connect(count_group_users, GroupUser)
+post_delete.connect(uncount_group_users, GroupUser)
 post_save.connect(create_user_info, User)
+post_save.connect(count_follows, Follow)
+post_delete.connect(uncount_follows, Follow)
+post_save.connect(index_follow, Follow)
+post_delete.connect(unindex_follow, Follow)
+post_save.connect(index_block, Block)
+post_delete.connect(unindex_block, Block)
+post_save.connect(index_username, User)
+post_delete.connect(unindex_username, User)
+post_save.connect(index_group_name, Group)
+post_delete.connect(unindex_group_name, Group)
+post_delete.connect(unindex_tag_name, Tag)
+post_save.connect(bump_notice_fragments, Notice)
+post_delete.connect(bump_notice_fragments, Notice)
+post_save.connect(bump_user_fragments, User)
+post_save.connect(bump_user_fragments, UserInfo)
+post_save.connect(touch_changed_timelines, Notice)
+post_delete.connect(touch_changed_timelines, Notice)
+post_save.connect(touch_changed_timelines, UserInfo)
+post_save.connect(touch_relationship_users, Follow)
+post_delete.connect(touch_relationship_users, Follow)
+post_save.connect(touch_relationship_users, Block)
+post_delete.connect(touch_relationship_users, Block)
+post_save.connect(touch_user, User)
+post_save.connect(touch_user, Message)
+post_save.connect(bump_notice_pages, Notice)
+post_delete.connect(bump_notice_pages, Notice)
+post_save.connect(bump_follow_pages, Follow)
+post_delete.connect(bump_follow_pages, Follow)
+post_save.connect(bump_user_pages, User)
+post_save.connect(bump_user_pages, UserInfo)
+request_finished.connect(flush_stale_counters)
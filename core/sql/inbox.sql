@@ -0,0 +1 @@
+CREATE INDEX core_inbox_user_posted ON core_inbox (user_id, posted, notice_id);
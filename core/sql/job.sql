@@ -0,0 +1 @@
+CREATE INDEX core_job_status_run_at ON core_job (status, run_at);
@@ -0,0 +1 @@
+CREATE INDEX core_mention_user_posted ON core_mention (user_id, posted, notice_id);
@@ -0,0 +1,4 @@
+CREATE INDEX core_notice_posted_id ON core_notice (posted, id);
+CREATE INDEX core_notice_author_posted_id ON core_notice (author_id, posted, id);
+CREATE INDEX core_notice_favorited_count_posted ON core_notice (favorited_count, posted);
+CREATE INDEX core_notice_thread_posted_id ON core_notice (thread_id, posted, id);
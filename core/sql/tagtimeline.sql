@@ -0,0 +1 @@
+CREATE INDEX core_tagtimeline_tag_posted ON core_tagtimeline (tag_id, posted, notice_id);
@@ -0,0 +1,41 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from django import template
+from django.utils.safestring import mark_safe
+
+from core.csrf import csrf_field
+
+
+register = template.Library()
+
+
+class CsrfTokenNode(template.Node):
+    
+    def render(self, context):
+        return mark_safe(csrf_field(context.get('csrf_token')))
+
+
+@register.tag
+def csrf_token(parser, token):
+    """
+    Hidden csrf token field for POST forms, needs csrf_token of
+    context_processors.csrf. Replaces the no-op tag of Django 1.1.
+    """
+    return CsrfTokenNode()
@@ -0,0 +1,44 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from django import template
+
+from core.fragments import fragments
+
+
+register = template.Library()
+
+
+class CachedNoticeNode(template.Node):
+    
+    def __init__(self, notice):
+        self.notice = template.Variable(notice)
+    
+    def render(self, context):
+        return fragments.render(self.notice.resolve(context),
+            context.get('csrf_token'))
+
+
+@register.tag
+def cached_notice(parser, token):
+    """ inc/notice.html for notice, from the fragment cache if fresh """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError('%r takes one argument' % bits[0])
+    return CachedNoticeNode(bits[1])
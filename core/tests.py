@@ -5,7 +5,43 @@ unittest). These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import management
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+from django.test import TestCase, TransactionTestCase
+from django.utils import simplejson, translation
+from django.utils.hashcompat import md5_constructor
+from django.utils.http import http_date
+
+from core import autocomplete as autocomplete_module
+from core import media, models, search
+from core.assets import AssetManifest, MANIFEST_NAME
+from core.autocomplete import PrefixIndex, autocomplete
+from core.conditional import TIMELINES_STAMP_KEY, USER_STAMP_KEY
+from core.context_processors import pythonica_context
+from core.counters import CounterBuffer, counters
+from core.fragments import fragments
+from core.graph import GraphIndex
+from core.jobs import enqueue
+from core.managers import POPULAR_NOTICES_CACHE_KEY, TRENDING_TAGS_CACHE_KEY
+from core.models import Notice, Follow, Block, Group, GroupUser, Inbox, \
+    Tag, Device, UserInfo, TagTimeline, TagTrend, Mention, Job
+from core.notices import render_notice, NOTICE_HTML_VERSION
+from core.pagecache import pages, PAGE_KEY, LOCK_KEY
+from core.paginator import KeysetPaginator, make_cursor
+from core.search import SqliteFTSBackend, ORDER_RECENT
+from core.trending import TrendBuffer, bucket_of, trends
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -21,3 +57,1485 @@ Another way to test that 1 + 1 is equal to 2.
 True
 """}
 
+
+class CoreTestCase(TestCase):
+    
+    def setUp(self):
+        """ keep the test run away from SEARCH_DATABASE file """
+        self.search_backend = search._backend
+        search._backend = SqliteFTSBackend(':memory:')
+    
+    def tearDown(self):
+        """ write buffered counters before the test transaction rolls back """
+        counters.flush()
+        trends.flush()
+        """ cached pages are of rolled back data """
+        pages.bump(public=True)
+        search._backend = self.search_backend
+
+
+class InboxTest(CoreTestCase):
+    
+    def setUp(self):
+        super(InboxTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        self.bob = User.objects.create_user('bob', 'bob@example.com')
+        self.carol = User.objects.create_user('carol', 'carol@example.com')
+    
+    def post(self, author, text):
+        notice = Notice(author=author, text=text, via_id=1)
+        notice.save()
+        return notice
+    
+    def timeline(self, user):
+        return [entry.notice_id for entry in Inbox.objects.timeline(user)]
+    
+    def test_fan_out(self):
+        Follow.subscribe(self.bob, self.alice)
+        group = Group.objects.create(name='python', owner=self.carol)
+        GroupUser.objects.create(group=group, user=self.carol)
+        Block.block(self.carol, self.bob)
+        
+        hello = self.post(self.alice, 'hello')
+        reply = self.post(self.bob, 'hi @alice')
+        ping = self.post(self.alice, 'ping !python')
+        also = self.post(self.bob, 'also !python')
+        
+        self.assertEqual(self.timeline(self.alice), [ping.id, reply.id,
+            hello.id])
+        self.assertEqual(self.timeline(self.bob), [also.id, ping.id,
+            reply.id, hello.id])
+        self.assertEqual(self.timeline(self.carol), [ping.id])
+        
+        for user in (self.alice, self.bob, self.carol):
+            self.assertEqual(self.timeline(user), list(
+                Inbox.timeline_query(user).values_list('id', flat=True)))
+    
+    def test_follow_changes_rebuild_entries(self):
+        notice = self.post(self.alice, 'hello')
+        self.assertEqual(self.timeline(self.bob), [])
+        
+        Follow.subscribe(self.bob, self.alice)
+        self.assertEqual(self.timeline(self.bob), [notice.id])
+        
+        rebuild, rebuilds = Inbox.__dict__['rebuild'], []
+        def counted_rebuild(cls, user, author=None):
+            rebuilds.append(user.id)
+            rebuild.__get__(None, cls)(user, author)
+        Inbox.rebuild = classmethod(counted_rebuild)
+        try:
+            Block.block(self.bob, self.alice)
+        finally:
+            Inbox.rebuild = rebuild
+        self.assertEqual(self.timeline(self.bob), [])
+        self.assertEqual(rebuilds, [self.bob.id])
+        self.failIf(Follow.is_subscribed(self.bob, self.alice))
+    
+    def test_follow_backfill_is_capped(self):
+        old_backfill = settings.INBOX_FOLLOW_BACKFILL
+        settings.INBOX_FOLLOW_BACKFILL = 2
+        try:
+            reply = self.post(self.alice, 'hi @bob')
+            notices = [self.post(self.alice, 'hello %d' % i)
+                for i in range(3)]
+            
+            Follow.subscribe(self.bob, self.alice)
+            self.assertEqual(self.timeline(self.bob), [notices[2].id,
+                notices[1].id, reply.id])
+        finally:
+            settings.INBOX_FOLLOW_BACKFILL = old_backfill
+    
+    def test_rebuild(self):
+        Follow.subscribe(self.bob, self.alice)
+        notice = self.post(self.alice, 'hello')
+        Inbox.objects.all().delete()
+        
+        Inbox.rebuild(self.bob)
+        self.assertEqual(self.timeline(self.bob), [notice.id])
+
+
+class KeysetPaginatorTest(CoreTestCase):
+    
+    def setUp(self):
+        super(KeysetPaginatorTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        for i in range(25):
+            Notice(author=self.alice, text='notice %s' % i, via_id=1).save()
+        self.ids = list(Notice.objects.order_by('-posted', '-id').values_list(
+            'id', flat=True))
+    
+    def ids_of(self, page):
+        return [notice.id for notice in page.object_list]
+    
+    def test_walk_back_and_forth(self):
+        paginator = KeysetPaginator(Notice.objects.all(), 10)
+        
+        first = paginator.page()
+        self.assertEqual(self.ids_of(first), self.ids[:10])
+        self.failIf(first.has_previous())
+        
+        second = paginator.page(before=first.next_cursor())
+        self.assertEqual(self.ids_of(second), self.ids[10:20])
+        
+        last = paginator.page(before=second.next_cursor())
+        self.assertEqual(self.ids_of(last), self.ids[20:])
+        self.failIf(last.has_next())
+        
+        back = paginator.page(after=last.previous_cursor())
+        self.assertEqual(self.ids_of(back), self.ids[10:20])
+        self.failUnless(back.has_previous())
+    
+    def test_views(self):
+        notice = Notice.objects.get(id=self.ids[9])
+        cursor = make_cursor(notice.posted, notice.id)
+        
+        response = self.client.get('/before/%s' % cursor)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids_of(response.context[0]['last_notices']),
+            self.ids[10:20])
+        
+        response = self.client.get('/alice/after/%s' % cursor)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids_of(response.context[0]['notices']),
+            self.ids[:9])
+        
+        response = self.client.get('/before/99999999999999999999-1')
+        self.assertEqual(response.status_code, 404)
+
+
+class NoticeSaveTest(CoreTestCase):
+    
+    def setUp(self):
+        super(NoticeSaveTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        for username in ('bob', 'carol', 'dave'):
+            user = User.objects.create_user(username, '%s@example.com' %
+                username)
+            Notice(author=user, text='hello', via_id=1).save()
+        for name in ('python', 'django'):
+            Group.objects.create(name=name, owner=self.alice)
+        Tag.objects.create(name='old')
+    
+    def count_queries(self, text):
+        debug, settings.DEBUG = settings.DEBUG, True
+        connection.queries = []
+        try:
+            notice = Notice(author=self.alice, text=text, via_id=1)
+            notice.save()
+            return notice, len(connection.queries)
+        finally:
+            settings.DEBUG = debug
+    
+    def test_query_count_is_constant(self):
+        small, small_count = self.count_queries('#one !python @bob')
+        big, big_count = self.count_queries('#old #a #b #c #c !python '
+            '!django @bob @carol @dave')
+        
+        self.assertEqual(small_count, big_count)
+        
+        counters.flush()
+        self.assertEqual(sorted(big.tags.values_list('name', flat=True)),
+            ['a', 'b', 'c', 'old'])
+        self.assertEqual(Tag.objects.get(name='old').use_count, 1)
+        self.assertEqual(Tag.objects.get(name='c').use_count, 1)
+        self.assertEqual(big.groups.count(), 2)
+        self.assertEqual(Group.objects.get(name='python').notices_count, 2)
+        self.assertEqual(big.in_reply_to.count(), 3)
+        self.assertEqual(Device.objects.get(id=1).notices_count, 5)
+        self.assertEqual(User.objects.get(id=self.alice.id).info.last_id,
+            big.id)
+    
+    def test_concurrent_new_tag(self):
+        """ another notice inserts the tag between select and insert """
+        insert_many = models._insert_many
+        def racing_insert_many(model, fields, rows):
+            rows = list(rows)
+            if model is Tag and len(rows) > 1:
+                Tag.objects.create(name='race')
+            insert_many(model, fields, rows)
+        models._insert_many = racing_insert_many
+        try:
+            notice = Notice(author=self.alice, text='#race #other', via_id=1)
+            notice.save()
+        finally:
+            models._insert_many = insert_many
+        
+        counters.flush()
+        self.assertEqual(sorted(notice.tags.values_list('name', flat=True)),
+            ['other', 'race'])
+        self.assertEqual(Tag.objects.filter(name='race').count(), 1)
+        self.assertEqual(Tag.objects.get(name='race').use_count, 1)
+    
+    def test_closed_group_restricts_notice(self):
+        Group.objects.filter(name='python').update(is_closed=True)
+        notice, count = self.count_queries('!python only')
+        self.failUnless(Notice.objects.get(id=notice.id).is_restricted)
+
+
+class PopularNoticesTest(CoreTestCase):
+    
+    def setUp(self):
+        super(PopularNoticesTest, self).setUp()
+        cache.delete(POPULAR_NOTICES_CACHE_KEY)
+        alice = User.objects.create_user('alice', 'alice@example.com')
+        for i in range(settings.POPULAR_NOTICES_COUNT + 5):
+            notice = Notice(author=alice, text='notice %s' % i, via_id=1,
+                favorited_count=i)
+            notice.save()
+        self.top = notice
+    
+    def test_bounded_and_cached(self):
+        popular = Notice.objects.popular()
+        self.assertEqual(len(popular), settings.POPULAR_NOTICES_COUNT)
+        self.assertEqual(popular[0], self.top)
+        
+        Notice.objects.filter(id=self.top.id).update(favorited_count=0)
+        self.assertEqual(Notice.objects.popular()[0], self.top)
+        
+        self.top.favorited_count = 0
+        self.top.save()
+        self.assertNotEqual(Notice.objects.popular()[0], self.top)
+    
+    def test_context_is_lazy(self):
+        context = pythonica_context(HttpRequest())
+        self.assertEqual(cache.get(POPULAR_NOTICES_CACHE_KEY), None)
+        self.assertEqual(list(context['popular_notices'])[0], self.top)
+        self.failIf(cache.get(POPULAR_NOTICES_CACHE_KEY) is None)
+
+
+class CountersTest(CoreTestCase):
+    
+    def setUp(self):
+        super(CountersTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        self.group = Group.objects.create(name='python', owner=self.alice)
+    
+    def reload(self, obj):
+        return obj.__class__.objects.get(id=obj.id)
+    
+    def test_deltas(self):
+        membership = GroupUser.objects.create(group=self.group,
+            user=self.alice)
+        self.assertEqual(self.reload(self.group).users_count, 1)
+        
+        notice = Notice(author=self.alice, text='#py !python', via_id=1)
+        notice.save()
+        counters.flush()
+        self.assertEqual(self.reload(self.group).notices_count, 1)
+        
+        notice.delete()
+        counters.flush()
+        self.assertEqual(self.reload(self.group).notices_count, 0)
+        self.assertEqual(Device.objects.get(id=1).notices_count, 0)
+        self.assertEqual(Tag.objects.get(name='py').use_count, 0)
+        
+        membership.delete()
+        self.assertEqual(self.reload(self.group).users_count, 0)
+    
+    def test_reconcile(self):
+        GroupUser.objects.create(group=self.group, user=self.alice)
+        Notice(author=self.alice, text='#py !python', via_id=1).save()
+        Group.objects.update(notices_count=7, users_count=0)
+        Tag.objects.update(use_count=3)
+        
+        management.call_command('reconcile_counters', batch_size=1,
+            verbosity=0)
+        
+        self.assertEqual(self.reload(self.group).notices_count, 1)
+        self.assertEqual(self.reload(self.group).users_count, 1)
+        self.assertEqual(Tag.objects.get(name='py').use_count, 1)
+
+
+class CounterBufferTest(CoreTestCase):
+    
+    def test_write_behind(self):
+        buffer = CounterBuffer(max_age=60, max_size=3)
+        python = Tag.objects.create(name='python')
+        django = Tag.objects.create(name='django')
+        
+        buffer.add(Tag, 'use_count', [python.id, django.id])
+        buffer.add(Tag, 'use_count', [python.id])
+        self.assertEqual(Tag.objects.get(id=python.id).use_count, 0)
+        
+        buffer.flush()
+        self.assertEqual(Tag.objects.get(id=python.id).use_count, 2)
+        self.assertEqual(Tag.objects.get(id=django.id).use_count, 1)
+        
+        other = Tag.objects.create(name='other')
+        buffer.add(Tag, 'use_count', [python.id, django.id, other.id], -1)
+        self.assertEqual(Tag.objects.get(id=python.id).use_count, 1)
+        self.assertEqual(Tag.objects.get(id=other.id).use_count, 0)
+    
+    def test_staleness(self):
+        buffer = CounterBuffer(max_age=60)
+        tag = Tag.objects.create(name='python')
+        buffer.add(Tag, 'use_count', [tag.id])
+        
+        buffer.flush_stale()
+        self.assertEqual(Tag.objects.get(id=tag.id).use_count, 0)
+        
+        buffer._since -= 60
+        buffer.flush_stale()
+        self.assertEqual(Tag.objects.get(id=tag.id).use_count, 1)
+    
+    def test_timer(self):
+        """ the timer thread has a database of its own, watch flush only """
+        buffer = CounterBuffer(max_age=0.05)
+        flushes = []
+        def flush():
+            flushes.append(buffer._since)
+            buffer._since = None
+        buffer.flush = flush
+        try:
+            buffer.add(Tag, 'use_count', [1])
+            since = buffer._since
+            self.assertEqual(flushes, [])
+            
+            time.sleep(0.3)
+            self.assertEqual(flushes, [since])
+        finally:
+            buffer.close()
+        self.failIf(buffer._timer.isAlive())
+
+
+class GraphIndexTest(CoreTestCase):
+    
+    def setUp(self):
+        super(GraphIndexTest, self).setUp()
+        self.users = [User.objects.create_user(username, '%s@example.com' %
+            username) for username in ('alice', 'bob', 'carol', 'dave')]
+        alice, bob, carol, dave = self.users
+        Follow.subscribe(alice, carol)
+        Follow.subscribe(bob, carol)
+        Follow.subscribe(bob, dave)
+        Block.block(dave, alice)
+    
+    def test_index(self):
+        alice, bob, carol, dave = [user.id for user in self.users]
+        graph = GraphIndex(True)
+        
+        self.failUnless(graph.is_following(bob, dave))
+        self.failIf(graph.is_following(dave, bob))
+        self.failUnless(graph.is_blocking(dave, alice))
+        self.assertEqual(graph.followers_count(carol), 2)
+        self.assertEqual(graph.following_count(bob), 2)
+        self.assertEqual(list(graph.common_following(alice, bob)), [carol])
+        
+        graph.follows.add(dave, bob)
+        graph.follows.remove(bob, carol)
+        self.failUnless(graph.is_following(dave, bob))
+        self.assertEqual(list(graph.common_followers(carol, dave)), [])
+        self.assertEqual(list(graph.follows.targets(bob)), [dave])
+    
+    def test_classmethods_use_index(self):
+        from core import models
+        alice, bob, carol, dave = self.users
+        enabled, models.graph.enabled = models.graph.enabled, True
+        models.graph.load()
+        try:
+            Follow.unsubscribe(bob, dave)
+            self.failIf(Follow.is_subscribed(bob, dave))
+            self.failIf(Follow.subscribe(alice, dave))
+            Block.unblock(dave, alice)
+            self.failUnless(Follow.subscribe(alice, dave))
+            self.failUnless(Follow.is_subscribed(alice, dave))
+        finally:
+            models.graph.enabled = enabled
+
+
+class RelationshipsTest(CoreTestCase):
+    
+    def setUp(self):
+        super(RelationshipsTest, self).setUp()
+        self.users = [User.objects.create_user(username, '%s@example.com' %
+            username) for username in ('alice', 'bob', 'carol', 'dave')]
+        alice, bob, carol, dave = self.users
+        Follow.subscribe(alice, bob)
+        Follow.subscribe(alice, carol)
+        Block.block(alice, dave)
+    
+    def test_bulk_lookups(self):
+        alice, bob, carol, dave = self.users
+        ids = [user.id for user in self.users]
+        
+        debug, settings.DEBUG = settings.DEBUG, True
+        connection.queries = []
+        try:
+            subscribed = Follow.followed_ids(alice, ids)
+            blocked = Block.blocked_ids(alice, ids)
+            self.assertEqual(len(connection.queries), 2)
+        finally:
+            settings.DEBUG = debug
+        
+        self.assertEqual(subscribed, set([bob.id, carol.id]))
+        self.assertEqual(blocked, set([dave.id]))
+        self.assertEqual(Follow.followed_ids(alice, []), set())
+    
+    def test_timeline_annotated(self):
+        alice, bob, carol, dave = self.users
+        for user in self.users:
+            Notice(author=user, text='hello', via_id=1).save()
+        alice.set_password('secret')
+        alice.save()
+        self.client.login(username='alice', password='secret')
+        
+        response = self.client.get('/')
+        authors = dict((notice.author.username, notice.author) for notice in
+            response.context[0]['last_notices'].object_list)
+        self.failUnless(authors['bob'].viewer_follows)
+        self.failIf(authors['dave'].viewer_follows)
+        self.failUnless(authors['dave'].viewer_blocks)
+
+
+class UserCountersTest(CoreTestCase):
+    
+    def setUp(self):
+        super(UserCountersTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        self.bob = User.objects.create_user('bob', 'bob@example.com')
+    
+    def info(self, user):
+        return UserInfo.objects.get(user=user)
+    
+    def test_follow_and_notice_counts(self):
+        Follow.subscribe(self.alice, self.bob)
+        self.assertEqual(self.info(self.alice).following_count, 1)
+        self.assertEqual(self.info(self.bob).followers_count, 1)
+        
+        Block.block(self.bob, self.alice)
+        self.assertEqual(self.info(self.alice).following_count, 1)
+        Block.block(self.alice, self.bob)
+        self.assertEqual(self.info(self.alice).following_count, 0)
+        self.assertEqual(self.info(self.bob).followers_count, 0)
+        
+        first = Notice(author=self.alice, text='one', via_id=1)
+        first.save()
+        last = Notice(author=self.alice, text='two', via_id=1)
+        last.save()
+        self.assertEqual(self.info(self.alice).notices_count, 2)
+        
+        last.delete()
+        self.assertEqual(self.info(self.alice).notices_count, 1)
+        self.assertEqual(self.info(self.alice).last_id, None)
+    
+    def test_reconcile(self):
+        Follow.subscribe(self.alice, self.bob)
+        Notice(author=self.alice, text='one', via_id=1).save()
+        UserInfo.objects.update(followers_count=5, following_count=0,
+            notices_count=0)
+        
+        management.call_command('reconcile_counters', verify=True,
+            verbosity=0)
+        self.assertEqual(self.info(self.alice).notices_count, 0)
+        
+        management.call_command('reconcile_counters', verbosity=0)
+        self.assertEqual(self.info(self.alice).following_count, 1)
+        self.assertEqual(self.info(self.alice).followers_count, 0)
+        self.assertEqual(self.info(self.alice).notices_count, 1)
+        self.assertEqual(self.info(self.bob).followers_count, 1)
+
+
+class TagTimelineTest(CoreTestCase):
+    
+    def setUp(self):
+        super(TagTimelineTest, self).setUp()
+        alice = User.objects.create_user('alice', 'alice@example.com')
+        Group.objects.create(name='secret', owner=alice, is_closed=True)
+        self.notices = []
+        for text in ('#python one', '#django two', '#python !secret',
+            '#python #django four'):
+            notice = Notice(author=alice, text=text, via_id=1)
+            notice.save()
+            self.notices.append(notice)
+    
+    def test_timeline(self):
+        one, two, secret, four = self.notices
+        python = Tag.objects.get(name='python')
+        self.assertEqual([entry.notice_id for entry in
+            TagTimeline.objects.timeline(python)], [four.id, one.id])
+        
+        TagTimeline.objects.all().delete()
+        management.call_command('rebuildtagtimelines', verbosity=0)
+        self.assertEqual([entry.notice_id for entry in
+            TagTimeline.objects.timeline(python)], [four.id, one.id])
+    
+    def test_view(self):
+        one, two, secret, four = self.notices
+        response = self.client.get(Tag.objects.get(
+            name='django').get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry.notice for entry in
+            response.context[0]['entries'].object_list], [four, two])
+        self.assertEqual(self.client.get('/tag/missing/').status_code, 404)
+
+
+class BrokenSearchBackend(search.BaseSearchBackend):
+    
+    def index(self, notices):
+        raise IOError('database is locked')
+    
+    def remove(self, ids):
+        raise IOError('database is locked')
+
+
+class SearchTest(CoreTestCase):
+    
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        search.get_backend().clear()
+        alice = User.objects.create_user('alice', 'alice@example.com')
+        Group.objects.create(name='secret', owner=alice, is_closed=True)
+        self.notices = []
+        for text in ('python is fun', 'python python python',
+            'django and python', 'python !secret', 'nothing here'):
+            notice = Notice(author=alice, text=text, via_id=1)
+            notice.save()
+            self.notices.append(notice)
+    
+    def test_search(self):
+        fun, pythons, django, secret, nothing = self.notices
+        backend = search.get_backend()
+        ids, cursor = backend.search('python')
+        self.assertEqual(ids[0], pythons.id)
+        self.assertEqual(set(ids), set([fun.id, pythons.id, django.id]))
+        self.assertEqual(cursor, None)
+        self.assertEqual(backend.search('Django PYTHON')[0], [django.id])
+        self.assertEqual(backend.search('"OR* (')[0], [])
+        
+        ids, cursor = backend.search('python', ORDER_RECENT, limit=2)
+        self.assertEqual(ids, [django.id, pythons.id])
+        self.assertEqual(backend.search('python', ORDER_RECENT, limit=2,
+            cursor=cursor), ([fun.id], None))
+        
+        ranked, cursor = backend.search('python', limit=2)
+        rest, cursor = backend.search('python', limit=2, cursor=cursor)
+        self.assertEqual(ranked + rest, backend.search('python')[0])
+        
+        django.delete()
+        self.assertEqual(backend.search('django')[0], [])
+    
+    def test_update(self):
+        fun, pythons, django, secret, nothing = self.notices
+        backend = search.get_backend()
+        fun.text = 'ruby is fun'
+        fun.save()
+        self.assertEqual(backend.search('ruby')[0], [fun.id])
+        self.assertEqual(set(backend.search('python')[0]),
+            set([pythons.id, django.id]))
+        
+        fun.is_restricted = True
+        fun.save()
+        self.assertEqual(backend.search('ruby')[0], [])
+    
+    def test_index_errors_keep_notices(self):
+        backend, search._backend = search._backend, BrokenSearchBackend()
+        search.logger.disabled = True
+        try:
+            notice = Notice(author=self.notices[0].author, text='locked',
+                via_id=1)
+            notice.save()
+            self.assertEqual(Notice.objects.filter(id=notice.id).count(), 1)
+            self.assertRaises(IOError, search.index_notices, [notice])
+            
+            notice.delete()
+            self.assertEqual(Notice.objects.filter(id=notice.id).count(), 0)
+        finally:
+            search._backend = backend
+            search.logger.disabled = False
+    
+    def test_reindex(self):
+        fun, pythons, django, secret, nothing = self.notices
+        search.get_backend().clear()
+        management.call_command('reindexsearch', chunk_size=2, verbosity=0)
+        self.assertEqual(search.get_backend().search('python',
+            ORDER_RECENT)[0], [django.id, pythons.id, fun.id])
+    
+    def test_view(self):
+        fun, pythons, django, secret, nothing = self.notices
+        response = self.client.get('/search/', {'q': 'python',
+            'order': 'recent'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context[0]['notices'],
+            [django, pythons, fun])
+        self.assertEqual(self.client.get('/search/', {'q': 'python',
+            'cursor': 'bad'}).status_code, 404)
+        self.assertEqual(self.client.get('/search/', {'q': 'python',
+            'order': 'bad'}).status_code, 400)
+
+
+class TrendingTagsTest(CoreTestCase):
+    
+    def setUp(self):
+        super(TrendingTagsTest, self).setUp()
+        cache.delete(TRENDING_TAGS_CACHE_KEY)
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        Group.objects.create(name='secret', owner=self.alice, is_closed=True)
+    
+    def post(self, *texts):
+        for text in texts:
+            Notice(author=self.alice, text=text, via_id=1).save()
+        trends.flush()
+    
+    def test_bucket_of(self):
+        when = datetime(2009, 10, 1, 12, 34, 56, 789)
+        self.assertEqual(bucket_of(when, 600), datetime(2009, 10, 1, 12, 30))
+        self.assertEqual(bucket_of(when, 3600), datetime(2009, 10, 1, 12))
+    
+    def test_counts(self):
+        self.post('#python #django', '#python', '#python !secret #secret')
+        self.post('#python')
+        self.assertEqual(sorted(TagTrend.objects.values_list('tag__name',
+            'count')), [('django', 1), ('python', 3)])
+        self.assertEqual([(tag.name, round(tag.trend)) for tag in
+            Tag.objects.trending()], [('python', 3), ('django', 1)])
+        self.assertEqual(cache.get(TRENDING_TAGS_CACHE_KEY),
+            Tag.objects.trending())
+    
+    def test_decay(self):
+        self.post('#old #new')
+        old, new = Tag.objects.get(name='old'), Tag.objects.get(name='new')
+        now = datetime.now()
+        TagTrend.objects.filter(tag=old).update(count=10,
+            bucket=bucket_of(now - timedelta(hours=18), 600))
+        TagTrend.objects.filter(tag=new).update(count=2)
+        
+        ranked = Tag.objects._rank_trending(now)
+        self.assertEqual([tag.name for tag in ranked], ['new', 'old'])
+        self.assertTrue(1 < ranked[1].trend < 2)
+        
+        TagTrend.objects.filter(tag=old).update(
+            bucket=bucket_of(now - timedelta(hours=30), 600))
+        self.assertEqual([tag.name for tag in
+            Tag.objects._rank_trending(now)], ['new'])
+        management.call_command('prunetagtrends', verbosity=0)
+        self.assertEqual(list(TagTrend.objects.values_list('tag',
+            flat=True)), [new.id])
+    
+    def test_concurrent_first_write(self):
+        """ another process writes the first row of a bucket meanwhile """
+        python = Tag.objects.create(name='python')
+        django = Tag.objects.create(name='django')
+        now = datetime.now()
+        buffer = TrendBuffer(600)
+        
+        insert_many = models._insert_many
+        def racing_insert_many(model, fields, rows):
+            if model is TagTrend and not TagTrend.objects.count():
+                TagTrend.objects.create(tag=python, count=5,
+                    bucket=bucket_of(now, 600))
+            insert_many(model, fields, rows)
+        models._insert_many = racing_insert_many
+        try:
+            buffer.add([python.id, django.id], now)
+        finally:
+            models._insert_many = insert_many
+        
+        self.assertEqual(sorted(TagTrend.objects.values_list('tag__name',
+            'count')), [('django', 1), ('python', 6)])
+    
+    def test_timer(self):
+        """ the timer thread has a database of its own, watch flush only """
+        buffer = TrendBuffer(600, max_age=0.05)
+        flushes = []
+        def flush():
+            flushes.append(buffer._since)
+            buffer._since = None
+        buffer.flush = flush
+        try:
+            buffer.add([1], datetime.now())
+            since = buffer._since
+            self.assertEqual(flushes, [])
+            
+            time.sleep(0.3)
+            self.assertEqual(flushes, [since])
+        finally:
+            buffer.close()
+        self.failIf(buffer._timer.isAlive())
+    
+    def test_view(self):
+        self.post('#python')
+        response = self.client.get('/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tag.name for tag in response.context[0]['tags']],
+            ['python'])
+
+
+class PrefixIndexTest(CoreTestCase):
+    
+    def setUp(self):
+        super(PrefixIndexTest, self).setUp()
+        self.heavy, autocomplete_module._HEAVY = autocomplete_module._HEAVY, 3
+        self.index = PrefixIndex(2)
+        self.index.load([(1, 'alice', 5), (2, 'Alex', 7), (3, 'albert', 1),
+            (4, 'bob', 3), (5, 'alina', 0)])
+    
+    def tearDown(self):
+        autocomplete_module._HEAVY = self.heavy
+        super(PrefixIndexTest, self).tearDown()
+    
+    def test_complete(self):
+        index = self.index
+        self.assertEqual(index.complete('AL'), [('Alex', 7), ('alice', 5)])
+        self.assertEqual(index.complete('ali'), [('alice', 5), ('alina', 0)])
+        self.assertEqual(index.complete('bo'), [('bob', 3)])
+        self.assertEqual(index.complete('z'), [])
+        self.failUnless('al' in index._top)
+    
+    def test_changes(self):
+        index = self.index
+        index.adjust([3], 10)
+        self.assertEqual(index.complete('al'), [('albert', 11), ('Alex', 7)])
+        index.set(6, 'alfred', 9)
+        self.assertEqual(index.complete('al'), [('albert', 11), ('alfred', 9)])
+        index.adjust([3], -10)
+        self.assertEqual(index.complete('al'), [('alfred', 9), ('Alex', 7)])
+        index.remove(6)
+        index.set(2, 'bobby')
+        self.assertEqual(index.complete('al'), [('alice', 5), ('albert', 1)])
+        self.assertEqual(index.complete('b'), [('bobby', 7), ('bob', 3)])
+        self.assertEqual(len(index), 5)
+
+
+class AutocompleteTest(CoreTestCase):
+    
+    def setUp(self):
+        super(AutocompleteTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        self.alex = User.objects.create_user('alex', 'alex@example.com')
+        Group.objects.create(name='alpha', owner=self.alice)
+        Notice(author=self.alice, text='#alpine #alps', via_id=1).save()
+        counters.flush()
+        autocomplete.load()
+    
+    def test_signals(self):
+        Follow.subscribe(self.alice, self.alex)
+        self.assertEqual(autocomplete.complete('@al'), [('@alex', 1),
+            ('@alice', 0)])
+        
+        Notice(author=self.alice, text='#alps #also', via_id=1).save()
+        self.assertEqual(autocomplete.complete('#al'), [('#alps', 2),
+            ('#alpine', 1), ('#also', 1)])
+        
+        Group.objects.create(name='Alpine', owner=self.alex)
+        GroupUser.objects.create(group=Group.objects.get(name='Alpine'),
+            user=self.alice)
+        self.assertEqual(autocomplete.complete('!ALP'), [('!Alpine', 1),
+            ('!alpha', 0)])
+        
+        self.alex.delete()
+        self.assertEqual(autocomplete.complete('@al'), [('@alice', 0)])
+    
+    def test_view(self):
+        response = self.client.get('/autocomplete/', {'q': '#alp'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(simplejson.loads(response.content), [
+            {'value': '#alpine', 'weight': 1},
+            {'value': '#alps', 'weight': 1}])
+        self.assertEqual(self.client.get('/autocomplete/', {'q': 'alp'}
+            ).status_code, 400)
+
+
+class ThreadTest(CoreTestCase):
+    
+    def setUp(self):
+        super(ThreadTest, self).setUp()
+        self.users = [User.objects.create_user(username, '%s@example.com' %
+            username) for username in ('alice', 'bob', 'carol', 'dave')]
+        alice, bob, carol, dave = self.users
+        Group.objects.create(name='secret', owner=alice, is_closed=True)
+        self.notices = []
+        for author, text in ((alice, 'root'), (bob, '@alice hi'),
+            (carol, '@alice @bob hey'), (dave, '!secret @carol psst')):
+            notice = Notice(author=author, text=text, via_id=1)
+            notice.save()
+            self.notices.append(notice)
+        
+        late = Notice(author=dave, text='late reply', via_id=1,
+            parent_id=self.notices[0].id)
+        late.save()
+        self.notices.append(late)
+    
+    def threads(self):
+        return [Notice.objects.filter(id=notice.id).values_list(
+            'thread_id', 'parent_id', 'depth')[0] for notice in self.notices]
+    
+    def test_save(self):
+        root, hi, hey, psst, late = [notice.id for notice in self.notices]
+        self.assertEqual(self.threads(), [(None, None, 0), (root, root, 1),
+            (root, hi, 2), (root, hey, 3), (root, root, 1)])
+        
+        Notice.objects.update(thread_id=None, parent_id=None, depth=0)
+        management.call_command('rebuildthreads', chunk_size=2, verbosity=0)
+        self.assertEqual(self.threads(), [(None, None, 0), (root, root, 1),
+            (root, hi, 2), (root, hey, 3), (root, root, 1)])
+    
+    def test_thread(self):
+        root, hi, hey, psst, late = self.notices
+        notices = Notice.objects.thread(hey)
+        self.assertEqual(notices, [root, hi, hey, late])
+        self.assertEqual([notice.thread_level for notice in notices],
+            [0, 1, 2, 1])
+        
+        response = self.client.get(late.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context[0]['notices'], notices)
+        self.assertEqual(self.client.get(psst.get_absolute_url()
+            ).status_code, 404)
+    
+    def test_restricted_parent(self):
+        alice, bob, carol, dave = self.users
+        root, hi, hey, psst, late = [notice.id for notice in self.notices]
+        GroupUser.objects.create(group=Group.objects.get(name='secret'),
+            user=carol)
+        
+        """ only members of the group of a restricted parent reply to it """
+        peek = Notice(author=bob, text='peek', via_id=1, parent_id=psst)
+        peek.save()
+        shh = Notice(author=carol, text='shh', via_id=1, parent_id=psst)
+        shh.save()
+        self.assertEqual([Notice.objects.filter(id=notice.id).values_list(
+            'thread_id', 'parent_id', 'depth')[0] for notice in (peek, shh)],
+            [(None, None, 0), (root, psst, 4)])
+        self.failIf(Mention.objects.filter(notice=peek))
+        self.assertEqual(list(Mention.objects.filter(notice=shh).values_list(
+            'user', flat=True)), [dave.id])
+    
+    def test_delete(self):
+        root, hi, hey, psst, late = [notice.id for notice in self.notices]
+        Notice.objects.get(id=hi).delete()
+        self.assertEqual(Notice.objects.filter(id=hey).values_list(
+            'thread_id', 'parent_id', 'depth')[0], (root, root, 1))
+        Notice.objects.get(id=root).delete()
+        self.assertEqual(list(Notice.objects.order_by('id').values_list(
+            'id', 'thread_id', 'parent_id', 'depth')), [(hey, None, None, 0),
+            (psst, hey, hey, 1), (late, None, None, 0)])
+    
+    def test_queryset_delete_keeps_replies(self):
+        root, hi, hey, psst, late = [notice.id for notice in self.notices]
+        alice, bob, carol, dave = self.users
+        Notice.objects.filter(id__in=[root, hi]).delete()
+        self.assertEqual(list(Notice.objects.order_by('id').values_list(
+            'id', 'thread_id', 'parent_id', 'depth')), [(hey, None, None, 0),
+            (psst, hey, hey, 1), (late, None, None, 0)])
+        self.assertEqual(UserInfo.objects.get(user=alice).last_id, None)
+        self.assertEqual(UserInfo.objects.get(user=bob).notices_count, 0)
+        self.assertEqual(UserInfo.objects.get(user=carol).notices_count, 1)
+    
+    def test_user_delete_keeps_replies(self):
+        root, hi, hey, psst, late = [notice.id for notice in self.notices]
+        alice, bob, carol, dave = self.users
+        alice.delete()
+        self.assertEqual(list(Notice.objects.order_by('id').values_list(
+            'id', 'thread_id', 'parent_id', 'depth')), [(hi, None, None, 0),
+            (hey, hi, hi, 1), (psst, hi, hey, 2), (late, None, None, 0)])
+        self.assertEqual(UserInfo.objects.get(user=bob).last_id, hi)
+        self.assertEqual(UserInfo.objects.get(user=bob).notices_count, 1)
+        self.assertEqual(UserInfo.objects.get(user=dave).notices_count, 2)
+
+
+class MentionTest(CoreTestCase):
+    
+    def setUp(self):
+        super(MentionTest, self).setUp()
+        self.users = [User.objects.create_user(username, '%s@example.com' %
+            username, 'secret') for username in ('alice', 'bob', 'carol',
+                'dave')]
+        alice, bob, carol, dave = self.users
+        secret = Group.objects.create(name='secret', owner=alice,
+            is_closed=True)
+        GroupUser.objects.create(group=secret, user=bob)
+        Block.block(carol, alice)
+        for user in self.users:
+            Notice(author=user, text='hello', via_id=1).save()
+        
+        self.notices = []
+        for author, text, parent in ((alice, '@bob @carol @alice hi', None),
+            (bob, 'no mention', 'hi'), (alice, '!secret @bob @dave', None)):
+            notice = Notice(author=author, text=text, via_id=1,
+                parent_id=parent and self.notices[0].id)
+            notice.save()
+            self.notices.append(notice)
+    
+    def mentions(self):
+        return sorted(Mention.objects.values_list('user__username',
+            'notice__text'))
+    
+    def unread(self, user):
+        return UserInfo.objects.get(user=user).unread_mentions_count
+    
+    def test_save(self):
+        alice, bob, carol, dave = self.users
+        self.assertEqual(self.mentions(), [
+            ('alice', 'no mention'),
+            ('bob', '!secret @bob @dave'),
+            ('bob', '@bob @carol @alice hi')])
+        self.assertEqual([self.unread(user) for user in self.users],
+            [1, 2, 0, 0])
+        self.assertEqual([entry.notice for entry in
+            Inbox.objects.timeline(bob) if entry.notice.author == alice],
+            [self.notices[2], self.notices[0]])
+        
+        Block.block(bob, alice)
+        self.assertEqual(self.mentions(), [('alice', 'no mention')])
+    
+    def test_deletes_uncount_unread(self):
+        alice, bob, carol, dave = self.users
+        Mention.objects.filter(user=alice).update(is_read=True)
+        UserInfo.objects.filter(user=alice).update(unread_mentions_count=0)
+        
+        Notice.objects.filter(id=self.notices[2].id).delete()
+        self.assertEqual(self.unread(bob), 1)
+        Block.block(bob, alice)
+        self.assertEqual(self.unread(bob), 0)
+        Notice.objects.filter(id=self.notices[1].id).delete()
+        self.assertEqual(self.unread(alice), 0)
+    
+    def test_reconcile(self):
+        alice, bob, carol, dave = self.users
+        Mention.objects.filter(user=alice).update(is_read=True)
+        UserInfo.objects.update(unread_mentions_count=5)
+        management.call_command('reconcile_counters', verbosity=0)
+        self.assertEqual([self.unread(user) for user in self.users],
+            [0, 2, 0, 0])
+    
+    def test_rebuild(self):
+        mentions = self.mentions()
+        Mention.objects.all().delete()
+        management.call_command('rebuildmentions', verbosity=0)
+        self.assertEqual(self.mentions(), mentions)
+        self.failIf(Mention.objects.filter(is_read=False).count())
+    
+    def test_view(self):
+        alice, bob, carol, dave = self.users
+        self.client.login(username='bob', password='secret')
+        response = self.client.get('/replies/')
+        self.assertEqual([(entry.notice, entry.is_read) for entry in
+            response.context[0]['entries'].object_list], [
+                (self.notices[2], False), (self.notices[0], False)])
+        self.assertEqual(self.unread(bob), 0)
+        
+        response = self.client.get('/replies/')
+        self.assertEqual([entry.is_read for entry in
+            response.context[0]['entries'].object_list], [True, True])
+        self.assertEqual(self.client.get('/replies/before/1-1').status_code,
+            404)
+
+
+class NoticeHtmlTest(CoreTestCase):
+    
+    def setUp(self):
+        super(NoticeHtmlTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+    
+    def test_render(self):
+        self.assertEqual(render_notice(u'<b>@bob</b> #py: http://x.org/?a=1&b'
+            ' !grp'), u'&lt;b&gt;@<a href="/bob/" class="url">bob</a>'
+            u'&lt;/b&gt; #<a href="/tag/py/" rel="tag">py</a>: '
+            u'<a href="http://x.org/?a=1&amp;b" rel="nofollow external">'
+            u'http://x.org/?a=1&amp;b</a> !<span class="group">grp</span>')
+    
+    def test_versions(self):
+        notice = Notice(author=self.alice, text='#python & more', via_id=1)
+        notice.save()
+        self.assertEqual(notice.html_version, NOTICE_HTML_VERSION)
+        self.assertEqual(Notice.objects.get(id=notice.id).get_html(),
+            u'#<a href="/tag/python/" rel="tag">python</a> &amp; more')
+        
+        Notice.objects.update(html='stale', html_version=0)
+        self.assertEqual(Notice.objects.get(id=notice.id).get_html(),
+            notice.html)
+        self.assertEqual(Notice.objects.get(id=notice.id).html_version,
+            NOTICE_HTML_VERSION)
+        
+        Notice.objects.update(html='stale', html_version=0)
+        management.call_command('rendernotices', chunk_size=1, verbosity=0)
+        self.assertEqual(list(Notice.objects.values_list('html', flat=True)),
+            [notice.html])
+
+
+class FragmentCacheTest(CoreTestCase):
+    
+    def setUp(self):
+        super(FragmentCacheTest, self).setUp()
+        fragments.flush_stats()
+        fragments.reset_stats()
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        self.notice = Notice(author=self.alice, text='hello', via_id=1)
+        self.notice.save()
+    
+    def render(self):
+        notice = Notice.objects.select_related().get(id=self.notice.id)
+        hits, misses = fragments.hits, fragments.misses
+        html = fragments.render(notice)
+        return html, (fragments.hits - hits, fragments.misses - misses)
+    
+    def test_versions(self):
+        html, counts = self.render()
+        self.assertEqual(counts, (0, 1))
+        self.failUnless('hello' in html and 'minutes' in html)
+        self.failIf(u'\x00' in html)
+        self.assertEqual(self.render(), (html, (1, 0)))
+        
+        self.notice.text = 'changed'
+        self.notice.save()
+        html, counts = self.render()
+        self.assertEqual(counts, (0, 1))
+        self.failUnless('changed' in html)
+        
+        self.alice.first_name = 'Alice'
+        self.alice.save()
+        html, counts = self.render()
+        self.assertEqual(counts, (0, 1))
+        self.failUnless('Alice' in html)
+        self.assertEqual(self.render()[1], (1, 0))
+    
+    def test_view_stats(self):
+        for i in range(3):
+            Notice(author=self.alice, text='more', via_id=1).save()
+        self.client.get('/')
+        """ past the anonymous page cache """
+        pages.bump(public=True)
+        self.client.get('/')
+        hits, misses = fragments.stats()
+        self.assertEqual((hits, misses), (4, 4))
+        
+        management.call_command('fragmentstats', reset=True, verbosity=0)
+        self.assertEqual(fragments.stats(), (0, 0))
+
+
+class ConditionalGetTest(CoreTestCase):
+    
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com',
+            'secret')
+        self.bob = User.objects.create_user('bob', 'bob@example.com')
+        self.notice = Notice(author=self.bob, text='hello', via_id=1)
+        self.notice.save()
+    
+    def revalidate(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    
+    def test_not_modified(self):
+        self.client.login(username='alice', password='secret')
+        for url in ('/', '/bob/', '/alice/all/'):
+            response = self.revalidate(url)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, '')
+    
+    def test_last_modified(self):
+        response = self.client.get('/bob/')
+        self.failIf(response.has_header('Last-Modified'))
+        
+        """ changes within the current second are never trusted """
+        ago = time.time() - 10
+        Notice.objects.update(posted=datetime.fromtimestamp(ago))
+        cache.set(TIMELINES_STAMP_KEY, ago)
+        cache.set(USER_STAMP_KEY % self.bob.id, ago)
+        response = self.client.get('/bob/')
+        self.assertEqual(response['Last-Modified'], http_date(ago))
+        self.assertEqual(self.client.get('/bob/',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            304)
+        
+        Follow.subscribe(self.alice, self.bob)
+        self.assertEqual(self.client.get('/bob/',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            200)
+    
+    def test_changes(self):
+        self.client.login(username='alice', password='secret')
+        response = self.client.get('/')
+        Notice(author=self.bob, text='news', via_id=1).save()
+        self.assertEqual(self.client.get('/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        
+        response = self.client.get('/bob/')
+        Follow.subscribe(self.alice, self.bob)
+        self.assertEqual(self.client.get('/bob/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        
+        response = self.client.get('/alice/all/')
+        self.notice.text = 'changed'
+        self.notice.save()
+        self.assertEqual(self.client.get('/alice/all/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        
+        response = self.client.get('/alice/all/')
+        self.notice.delete()
+        self.assertEqual(self.client.get('/alice/all/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+    
+    def test_viewer(self):
+        response = self.client.get('/bob/')
+        self.client.login(username='alice', password='secret')
+        self.assertEqual(self.client.get('/bob/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class PageCacheTest(CoreTestCase):
+    
+    def setUp(self):
+        super(PageCacheTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com',
+            'secret')
+        self.notice = Notice(author=self.alice, text='hello', via_id=1)
+        self.notice.save()
+    
+    def test_anonymous(self):
+        self.failUnless('hello' in self.client.get('/').content)
+        self.failUnless('hello' in self.client.get('/alice/').content)
+        
+        """ no signals, cached pages stay """
+        Notice.objects.update(text='quiet', html='quiet')
+        self.failUnless('hello' in self.client.get('/').content)
+        self.failUnless('hello' in self.client.get('/alice/').content)
+        
+        self.client.login(username='alice', password='secret')
+        self.failUnless('quiet' in self.client.get('/').content)
+        self.client.logout()
+        
+        Notice(author=self.alice, text='news', via_id=1).save()
+        for url in ('/', '/alice/'):
+            content = self.client.get(url).content
+            self.failUnless('news' in content and 'quiet' in content)
+    
+    def test_lock(self):
+        renders = []
+        def render():
+            renders.append(1)
+            return HttpResponse('page %d' % len(renders))
+        
+        request = HttpRequest()
+        request.path = '/'
+        name = md5_constructor('/:%s' % translation.get_language()
+            ).hexdigest()
+        cache.delete(PAGE_KEY % name)
+        lock_timeout, pages.lock_timeout = pages.lock_timeout, 0.2
+        try:
+            """ nothing to give out, waits for the lock holder """
+            cache.add(LOCK_KEY % name, 1)
+            self.assertEqual(pages.get_or_render(request, (), render).content,
+                'page 1')
+            cache.delete(LOCK_KEY % name)
+            
+            self.assertEqual(pages.get_or_render(request, (), render).content,
+                'page 2')
+            self.assertEqual(pages.get_or_render(request, (), render).content,
+                'page 2')
+            
+            """ the page of a moment ago while the lock holder renders """
+            pages.bump(public=True)
+            cache.add(LOCK_KEY % name, 1)
+            self.assertEqual(pages.get_or_render(request, (), render).content,
+                'page 2')
+            cache.delete(LOCK_KEY % name)
+            self.assertEqual(pages.get_or_render(request, (), render).content,
+                'page 3')
+            self.assertEqual(len(renders), 3)
+        finally:
+            pages.lock_timeout = lock_timeout
+            cache.delete(PAGE_KEY % name)
+
+
+class CsrfTokenTest(CoreTestCase):
+    
+    def setUp(self):
+        super(CsrfTokenTest, self).setUp()
+        self.alice = User.objects.create_user('alice', 'alice@example.com',
+            'secret')
+        self.bob = User.objects.create_user('bob', 'bob@example.com',
+            'secret')
+        Notice(author=self.bob, text='hello', via_id=1).save()
+    
+    def tokens(self, url):
+        return set(re.findall(r'name="csrfmiddlewaretoken" value="(\w*)"',
+            self.client.get(url).content))
+    
+    def test_post(self):
+        self.assertEqual(self.tokens('/'), set())
+        
+        self.client.login(username='alice', password='secret')
+        tokens = self.tokens('/')
+        self.assertEqual(len(tokens), 1)
+        self.assertEqual(self.client.post('/post/',
+            {'text': 'no token'}).status_code, 403)
+        response = self.client.post('/post/', {'text': 'with token',
+            'csrfmiddlewaretoken': tokens.pop()})
+        self.assertEqual(response.status_code, 302)
+        self.failUnless(Notice.objects.filter(text='with token'))
+        
+        """ cached notice fragments get the token of every viewer """
+        self.client.login(username='bob', password='secret')
+        bob_tokens = self.tokens('/')
+        self.assertEqual(len(bob_tokens), 1)
+        self.failIf(bob_tokens & tokens)
+    
+    def test_rewrite_paths(self):
+        self.client.login(username='alice', password='secret')
+        self.failUnless('csrfmiddlewaretoken' in
+            self.client.get('/admin/').content)
+
+
+class AssetsTest(CoreTestCase):
+    
+    def setUp(self):
+        super(AssetsTest, self).setUp()
+        self.static_root = settings.STATIC_ROOT
+        settings.STATIC_ROOT = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(settings.STATIC_ROOT)
+        settings.STATIC_ROOT = self.static_root
+        super(AssetsTest, self).tearDown()
+    
+    def test_build(self):
+        management.call_command('buildassets', verbosity=0)
+        names = simplejson.load(open(os.path.join(settings.STATIC_ROOT,
+            MANIFEST_NAME)))
+        self.failUnless(re.match(r'^images/logo\.\w{12}\.png$',
+            names['images/logo.png']))
+        
+        css_path = os.path.join(settings.STATIC_ROOT,
+            names['css/display.css'])
+        css = open(css_path).read()
+        self.failIf('{{' in css)
+        self.failUnless('url(/static/%s)' %
+            names['images/laconica/icons/icon_rss.png'] in css)
+        self.assertEqual(gzip.open(css_path + '.gz').read(), css)
+        self.failIf(os.path.exists(os.path.join(settings.STATIC_ROOT,
+            names['images/logo.png'] + '.gz')))
+        
+        management.call_command('buildassets', clear=True, verbosity=0)
+        self.assertEqual(simplejson.load(open(os.path.join(
+            settings.STATIC_ROOT, MANIFEST_NAME))), names)
+        
+        manifest = AssetManifest(settings.STATIC_ROOT, '/static/')
+        self.assertEqual(manifest.url_of('css/display.css'),
+            '/static/' + names['css/display.css'])
+        self.assertEqual(AssetManifest(tempfile.gettempdir(), '/static/'
+            ).url_of('images/logo.png'), settings.MEDIA_URL +
+            'images/logo.png')
+
+
+class MediaServeTest(CoreTestCase):
+    
+    url = '/media/images/favicon.png'
+    
+    def setUp(self):
+        super(MediaServeTest, self).setUp()
+        self.path = os.path.join(settings.MEDIA_ROOT, 'images', 'favicon.png')
+        self.content = open(self.path, 'rb').read()
+        self.sendfile_header = settings.MEDIA_SENDFILE_HEADER
+        """ a sub-second mtime must still compare equal to the header """
+        stat_result = os.stat(self.path)
+        self.times = (stat_result.st_atime, stat_result.st_mtime)
+        os.utime(self.path, (stat_result.st_atime,
+            int(stat_result.st_mtime) + 0.5))
+    
+    def tearDown(self):
+        os.utime(self.path, self.times)
+        settings.MEDIA_SENDFILE_HEADER = self.sendfile_header
+        super(MediaServeTest, self).tearDown()
+    
+    def test_full(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.content)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Last-Modified'],
+            http_date(os.stat(self.path).st_mtime))
+        self.failIf(response.has_header('Expires'))
+        
+        self.assertEqual(self.client.get(self.url,
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get('/media/images/').status_code, 404)
+        
+        request = HttpRequest()
+        request.method = 'GET'
+        response = media.serve(request, 'images/favicon.png',
+            settings.MEDIA_ROOT, expires=media.FAR_FUTURE)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=%d' %
+            media.FAR_FUTURE)
+        self.assertEqual(self.client.get('/media/../urls.py').status_code,
+            404)
+    
+    def test_ranges(self):
+        size = len(self.content)
+        for header, start, end in (('bytes=0-9', 0, 9),
+            ('bytes=10-', 10, size - 1), ('bytes=-5', size - 5, size - 1),
+            ('bytes=5-100000', 5, size - 1)):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.content, self.content[start:end + 1])
+            self.assertEqual(response['Content-Range'],
+                'bytes %d-%d/%d' % (start, end, size))
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=%d-' % size)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % size)
+        
+        """ several ranges and stale If-Range get the whole file """
+        self.assertEqual(self.client.get(self.url,
+            HTTP_RANGE='bytes=0-1,5-6').content, self.content)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1',
+            HTTP_IF_RANGE=http_date(0)).status_code, 200)
+    
+    def test_sendfile(self):
+        settings.MEDIA_SENDFILE_HEADER = 'X-Sendfile'
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.path)
+        self.assertEqual(response.content, '')
+        
+        settings.MEDIA_SENDFILE_HEADER = 'X-Accel-Redirect'
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'],
+            settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + self.url)
+
+
+def failing_job(message):
+    raise ValueError(message)
+
+
+class JobQueueTest(CoreTestCase):
+    
+    def setUp(self):
+        super(JobQueueTest, self).setUp()
+        self.saved = (settings.JOB_QUEUE_ASYNC, settings.JOB_MAX_ATTEMPTS)
+        settings.JOB_QUEUE_ASYNC = True
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        self.bob = User.objects.create_user('bob', 'bob@example.com')
+        Follow.subscribe(self.bob, self.alice)
+    
+    def tearDown(self):
+        settings.JOB_QUEUE_ASYNC, settings.JOB_MAX_ATTEMPTS = self.saved
+        super(JobQueueTest, self).tearDown()
+    
+    def run_jobs(self):
+        management.call_command('runjobs', processes=0, once=True,
+            verbosity=0)
+    
+    def test_notice(self):
+        notice = Notice(author=self.alice, text='hi @bob #news', via_id=1)
+        notice.save()
+        self.failIf(Inbox.objects.filter(notice=notice))
+        self.failIf(notice.tags.all())
+        
+        """ the same key is queued once """
+        job = Job.objects.get()
+        self.assertEqual(job.key, 'notice:%d' % notice.id)
+        enqueue(job.name, simplejson.loads(job.args), job.key)
+        self.assertEqual(Job.objects.count(), 1)
+        
+        self.run_jobs()
+        self.assertEqual(Job.objects.get().status, Job.STATUS_DONE)
+        self.assertEqual(set(Inbox.objects.filter(notice=notice).values_list(
+            'user', flat=True)), set([self.alice.id, self.bob.id]))
+        self.assertEqual([tag.name for tag in notice.tags.all()], ['news'])
+        self.assertEqual(Mention.objects.get().user, self.bob)
+        info = UserInfo.objects.get(user=self.alice)
+        self.assertEqual((info.last_id, info.notices_count), (notice.id, 1))
+        
+        self.run_jobs()
+        self.assertEqual(Inbox.objects.filter(notice=notice).count(), 2)
+    
+    def test_retries(self):
+        settings.JOB_MAX_ATTEMPTS = 2
+        enqueue('core.tests.failing_job', ['broken'])
+        self.run_jobs()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_PENDING, 1))
+        self.failUnless('broken' in job.error)
+        self.failUnless(job.run_at > datetime.now())
+        
+        Job.objects.update(run_at=datetime.now())
+        self.run_jobs()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+
+
+class JobRetryTest(TransactionTestCase):
+    """ TestCase turns rollbacks into no-ops, attempts must roll back here """
+    
+    def setUp(self):
+        self.search_backend = search._backend
+        search._backend = SqliteFTSBackend(':memory:')
+        self.saved = settings.JOB_QUEUE_ASYNC
+        settings.JOB_QUEUE_ASYNC = True
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        self.deliver = Inbox.__dict__['deliver']
+        """ tag ids of other tests are reused after the flush """
+        autocomplete.load()
+    
+    def tearDown(self):
+        settings.JOB_QUEUE_ASYNC = self.saved
+        Inbox.deliver = self.deliver
+        counters.flush()
+        trends.flush()
+        pages.bump(public=True)
+        search._backend = self.search_backend
+    
+    def test_failed_attempt_is_not_counted(self):
+        deliver, attempts = Inbox.deliver, []
+        def flaky_deliver(cls, notice):
+            attempts.append(notice.id)
+            if len(attempts) == 1:
+                raise IOError('inbox is down')
+            deliver(notice)
+        Inbox.deliver = classmethod(flaky_deliver)
+        device_count = Device.objects.get(id=1).notices_count
+        
+        notice = Notice(author=self.alice, text='#retried', via_id=1)
+        notice.save()
+        management.call_command('runjobs', processes=0, once=True,
+            verbosity=0)
+        self.assertEqual(Job.objects.get().status, Job.STATUS_PENDING)
+        self.failIf(Tag.objects.filter(name='retried'))
+        
+        Job.objects.update(run_at=datetime.now())
+        management.call_command('runjobs', processes=0, once=True,
+            verbosity=0)
+        self.assertEqual(Job.objects.get().status, Job.STATUS_DONE)
+        self.assertEqual(len(attempts), 2)
+        
+        counters.flush()
+        trends.flush()
+        tag = Tag.objects.get(name='retried')
+        self.assertEqual(tag.use_count, 1)
+        self.assertEqual(Device.objects.get(id=1).notices_count,
+            device_count + 1)
+        self.assertEqual(TagTrend.objects.get(tag=tag).count, 1)
+        self.assertEqual(autocomplete.tags.complete('retried'),
+            [('retried', 1)])
+        self.assertEqual(UserInfo.objects.get(user=self.alice).notices_count,
+            1)
+    
+    def test_rolled_back_save_is_not_counted(self):
+        settings.JOB_QUEUE_ASYNC = False
+        def broken_deliver(cls, notice):
+            raise IOError('inbox is down')
+        Inbox.deliver = classmethod(broken_deliver)
+        device_count = Device.objects.get(id=1).notices_count
+        
+        notice = Notice(author=self.alice, text='#lost', via_id=1)
+        self.assertRaises(IOError, notice.save)
+        self.failIf(trends._buckets)
+        counters.flush()
+        self.assertEqual(Device.objects.get(id=1).notices_count, device_count)
+        self.failIf(Tag.objects.filter(name='lost'))
+        
+        """ deltas of a committed save are buffered after the commit """
+        Inbox.deliver = self.deliver
+        notice = Notice(author=self.alice, text='#kept', via_id=1)
+        notice.save()
+        self.failUnless(counters._deltas and trends._buckets)
+        counters.flush()
+        trends.flush()
+        tag = Tag.objects.get(name='kept')
+        self.assertEqual(tag.use_count, 1)
+        self.assertEqual(TagTrend.objects.get(tag=tag).count, 1)
+        self.assertEqual(Device.objects.get(id=1).notices_count,
+            device_count + 1)
@@ -0,0 +1,155 @@
+"""
+Copyright 2009 Serge Matveenko
+
+This file is part of Pythonica.
+
+Pythonica is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pythonica is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
+
+@note: tag use counts in fixed time buckets for trending tags, the ranking
+    itself is TagManager.trending
+"""
+
+import atexit
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+from counters import WriteBehindBuffer, update_counter
+
+
+_EPOCH = datetime(2000, 1, 1)
+
+""" keep IN (...) lists under SQLite's 999 variables limit """
+_CHUNK_SIZE = 500
+
+
+def bucket_of(when, size):
+    """ start of the size seconds long bucket when falls into """
+    age = when - _EPOCH
+    seconds = age.days * 86400 + age.seconds
+    return when - timedelta(seconds=seconds % size,
+        microseconds=when.microsecond)
+
+
+def _chunks(items, size=_CHUNK_SIZE):
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+
+class TrendBuffer(WriteBehindBuffer):
+    """
+    Write-behind tag use counts per time bucket. Uses are summed in memory
+    by (bucket, tag) and written to TagTrend rows, one per tag and bucket,
+    when max_size pairs are pending or the oldest use is max_age seconds
+    old, same as CounterBuffer.
+    
+    @note: first writes of one bucket from two processes may collide on
+        the (tag, bucket) unique key, the losing insert becomes an update
+    @note: uses of a process that dies, or of a flush that fails, are lost
+    """
+    
+    def __init__(self, bucket_size, max_age=0, max_size=1000):
+        super(TrendBuffer, self).__init__(max_age, max_size)
+        self.bucket_size = bucket_size
+        self._buckets = {}
+        self._size = 0
+    
+    def add(self, tag_ids, when):
+        if not tag_ids:
+            return
+        bucket = bucket_of(when, self.bucket_size)
+        
+        self._lock.acquire()
+        try:
+            counts = self._buckets.setdefault(bucket, {})
+            for id in tag_ids:
+                if id not in counts:
+                    counts[id] = 0
+                    self._size += 1
+                counts[id] += 1
+            if self._since is None:
+                self._since = time.time()
+            is_full = self._size >= self.max_size
+            if self.max_age:
+                self._start_timer()
+        finally:
+            self._lock.release()
+        
+        if not self.max_age or is_full:
+            self.flush()
+        else:
+            self.flush_stale()
+    
+    def flush(self):
+        self._lock.acquire()
+        try:
+            buckets, self._buckets = self._buckets, {}
+            self._size, self._since = 0, None
+        finally:
+            self._lock.release()
+        
+        for bucket, counts in buckets.items():
+            for ids in _chunks(counts.keys()):
+                self._write(bucket, dict((id, counts[id]) for id in ids))
+    
+    def _write(self, bucket, counts):
+        from models import TagTrend
+        trends = TagTrend.objects.filter(bucket=bucket)
+        existing = set(trends.filter(tag__in=counts.keys()).values_list(
+            'tag', flat=True))
+        
+        ids_by_delta = {}
+        for id in existing:
+            ids_by_delta.setdefault(counts[id], []).append(id)
+        for delta, ids in ids_by_delta.items():
+            update_counter(trends.filter(tag__in=ids), 'count', delta)
+        
+        new = [(id, bucket, count) for id, count in counts.items()
+            if id not in existing]
+        if not new:
+            return
+        if connection.features.uses_savepoints:
+            if _insert_trends(new):
+                return
+        
+        """
+        a row was inserted meanwhile, or there are no savepoints to undo a
+        partly done bulk insert: go row by row
+        """
+        for row in new:
+            if not _insert_trends([row]):
+                update_counter(trends.filter(tag=row[0]), 'count', row[2])
+
+
+def _insert_trends(rows):
+    """
+    Insert (tag, bucket, count) rows, returns False and leaves the current
+    transaction usable if one of them exists already
+    """
+    from models import TagTrend, _insert_many
+    sid = transaction.savepoint()
+    try:
+        _insert_many(TagTrend, ('tag', 'bucket', 'count'), rows)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        return False
+    transaction.savepoint_commit(sid)
+    return True
+
+
+trends = TrendBuffer(settings.TRENDING_TAGS_BUCKET,
+    settings.COUNTER_BUFFER_MAX_AGE, settings.COUNTER_BUFFER_SIZE)
+atexit.register(trends.close)
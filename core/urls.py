@@ -22,6 +22,8 @@ import os
 from django.conf import settings
 from django.conf.urls.defaults import *
 
+from paginator import CURSOR_REGEX
+
 patterns_prefix = '.'.join((os.path.basename(os.path.dirname(__file__)),
     'views',))
 
@@ -29,22 +31,51 @@ patterns_prefix = '.'.join((os.path.basename(os.path.dirname(__file__)),
 urlpatterns = patterns(patterns_prefix,
     
     (r'^$', 'index', {}, 'pythonica-index'),
-    (r'^page/(?P<page>\d+)$', 'index', {}, 'pythonica-index'),
+    (r'^before/(?P<before>%s)$' % CURSOR_REGEX, 'index', {},
+        'pythonica-index'),
+    (r'^after/(?P<after>%s)$' % CURSOR_REGEX, 'index', {}, 'pythonica-index'),
     
     (r'^post/$', 'post', {}, 'pythonica-post'),
     
     (r'^accounts/profile/$', 'edit_profile', {}, 'pythonica-profile-edit'),
     
+    (r'^replies/$', 'replies', {}, 'pythonica-replies'),
+    (r'^replies/before/(?P<before>%s)$' % CURSOR_REGEX, 'replies', {},
+        'pythonica-replies'),
+    (r'^replies/after/(?P<after>%s)$' % CURSOR_REGEX, 'replies', {},
+        'pythonica-replies'),
+    
+    (r'^tag/(?P<name>%s)/$' % settings.HASHTAG_REGEX, 'tag', {},
+        'pythonica-tag'),
+    (r'^tag/(?P<name>%s)/before/(?P<before>%s)$' % (settings.HASHTAG_REGEX,
+        CURSOR_REGEX), 'tag', {}, 'pythonica-tag'),
+    (r'^tag/(?P<name>%s)/after/(?P<after>%s)$' % (settings.HASHTAG_REGEX,
+        CURSOR_REGEX), 'tag', {}, 'pythonica-tag'),
+    
+    (r'^notice/(?P<id>\d+)/$', 'thread', {}, 'pythonica-notice'),
+    
+    (r'^tags/$', 'tags', {}, 'pythonica-tags'),
+    
+    (r'^autocomplete/$', 'autocomplete', {}, 'pythonica-autocomplete'),
+    
+    (r'^search/$', 'search', {}, 'pythonica-search'),
+    
     (r'^subscribe/$', 'subscribe', {}, 'pythonica-subscribe'),
     (r'^block/$', 'block', {}, 'pythonica-block'),
     
     (r'^(?P<username>%s)/$' % settings.USERNAME_REGEX, 'profile', {},
         'pythonica-profile'),
-    (r'^(?P<username>%s)/page/(?P<page>\d+)$' % settings.USERNAME_REGEX,
-        'profile', {}, 'pythonica-profile'),
+    (r'^(?P<username>%s)/before/(?P<before>%s)$' % (settings.USERNAME_REGEX,
+        CURSOR_REGEX), 'profile', {}, 'pythonica-profile'),
+    (r'^(?P<username>%s)/after/(?P<after>%s)$' % (settings.USERNAME_REGEX,
+        CURSOR_REGEX), 'profile', {}, 'pythonica-profile'),
     
     (r'^(?P<username>%s)/all/$' % settings.USERNAME_REGEX, 'list_all', {},
         'pythonica-all'),
-    (r'^(?P<username>%s)/all/page/(?P<page>\d+)$' % settings.USERNAME_REGEX,
-        'list_all', {}, 'pythonica-all'),
+    (r'^(?P<username>%s)/all/before/(?P<before>%s)$' % (
+        settings.USERNAME_REGEX, CURSOR_REGEX), 'list_all', {},
+        'pythonica-all'),
+    (r'^(?P<username>%s)/all/after/(?P<after>%s)$' % (
+        settings.USERNAME_REGEX, CURSOR_REGEX), 'list_all', {},
+        'pythonica-all'),
 )
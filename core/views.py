@@ -19,21 +19,56 @@ along with Pythonica.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
-from django.http import Http404, HttpResponseBadRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from django.db.models import Q
 from django.shortcuts import get_object_or_404, redirect
+from django.utils import simplejson
 from django.utils.translation import ugettext as _
 
-from decorators import login_proposed, render_to, post_required
+from autocomplete import autocomplete as names
+from decorators import login_proposed, render_to, paginate, \
+    annotate_authors, post_required, conditional, cache_anonymous
 from forms import NoticeForm, SubscribeForm, BlockForm
-from models import Notice, Follow, Block
+from models import Notice, Follow, Block, Inbox, Mention, Tag, TagTimeline
+from paginator import KeysetPaginator, InvalidCursor
+from search import get_backend, ORDER_RANK, ORDER_RECENT
 
 
+def _newest(queryset, id_field='id'):
+    """ (id, posted) of the newest row, or None """
+    rows = list(queryset.order_by('-posted', '-%s' % id_field).values_list(
+        id_field, 'posted')[:1])
+    return rows and rows[0] or None
+
+
+def _index_state(request, **kw):
+    return _newest(Notice.objects.public()), ()
+
+
+def _owner_ids(request, username, **kw):
+    return list(User.objects.filter(username=username).values_list('id',
+        flat=True))
+
+
+def _profile_state(request, username, **kw):
+    """ owner's restricted notices count too, they show to the owner """
+    owner_ids = _owner_ids(request, username)
+    return _newest(Notice.objects.filter(author__in=owner_ids)), owner_ids
+
+
+def _list_all_state(request, username, **kw):
+    owner_ids = _owner_ids(request, username)
+    return (_newest(Inbox.objects.filter(user__in=owner_ids), 'notice'),
+        owner_ids)
+
+
+@conditional(_index_state)
+@cache_anonymous()
 @render_to('main/index.html')
-def index(request, page=1):
-    last_notices_pages = Paginator(Notice.objects.public(), 10)
-    return {'last_notices': last_notices_pages.page(page)}
+@annotate_authors('last_notices')
+@paginate('last_notices')
+def index(request):
+    return {'last_notices': Notice.objects.public()}
 
 
 @login_required
@@ -48,9 +83,8 @@ def post(request):
             notice.author = request.user
             """ 1 for web """
             notice.via_id = 1
+            notice.parent_id = noticeForm.cleaned_data['in_reply_to']
             notice.save()
-            if noticeForm.cleaned_data['in_reply_to']:
-                notice.in_reply_to = noticeForm.cleaned_data['in_reply_to'],
             request.user.message_set.create(message=_('Your notice added'))
             return redirect('pythonica-all', username=notice.author)
     
@@ -70,9 +104,12 @@ def edit_profile(request):
     return {}
 
 
+@conditional(_profile_state)
+@cache_anonymous(_owner_ids)
 @login_proposed
 @render_to('profile/profile.html')
-def profile(request, username, is_logged_in, page=1):
+@paginate('notices')
+def profile(request, username, is_logged_in):
     """
     show user info and user timeline
     """
@@ -89,8 +126,6 @@ def profile(request, username, is_logged_in, page=1):
     if not is_logged_in or request.user != list_owner:
         notices = notices.filter(q_public)
     
-    notices = Paginator(notices, 10)
-    
     is_subscribed = (is_logged_in and
         Follow.is_subscribed(request.user, list_owner))
     subscribeForm = SubscribeForm(
@@ -100,13 +135,16 @@ def profile(request, username, is_logged_in, page=1):
     blockForm = BlockForm(
         initial={'blocked': list_owner.id, 'is_blocked': is_blocked})
     
-    return {'list_owner': list_owner, 'notices': notices.page(page),
+    return {'list_owner': list_owner, 'notices': notices,
         'is_subscribed': is_subscribed, 'subscribe_form': subscribeForm,
         'is_blocked': is_blocked, 'block_form': blockForm}
 
 
 @login_required
+@conditional(_list_all_state)
 @render_to('profile/all.html')
+@annotate_authors('entries', lambda entry: entry.notice)
+@paginate('entries', id_field='notice')
 def list_all(request, username):
     """
     we gonna show here: own notices, notices of the followed users, replies,
@@ -123,19 +161,100 @@ def list_all(request, username):
     except User.DoesNotExist:
         raise Http404
     
-    q_public = Q(is_restricted=False)
-    q_own = Q(author=list_owner)
-    q_followed = Q(author__followeds__follower=list_owner)
-    q_replies = Q(in_reply_to__author=list_owner)
-    q_from_groups = Q(groups__users=list_owner)
-    q_blocked = Q(author__is_blocked__blocker=list_owner)
+    """ timeline is materialized by Notice.save, see Inbox """
+    entries = Inbox.objects.timeline(list_owner)
+    
+    return {'list_owner': list_owner, 'entries': entries,}
+
+
+@login_required
+@render_to('main/replies.html')
+@annotate_authors('entries', lambda entry: entry.notice)
+def replies(request, before=None, after=None):
+    """
+    notices mentioning current user, shown ones are marked read
+    """
+    
+    try:
+        entries = KeysetPaginator(Mention.objects.timeline(request.user), 10,
+            id_field='notice').page(before, after)
+    except InvalidCursor:
+        raise Http404
+    Mention.mark_read(request.user, entries.object_list)
+    
+    return {'entries': entries}
+
+
+@render_to('main/tag.html')
+@annotate_authors('entries', lambda entry: entry.notice)
+@paginate('entries', id_field='notice')
+def tag(request, name):
+    """
+    public notices tagged with #name
+    """
+    
+    tag = get_object_or_404(Tag, name=name)
+    
+    return {'tag': tag, 'entries': TagTimeline.objects.timeline(tag),}
+
+
+@render_to('main/thread.html')
+@annotate_authors('notices')
+def thread(request, id):
+    """
+    whole conversation the notice belongs to
+    """
+    
+    notice = get_object_or_404(Notice.objects.public(), id=id)
+    return {'notice': notice, 'notices': Notice.objects.thread(notice)}
+
+
+@render_to('main/tags.html')
+def tags(request):
+    """
+    tags trending over the last TRENDING_TAGS_WINDOW hours
+    """
+    
+    return {'tags': Tag.objects.trending()}
+
+
+def autocomplete(request):
+    """
+    JSON list of @users, #tags or !groups starting with q (sigil included)
+    """
+    
+    try:
+        suggestions = names.complete(request.GET.get('q', ''))
+    except ValueError:
+        return HttpResponseBadRequest()
+    
+    return HttpResponse(simplejson.dumps([{'value': value, 'weight': weight}
+        for value, weight in suggestions]), mimetype='application/json')
+
+
+@render_to('main/search.html')
+def search(request):
+    """
+    full-text search over public notices, ranked or most recent first
+    """
+    
+    query = request.GET.get('q', '').strip()
+    order = request.GET.get('order', ORDER_RANK)
+    if order not in (ORDER_RANK, ORDER_RECENT):
+        return HttpResponseBadRequest()
+    
+    try:
+        ids, next_cursor = get_backend().search(query, order,
+            cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        raise Http404
     
-    """ ((own or followed or replies) and public) or from_groups
-    exclude blocked do not repeat one twice"""
-    notices = Notice.objects.filter(Q((q_own | q_followed | q_replies),
-        q_public) | q_from_groups).exclude(q_blocked).distinct()
+    """ index may lag behind deletes and restrictions, database decides """
+    notices = Notice.objects.public().in_bulk(ids)
+    notices = [notices[id] for id in ids if id in notices]
     
-    return {'list_owner': list_owner, 'notices': notices,}
+    return {'query': query, 'order': order, 'notices': notices,
+        'next_cursor': next_cursor}
 
 
 @login_required
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from registration.models import RegistrationProfile
+from registration.models import RegistrationProfile, QueuedEmail
 
 
 class RegistrationAdmin(admin.ModelAdmin):
@@ -9,3 +9,11 @@ class RegistrationAdmin(admin.ModelAdmin):
 
 
 admin.site.register(RegistrationProfile, RegistrationAdmin)
+
+
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'queued', 'attempts', 'next_attempt')
+    search_fields = ('recipients', 'subject')
+
+
+admin.site.register(QueuedEmail, QueuedEmailAdmin)
@@ -7,6 +7,8 @@ contains the actual logic for determining which accounts are deleted.
 
 """
 
+from optparse import make_option
+
 from django.core.management.base import NoArgsCommand
 
 from registration.models import RegistrationProfile
@@ -14,6 +16,26 @@ from registration.models import RegistrationProfile
 
 class Command(NoArgsCommand):
     help = "Delete expired user registrations from the database"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+                    help='Users deleted per transaction'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only count the users which would be deleted'),
+    )
 
     def handle_noargs(self, **options):
-        RegistrationProfile.objects.delete_expired_users()
+        verbosity = int(options.get('verbosity', 1))
+        dry_run = options['dry_run']
+        if dry_run:
+            message = "%d expired users would be deleted"
+        else:
+            message = "%d expired users deleted"
+
+        def progress(deleted):
+            if verbosity > 1:
+                print message % deleted
+
+        deleted = RegistrationProfile.objects.delete_expired_users(options['chunk_size'],
+                                                                   dry_run, progress)
+        if verbosity > 0:
+            print message % deleted
@@ -0,0 +1,35 @@
+"""
+A management command which sends email queued by
+``QueuedEmail.objects.queue()`` (activation email, when the setting
+``REGISTRATION_EMAIL_SPOOL`` is on) over one SMTP connection.
+
+Calls ``QueuedEmail.objects.send_queued()``, which contains the
+actual logic for batching, retries and backoff. Run it regularly,
+e.g. from cron every minute.
+
+Only one sender should run at a time (one cron entry). Messages are
+claimed before they are sent, so a run which overlaps a slow previous
+one skips the messages that run has taken instead of sending them
+again.
+
+"""
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from registration.models import QueuedEmail
+
+
+class Command(NoArgsCommand):
+    help = "Send queued email over one SMTP connection"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=100,
+                    help='Queued messages read from the database at a time'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        sent, failed = QueuedEmail.objects.send_queued(options['batch_size'])
+        if verbosity > 0:
+            print "Sent %d, failed %d" % (sent, failed)
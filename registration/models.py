@@ -2,9 +2,12 @@ import datetime
 import random
 import re
 import sha
+import smtplib
+import socket
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
@@ -66,7 +69,9 @@ class RegistrationManager(models.Manager):
         ``RegistrationProfile`` and email its activation key to the
         ``User``, returning the new ``User``.
         
-        To disable the email, call with ``send_email=False``.
+        To disable the email, call with ``send_email=False``. With the
+        setting ``REGISTRATION_EMAIL_SPOOL`` on, the email is queued
+        (see ``QueuedEmail``) instead of being sent during the request.
 
         The activation email will make use of two templates:
 
@@ -111,7 +116,6 @@ class RegistrationManager(models.Manager):
             profile_callback(user=new_user)
         
         if send_email:
-            from django.core.mail import send_mail
             current_site = Site.objects.get_current()
             
             subject = render_to_string('registration/activation_email_subject.txt',
@@ -124,7 +128,13 @@ class RegistrationManager(models.Manager):
                                          'expiration_days': settings.ACCOUNT_ACTIVATION_DAYS,
                                          'site': current_site })
             
-            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [new_user.email])
+            if getattr(settings, 'REGISTRATION_EMAIL_SPOOL', False):
+                QueuedEmail.objects.queue(subject, message,
+                                          settings.DEFAULT_FROM_EMAIL,
+                                          [new_user.email])
+            else:
+                from django.core.mail import send_mail
+                send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [new_user.email])
         return new_user
     
     def create_profile(self, user):
@@ -142,7 +152,7 @@ class RegistrationManager(models.Manager):
         return self.create(user=user,
                            activation_key=activation_key)
         
-    def delete_expired_users(self):
+    def delete_expired_users(self, chunk_size=1000, dry_run=False, progress=None):
         """
         Remove expired instances of ``RegistrationProfile`` and their
         associated ``User``s.
@@ -181,12 +191,49 @@ class RegistrationManager(models.Manager):
         does not have an associated ``RegistrationProfile`` will not
         be deleted.
         
+        Users are deleted in chunks of ``chunk_size``, each chunk in a
+        transaction of its own, so that a large backlog does not hold
+        locks on the auth tables for long. After every chunk,
+        ``progress`` (if given) is called with the number of users
+        deleted so far. With ``dry_run=True`` nothing is deleted, the
+        users which would be deleted are only counted.
+        
+        Returns the number of deleted users.
+        
         """
-        for profile in self.all():
-            if profile.activation_key_expired():
-                user = profile.user
-                if not user.is_active:
-                    user.delete()
+        deleted = 0
+        last_id = 0
+        while True:
+            user_ids = list(self.expired_users().filter(user__gt=last_id).order_by('user')[:chunk_size])
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            if not dry_run:
+                self._delete_users(user_ids)
+            deleted += len(user_ids)
+            if progress is not None:
+                progress(deleted)
+        return deleted
+    
+    def expired_users(self):
+        """
+        Return the ids of inactive ``User``s with an expired activation
+        key, as a ``values_list`` query, without loading any profile
+        or ``User``.
+        
+        The activation window is checked against ``date_joined`` in
+        the database (see ``sql/registrationprofile.sql`` for the
+        index), the same way ``activation_key_expired()`` checks it.
+        
+        """
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        return self.filter(Q(user__date_joined__lte=cutoff) |
+                           Q(activation_key=RegistrationProfile.ACTIVATED),
+                           user__is_active=False).values_list('user', flat=True)
+    
+    @transaction.commit_on_success
+    def _delete_users(self, user_ids):
+        User.objects.filter(id__in=user_ids).delete()
 
 
 class RegistrationProfile(models.Model):
@@ -248,3 +295,144 @@ class RegistrationProfile(models.Model):
         return self.activation_key == self.ACTIVATED or \
                (self.user.date_joined + expiration_date <= datetime.datetime.now())
     activation_key_expired.boolean = True
+
+
+class QueuedEmailManager(models.Manager):
+    """
+    Custom manager for the ``QueuedEmail`` model.
+    
+    Queues outgoing email and sends queued email in batches over one
+    SMTP connection.
+    
+    """
+    def queue(self, subject, message, from_email, recipient_list):
+        """
+        Queue an email for ``manage.py sendqueuedmail``, returning the
+        ``QueuedEmail``.
+        
+        """
+        return self.create(subject=subject, message=message,
+                           from_email=from_email,
+                           recipients='\n'.join(recipient_list),
+                           next_attempt=datetime.datetime.now())
+    
+    def send_queued(self, batch_size=100, connection=None):
+        """
+        Send email that is due over one SMTP connection, ``batch_size``
+        rows fetched at a time, returning the numbers of sent and
+        failed messages.
+        
+        Sent email is deleted. A message that fails is tried again
+        after ``QUEUED_EMAIL_RETRY_DELAY`` seconds, doubled on every
+        next attempt, and is given up after
+        ``QUEUED_EMAIL_MAX_ATTEMPTS`` attempts: it stays in the queue
+        with its last error and no next attempt.
+        
+        If the connection itself is lost, sending stops; the rest of
+        the queue is tried on the next run.
+        
+        Every batch is claimed (see ``claim()``) before it is sent, so
+        a run which overlaps the previous one does not send the same
+        email twice.
+        
+        """
+        from django.core import mail
+        if connection is None:
+            connection = mail.SMTPConnection()
+        sent = failed = 0
+        last_id = 0
+        connection.open()
+        try:
+            while True:
+                batch = list(self.filter(next_attempt__lte=datetime.datetime.now(),
+                                         id__gt=last_id).order_by('id')[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                claimed = self.claim(batch)
+                for i, queued in enumerate(claimed):
+                    try:
+                        connection.send_messages([queued.email_message()])
+                    except Exception, e:
+                        failed += 1
+                        queued.defer(e)
+                        if isinstance(e, (socket.error, smtplib.SMTPServerDisconnected)):
+                            # Give the rest of the batch back to the next run.
+                            self.filter(id__in=[rest.id for rest in claimed[i + 1:]]).update(
+                                next_attempt=datetime.datetime.now())
+                            return sent, failed
+                    else:
+                        sent += 1
+                        queued.delete()
+        finally:
+            connection.close()
+        return sent, failed
+    
+    def claim(self, batch):
+        """
+        Take due ``QueuedEmail``s of ``batch`` for sending, returning
+        the ones taken.
+        
+        Each one is taken by a conditional ``UPDATE`` which moves its
+        next attempt ``QUEUED_EMAIL_CLAIM_TIMEOUT`` seconds forward,
+        so of two senders only one gets it. Sending reschedules or
+        deletes it; if the sender dies first, it is due again once the
+        claim times out.
+        
+        """
+        timeout = getattr(settings, 'QUEUED_EMAIL_CLAIM_TIMEOUT', 600)
+        claimed = []
+        for queued in batch:
+            next_attempt = datetime.datetime.now() + datetime.timedelta(seconds=timeout)
+            if self.filter(id=queued.id,
+                           next_attempt=queued.next_attempt).update(next_attempt=next_attempt):
+                queued.next_attempt = next_attempt
+                claimed.append(queued)
+        return claimed
+
+
+class QueuedEmail(models.Model):
+    """
+    An outgoing email waiting for ``manage.py sendqueuedmail``, which
+    sends the queue in batches over one SMTP connection instead of one
+    connection per message during the request.
+    
+    """
+    subject = models.CharField(_('subject'), max_length=255)
+    message = models.TextField(_('message'))
+    from_email = models.CharField(_('from'), max_length=255)
+    recipients = models.TextField(_('recipients, one per line'))
+    queued = models.DateTimeField(_('queued'), auto_now_add=True)
+    next_attempt = models.DateTimeField(_('next attempt'), null=True,
+                                        db_index=True)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True)
+    
+    objects = QueuedEmailManager()
+    
+    class Meta:
+        verbose_name = _('queued email')
+        verbose_name_plural = _('queued email')
+    
+    def __unicode__(self):
+        return u"%s to %s" % (self.subject, self.recipients.replace('\n', ', '))
+    
+    def email_message(self):
+        from django.core.mail import EmailMessage
+        return EmailMessage(self.subject, self.message, self.from_email,
+                            self.recipients.splitlines())
+    
+    def defer(self, error):
+        """
+        Record a failed attempt and schedule the next one, or give up
+        after ``QUEUED_EMAIL_MAX_ATTEMPTS`` attempts.
+        
+        """
+        self.attempts += 1
+        self.last_error = repr(error)
+        if self.attempts >= getattr(settings, 'QUEUED_EMAIL_MAX_ATTEMPTS', 5):
+            self.next_attempt = None
+        else:
+            delay = getattr(settings, 'QUEUED_EMAIL_RETRY_DELAY', 60) * 2 ** (self.attempts - 1)
+            self.next_attempt = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+        self.save()
@@ -0,0 +1 @@
+CREATE INDEX registration_auth_user_active_joined ON auth_user (is_active, date_joined);
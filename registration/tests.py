@@ -19,8 +19,12 @@ getting django-registration running in the default setup, to wit:
 
 """
 
+import asyncore
 import datetime
 import sha
+import smtpd
+import socket
+import threading
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -30,7 +34,7 @@ from django.core.urlresolvers import reverse
 from django.test import TestCase
 
 from registration import forms
-from registration.models import RegistrationProfile
+from registration.models import RegistrationProfile, QueuedEmail
 
 
 class RegistrationTestCase(TestCase):
@@ -138,9 +142,38 @@ class RegistrationModelTests(RegistrationTestCase):
         correctly.
         
         """
-        management.call_command('cleanupregistration')
+        management.call_command('cleanupregistration', verbosity=0)
         self.assertEqual(RegistrationProfile.objects.count(), 1)
 
+    def test_chunked_expired_user_deletion(self):
+        """
+        Test that ``delete_expired_users()`` deletes in chunks,
+        reports progress, and with ``dry_run=True`` only counts.
+        
+        """
+        for name in ('carol', 'dave', 'eve'):
+            user = RegistrationProfile.objects.create_inactive_user(username=name,
+                                                                    password='secret',
+                                                                    email='%s@example.com' % name)
+            user.date_joined = self.expired_user.date_joined
+            user.save()
+        # An activated, then deactivated user has an expired key too.
+        RegistrationProfile.objects.activate_user(RegistrationProfile.objects.get(user=self.sample_user).activation_key)
+        User.objects.filter(pk=self.sample_user.pk).update(is_active=False)
+
+        progress = []
+        self.assertEqual(RegistrationProfile.objects.delete_expired_users(chunk_size=2, dry_run=True,
+                                                                          progress=progress.append), 5)
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertEqual(RegistrationProfile.objects.count(), 5)
+
+        progress = []
+        self.assertEqual(RegistrationProfile.objects.delete_expired_users(chunk_size=2,
+                                                                          progress=progress.append), 5)
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertEqual(RegistrationProfile.objects.count(), 0)
+        self.assertEqual(User.objects.count(), 0)
+
 
 class RegistrationFormTests(RegistrationTestCase):
     """
@@ -316,3 +349,128 @@ class RegistrationViewTests(RegistrationTestCase):
         response = self.client.get(reverse('registration_activate',
                                            kwargs={ 'activation_key': sha.new('foo').hexdigest() }))
         self.failIf(response.context['account'])
+
+
+class QueuedEmailTests(TestCase):
+    """
+    Tests for the outgoing email queue and ``manage.py
+    sendqueuedmail``, against the test outbox and against a local SMTP
+    stand-in.
+    
+    """
+    def setUp(self):
+        self.old_spool = getattr(settings, 'REGISTRATION_EMAIL_SPOOL', False)
+        settings.REGISTRATION_EMAIL_SPOOL = True
+
+    def tearDown(self):
+        settings.REGISTRATION_EMAIL_SPOOL = self.old_spool
+
+    def test_activation_email_queued(self):
+        """
+        Test that signup queues the activation email and the command
+        sends it.
+        
+        """
+        RegistrationProfile.objects.create_inactive_user(username='alice',
+                                                         password='secret',
+                                                         email='alice@example.com')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(QueuedEmail.objects.count(), 1)
+
+        management.call_command('sendqueuedmail', verbosity=0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['alice@example.com'])
+        self.assertEqual(QueuedEmail.objects.count(), 0)
+
+    def test_claim(self):
+        """
+        Test that an email claimed by one sender is not sent by
+        another.
+        
+        """
+        for name in ('alice', 'bob'):
+            QueuedEmail.objects.queue('Hello', 'Message', 'site@example.com',
+                                      ['%s@example.com' % name])
+        batch = list(QueuedEmail.objects.order_by('id'))
+
+        # Another sender, with rows of its own, takes the first email.
+        other_batch = list(QueuedEmail.objects.filter(id=batch[0].id))
+        self.assertEqual(QueuedEmail.objects.claim(other_batch), batch[:1])
+        self.assertEqual(QueuedEmail.objects.claim(batch), batch[1:])
+        QueuedEmail.objects.filter(id=batch[1].id).update(next_attempt=datetime.datetime.now())
+
+        self.assertEqual(QueuedEmail.objects.send_queued(), (1, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['bob@example.com']])
+        self.assertEqual(list(QueuedEmail.objects.all()), batch[:1])
+
+    def test_smtp_stand_in(self):
+        """
+        Test that queued email goes over one SMTP connection and that
+        refused messages are retried later, then given up.
+        
+        """
+        server = StandInSMTPServer(('127.0.0.1', 0), None)
+        thread = threading.Thread(target=asyncore.loop,
+                                  kwargs={'timeout': 0.05})
+        thread.start()
+        try:
+            for i in range(5):
+                QueuedEmail.objects.queue('Hello', 'Message %d' % i,
+                                          'site@example.com',
+                                          ['user%d@example.com' % i])
+            QueuedEmail.objects.queue('Hello', 'Refused', 'site@example.com',
+                                      ['refused@example.com'])
+            connection = mail.original_SMTPConnection(host='127.0.0.1',
+                                                      port=server.port)
+            self.assertEqual(QueuedEmail.objects.send_queued(2, connection), (5, 1))
+            self.assertEqual(server.connections, 1)
+            self.assertEqual(len(server.messages), 5)
+
+            queued = QueuedEmail.objects.get()
+            self.assertEqual(queued.attempts, 1)
+            self.failUnless(queued.next_attempt > datetime.datetime.now())
+            self.failUnless('550' in queued.last_error)
+
+            # Not due yet.
+            connection = mail.original_SMTPConnection(host='127.0.0.1',
+                                                      port=server.port)
+            self.assertEqual(QueuedEmail.objects.send_queued(2, connection), (0, 0))
+
+            for i in range(settings.QUEUED_EMAIL_MAX_ATTEMPTS - 1):
+                QueuedEmail.objects.update(next_attempt=datetime.datetime.now())
+                connection = mail.original_SMTPConnection(host='127.0.0.1',
+                                                          port=server.port)
+                QueuedEmail.objects.send_queued(2, connection)
+            queued = QueuedEmail.objects.get()
+            self.assertEqual(queued.attempts, settings.QUEUED_EMAIL_MAX_ATTEMPTS)
+            self.assertEqual(queued.next_attempt, None)
+        finally:
+            server.close()
+            thread.join(5)
+
+
+class StandInSMTPServer(smtpd.SMTPServer):
+    """
+    Local SMTP server which keeps messages in memory, counts
+    connections and refuses ``refused@example.com``.
+    
+    """
+    def __init__(self, localaddr, remoteaddr):
+        self.messages = []
+        self.connections = 0
+        asyncore.dispatcher.__init__(self)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(localaddr)
+        self.listen(5)
+        self.port = self.socket.getsockname()[1]
+
+    def handle_accept(self):
+        connection, address = self.accept()
+        self.connections += 1
+        smtpd.SMTPChannel(self, connection, address)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if 'refused@example.com' in rcpttos:
+            return '550 No such user'
+        self.messages.append((mailfrom, rcpttos, data))
@@ -24,12 +24,75 @@ PYTHONICA_THEME = 'pythonica'
 
 ACCOUNT_ACTIVATION_DAYS = 1
 
+# queue activation email for the sendqueuedmail command instead of sending
+# it during the registration request, attempts per message, first retry
+# delay and seconds a sender may hold a message before others may take it
+REGISTRATION_EMAIL_SPOOL = False
+QUEUED_EMAIL_MAX_ATTEMPTS = 5
+QUEUED_EMAIL_RETRY_DELAY = 60
+QUEUED_EMAIL_CLAIM_TIMEOUT = 600
+
 HASHTAG_REGEX = r'[a-zA-Z0-9_\.\-]+'
 USERNAME_REGEX = r'\w+'
 
+# newest notices of a followed user copied to the follower home timeline on
+# follow, older ones are not backfilled
+INBOX_FOLLOW_BACKFILL = 200
+
+# popular notices sidebar: size, cache timeout in seconds and favorites
+# half-life in hours (None disables time decay)
+POPULAR_NOTICES_COUNT = 10
+POPULAR_NOTICES_TIMEOUT = 300
+POPULAR_NOTICES_HALF_LIFE = None
+
+# write-behind buffers for tag, device and group counters and for trending
+# tags: max staleness in seconds, enforced by a timer thread (0 writes every
+# change at once), and max pending objects
+COUNTER_BUFFER_MAX_AGE = 5
+COUNTER_BUFFER_SIZE = 1000
+
+# trending tags: list size, cache timeout in seconds, window and use count
+# half-life in hours (None disables time decay), bucket size in seconds
+TRENDING_TAGS_COUNT = 10
+TRENDING_TAGS_TIMEOUT = 60
+TRENDING_TAGS_WINDOW = 24
+TRENDING_TAGS_HALF_LIFE = 6
+TRENDING_TAGS_BUCKET = 600
+
+# rendered notice list items cache timeout in seconds (0 disables)
+NOTICE_FRAGMENT_TIMEOUT = 3600
+
+# seconds a timeline ETag stays valid while nothing changes, bounds how old
+# "posted ... ago" texts of a page revalidated by a client may get
+CONDITIONAL_GET_MAX_AGE = 300
+
+# seconds index and profile pages are cached for anonymous visitors (0
+# disables), seconds one request may take to render a page for the others
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 60
+ANONYMOUS_PAGE_CACHE_LOCK_TIMEOUT = 10
+
+# names suggested by @user, #tag and !group autocomplete
+AUTOCOMPLETE_LIMIT = 10
+
+# run post-save work of notices through the job queue (requires runjobs
+# workers), job timeout, attempts and first retry delay in seconds
+# @note: autocomplete of running web processes misses tags that are new to
+#     them until restart when on
+JOB_QUEUE_ASYNC = False
+JOB_TIMEOUT = 300
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+
+# keep follow and block graph in process memory, single process setups only
+GRAPH_INDEX = False
+
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__),
     os.path.pardir))
 
+# notice text search backend and its local SQLite FTS5 index file
+SEARCH_BACKEND = 'core.search.SqliteFTSBackend'
+SEARCH_DATABASE = os.path.join(PROJECT_ROOT, 'search.db')
+
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
 
@@ -78,6 +141,18 @@ MEDIA_ROOT = os.path.join(PROJECT_ROOT, 'media')
 # Examples: "http://media.lawrence.com", "http://example.com/media/"
 MEDIA_URL = '/media/'
 
+# Absolute path to the directory buildassets writes fingerprinted media and
+# theme css to, and URL that serves it (with far-future expiry headers).
+STATIC_ROOT = os.path.join(PROJECT_ROOT, 'static')
+STATIC_URL = '/static/'
+
+# Leave media and static file bodies to the front-end server: 'X-Sendfile'
+# (apache, lighttpd) sends the file path, 'X-Accel-Redirect' (nginx) sends
+# the request path under MEDIA_ACCEL_REDIRECT_PREFIX, an internal location.
+# Empty streams files from python.
+MEDIA_SENDFILE_HEADER = ''
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected/'
+
 # URL prefix for admin media -- CSS, JavaScript and images. Make sure to use a
 # trailing slash.
 # Examples: "http://foo.com/media/", "/media/".
@@ -95,7 +170,8 @@ TEMPLATE_LOADERS = (
 
 MIDDLEWARE_CLASSES = (
     'django.middleware.common.CommonMiddleware',
-    'django.contrib.csrf.middleware.CsrfMiddleware',
+    'django.contrib.csrf.middleware.CsrfViewMiddleware',
+    'core.csrf.CsrfRewriteMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -132,6 +208,11 @@ TEMPLATE_CONTEXT_PROCESSORS = (
     'django.core.context_processors.media',
     # pythonica
     'core.context_processors.pythonica_context',
+    'core.context_processors.csrf',
 )
 
+# templates of pythonica render csrf tokens ({% load csrf %}{% csrf_token %}),
+# responses under these paths are rewritten to add them instead
+CSRF_REWRITE_PATHS = ('/admin/', '/accounts/password/',)
+
 AUTH_PROFILE_MODULE = 'core.UserInfo'
@@ -22,10 +22,12 @@ import os
 from django.conf import settings
 from django.conf.urls.defaults import *
 from django.contrib import admin
-from django.views.static import serve
 from django.views.generic.simple import direct_to_template
 
+from core.media import serve, FAR_FUTURE
+
 media_url = settings.MEDIA_URL.strip('/')
+static_url = settings.STATIC_URL.strip('/')
 
 
 admin.autodiscover()
@@ -43,7 +45,12 @@ urlpatterns = patterns('',
     # serve css
     (r'^(?P<template>css/.*)/$', direct_to_template, {'mimetype': 'text/css'}),
     
-    # @warning: not for production use, for testing purposes only
+    # streamed, or handed over to the front-end server by
+    # MEDIA_SENDFILE_HEADER
     (r'^%s/(?P<path>.*)$' % media_url, serve,
         {'document_root': settings.MEDIA_ROOT,}),
+    
+    # built by buildassets, names change with content
+    (r'^%s/(?P<path>.*)$' % static_url, serve,
+        {'document_root': settings.STATIC_ROOT, 'expires': FAR_FUTURE,}),
 )